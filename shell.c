@@ -8703,6 +8703,8 @@ struct ShellState {
   FILE *in;              /* Read commands from this stream */
   FILE *out;             /* Write results here */
   FILE *traceOut;        /* Output for sqlite3_trace() */
+  FILE *branchTraceOut;  /* Output for the branch operations trace */
+  unsigned mTraceType;   /* SQLITE_TRACE_* events requested by ".trace" */
   int nErr;              /* Number of errors seen */
   int mode;              /* An output mode setting */
   int modePrior;         /* Saved mode */
@@ -11102,6 +11104,9 @@ static const char *(azHelp[]) = {
   "       --async             Write to FILE without a journal and without fsync()",
   ".bail on|off             Stop after hitting an error.  Default OFF",
   ".binary on|off           Turn binary output on or off.  Default OFF",
+#ifndef SQLITE_OMIT_TRACE
+  ".branchtrace on|off|FILE Show the branch operations and commits as they run",
+#endif
   ".cd DIRECTORY            Change the working directory to DIRECTORY",
   ".changes on|off          Show number of rows changed by SQL",
   ".check GLOB              Fail if output since .testcase does not match",
@@ -11866,6 +11871,87 @@ static FILE *output_file_open(const char *zFile, int bTextMode){
 }
 
 #ifndef SQLITE_OMIT_TRACE
+/*
+** Returns the name of the branch operation done by the statement or 0
+** if it is not one. Only the statements that modify the branches are
+** reported, not the ones that just read them (PRAGMA branches...).
+*/
+static const char *branch_operation(const char *zSql){
+  static const struct {
+    const char *zPragma;
+    const char *zOperation;
+  } aOp[] = {
+    { "new_branch",       "create"   },
+    { "del_branch",       "delete"   },
+    { "rename_branch",    "rename"   },
+    { "branch_truncate",  "truncate" },
+    { "discard_commits",  "discard"  },
+    { "branch_merge",     "merge"    },
+  };
+  const char *z = zSql;
+  int n, i;
+  while( IsSpace(z[0]) ) z++;
+  if( sqlite3_strnicmp(z, "commit", 6)==0 && !isalnum((unsigned char)z[6]) ){
+    return "commit";
+  }
+  if( sqlite3_strnicmp(z, "end", 3)==0 && !isalnum((unsigned char)z[3]) ){
+    return "commit";
+  }
+  if( sqlite3_strnicmp(z, "pragma", 6)!=0 || !IsSpace(z[6]) ) return 0;
+  z += 6;
+  while( IsSpace(z[0]) ) z++;
+  for(n=0; isalnum((unsigned char)z[n]) || z[n]=='_'; n++){}
+  if( z[n]=='.' ){  /* schema name */
+    z += n+1;
+    for(n=0; isalnum((unsigned char)z[n]) || z[n]=='_'; n++){}
+  }
+  if( n==6 && sqlite3_strnicmp(z, "branch", 6)==0 ){
+    z += n;
+    while( IsSpace(z[0]) ) z++;
+    return z[0]=='=' ? "switch" : 0;
+  }
+  for(i=0; i<ArraySize(aOp); i++){
+    if( strlen30(aOp[i].zPragma)==n && sqlite3_strnicmp(z, aOp[i].zPragma, n)==0 ){
+      return aOp[i].zOperation;
+    }
+  }
+  return 0;
+}
+
+/*
+** Output for ".branchtrace". Called when a statement ends. Shows the
+** branch operations and the commits with their duration. For commits
+** it also shows the number of pages written, each one becoming a new
+** page version on the current branch.
+*/
+static void branch_trace_event(
+  ShellState *p,
+  sqlite3_stmt *pStmt,
+  sqlite3_int64 nNanosec
+){
+  const char *zSql = sqlite3_sql(pStmt);
+  const char *zOp;
+  int nPage = 0, iHiwtr = 0;
+  int nSql;
+  if( zSql==0 ) return;
+  zOp = branch_operation(zSql);
+  if( zOp==0 && !sqlite3_stmt_readonly(pStmt) && sqlite3_get_autocommit(p->db) ){
+    zOp = "commit";  /* a statement run in autocommit mode */
+  }
+  if( zOp==0 ) return;
+  /* the pages written since the previous event */
+  sqlite3_db_status(p->db, SQLITE_DBSTATUS_CACHE_WRITE, &nPage, &iHiwtr, 1);
+  if( strcmp(zOp, "commit")==0 ){
+    utf8_printf(p->branchTraceOut, "-- branch commit: %d pages, %lld ns\n",
+                nPage, nNanosec);
+  }else{
+    nSql = strlen30(zSql);
+    while( nSql>0 && (zSql[nSql-1]==';' || IsSpace(zSql[nSql-1])) ){ nSql--; }
+    utf8_printf(p->branchTraceOut, "-- branch %s: %.*s; -- %lld ns\n",
+                zOp, nSql, zSql, nNanosec);
+  }
+}
+
 /*
 ** A routine for handling output from sqlite3_trace().
 */
@@ -11879,7 +11965,10 @@ static int sql_trace_callback(
   sqlite3_stmt *pStmt;
   const char *zSql;
   int nSql;
-  if( p->traceOut==0 ) return 0;
+  if( mType==SQLITE_TRACE_PROFILE && p->branchTraceOut ){
+    branch_trace_event(p, (sqlite3_stmt*)pP, *(sqlite3_int64*)pX);
+  }
+  if( p->traceOut==0 || (p->mTraceType & mType)==0 ) return 0;
   if( mType==SQLITE_TRACE_CLOSE ){
     utf8_printf(p->traceOut, "-- closing database connection\n");
     return 0;
@@ -11922,6 +12011,21 @@ static int sql_trace_callback(
   }
   return 0;
 }
+
+/*
+** Registers the trace callback for the events requested by ".trace"
+** and ".branchtrace"
+*/
+static void shell_update_trace(ShellState *p){
+  unsigned mType = 0;
+  if( p->traceOut ) mType |= p->mTraceType;
+  if( p->branchTraceOut ) mType |= SQLITE_TRACE_PROFILE;
+  if( mType==0 ){
+    sqlite3_trace_v2(p->db, 0, 0, 0);
+  }else{
+    sqlite3_trace_v2(p->db, mType, sql_trace_callback, p);
+  }
+}
 #endif
 
 /*
@@ -13785,6 +13889,29 @@ static int do_meta_command(char *zLine, ShellState *p){
     }
   }else
 
+#ifndef SQLITE_OMIT_TRACE
+  if( c=='b' && n>=3 && strncmp(azArg[0], "branchtrace", n)==0 ){
+    if( nArg!=2 ){
+      raw_printf(stderr, "Usage: .branchtrace on|off|FILE\n");
+      rc = 1;
+      goto meta_command_exit;
+    }
+    open_db(p, 0);
+    output_file_close(p->branchTraceOut);
+    if( strcmp(azArg[1], "on")==0 ){
+      p->branchTraceOut = stdout;
+    }else{
+      p->branchTraceOut = output_file_open(azArg[1], 0);
+    }
+    /* count the pages written from now on */
+    if( p->branchTraceOut ){
+      int iCur = 0, iHiwtr = 0;
+      sqlite3_db_status(p->db, SQLITE_DBSTATUS_CACHE_WRITE, &iCur, &iHiwtr, 1);
+    }
+    shell_update_trace(p);
+  }else
+#endif /* !defined(SQLITE_OMIT_TRACE) */
+
   /* The undocumented ".breakpoint" command causes a call to the no-op
   ** routine named test_breakpoint().
   */
@@ -15855,12 +15982,9 @@ static int do_meta_command(char *zLine, ShellState *p){
         p->traceOut = output_file_open(azArg[1], 0);
       }
     }
-    if( p->traceOut==0 ){
-      sqlite3_trace_v2(p->db, 0, 0, 0);
-    }else{
-      if( mType==0 ) mType = SQLITE_TRACE_STMT;
-      sqlite3_trace_v2(p->db, mType, sql_trace_callback, p);
-    }
+    if( mType==0 ) mType = SQLITE_TRACE_STMT;
+    p->mTraceType = mType;
+    shell_update_trace(p);
   }else
 #endif /* !defined(SQLITE_OMIT_TRACE) */
 
@@ -0,0 +1,411 @@
+#
+# Benchmark suite for the branch operations
+#
+# Each scenario runs on a new db file and reports the latencies with
+# percentiles, in seconds. The result is printed as JSON so it can be
+# stored and compared between versions:
+#
+#   python benchmark-suite.py --output result.json
+#   python benchmark-suite.py --commits 1000 ancestry_depth history_reads
+#
+# Copyright defined in LICENSE.txt
+#
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import threading
+import timeit
+
+if platform.system() == "Darwin":
+    import pysqlite2.dbapi2 as sqlite3
+else:
+    import sqlite3
+
+sqlite_version = "3.27.2"
+
+if sqlite3.sqlite_version != sqlite_version:
+    print "wrong SQLite version. expected: " + sqlite_version + " found: " + sqlite3.sqlite_version
+    quit()
+
+timer = timeit.default_timer
+
+
+def delete_file(filepath):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+def delete_files(filepath):
+    delete_file(filepath)
+    delete_file(filepath + "-journal")
+    delete_file(filepath + "-wal")
+    delete_file(filepath + "-shm")
+    delete_file(filepath + "-lock")
+
+
+def percentile(values, p):
+    """ nearest-rank percentile of a sorted list """
+    if len(values) == 0:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def summary(samples):
+    values = sorted(samples)
+    if len(values) == 0:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'total': sum(values),
+        'mean': sum(values) / len(values),
+        'min': values[0],
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+def connect(filename):
+    return sqlite3.connect('file:' + filename + '?branches=on', isolation_level=None,
+                           check_same_thread=False, timeout=60)
+
+
+def head_commit(c, branch):
+    c.execute("pragma branch_info(" + branch + ")")
+    return json.loads(c.fetchone()[0])["total_commits"]
+
+
+def write_commit(c, rnd, params, table="t1"):
+    """ one transaction that updates some rows and inserts new ones.
+        returns the time taken by the commit """
+    c.execute("begin")
+    for n in range(params.updates):
+        c.execute("update " + table + " set value = ? where rowid = ?",
+                  (random_value(rnd, params.row_size), rnd.randint(1, params.rows)))
+    for n in range(params.inserts):
+        c.execute("insert into " + table + " (value) values (?)", (random_value(rnd, params.row_size),))
+    start = timer()
+    c.execute("commit")
+    return timer() - start
+
+
+def random_value(rnd, size):
+    return "%0*x" % (size, rnd.getrandbits(size * 4))
+
+
+def create_master(filename, rnd, params, commits=0):
+    """ creates the db with the t1 table filled with params.rows rows,
+        followed by the given number of commits """
+    delete_files(filename)
+    conn = connect(filename)
+    c = conn.cursor()
+    c.execute("create table t1 (value)")
+    c.execute("begin")
+    for n in range(params.rows):
+        c.execute("insert into t1 (value) values (?)", (random_value(rnd, params.row_size),))
+    c.execute("commit")
+    for n in range(commits):
+        write_commit(c, rnd, params)
+    return conn
+
+
+
+def bench_branch_creation(params, filename):
+    """ the cost of creating a branch as the history of master grows """
+
+    rnd = random.Random(params.seed)
+    conn = create_master(filename, rnd, params)
+    c = conn.cursor()
+
+    samples = []
+    by_history = []
+    for n in range(params.commits):
+        write_commit(c, rnd, params)
+        if (n + 1) % params.branch_every != 0:
+            continue
+        head = head_commit(c, "master")
+        start = timer()
+        c.execute("pragma new_branch=b" + str(n) + " at master." + str(head))
+        elapsed = timer() - start
+        c.execute("pragma branch=master")
+        samples.append(elapsed)
+        by_history.append({'commits': head, 'seconds': elapsed})
+
+    conn.close()
+    return {'latency': summary(samples), 'by_history': by_history}
+
+
+def bench_ancestry_depth(params, filename):
+    """ reads on branches with a growing number of ancestors. each branch
+        is created from the head of the previous one and modifies some rows """
+
+    rnd = random.Random(params.seed)
+    conn = create_master(filename, rnd, params, commits=1)
+    c = conn.cursor()
+
+    names = ["master"]
+    for depth in range(1, params.depth + 1):
+        source = names[-1]
+        name = "d" + str(depth)
+        c.execute("pragma new_branch=" + name + " at " + source + "." + str(head_commit(c, source)))
+        write_commit(c, rnd, params)
+        names.append(name)
+    conn.close()
+
+    result = []
+    for depth, name in enumerate(names):
+        conn = connect(filename)
+        c = conn.cursor()
+        c.execute("pragma branch=" + name)
+
+        # the first scan reads all the pages from the storage
+        start = timer()
+        c.execute("select count(*), sum(length(value)) from t1")
+        c.fetchall()
+        cold_scan = timer() - start
+
+        samples = []
+        for n in range(params.reads):
+            rowid = rnd.randint(1, params.rows)
+            start = timer()
+            c.execute("select value from t1 where rowid = ?", (rowid,))
+            c.fetchall()
+            samples.append(timer() - start)
+
+        conn.close()
+        result.append({'depth': depth, 'cold_scan': cold_scan, 'point_reads': summary(samples)})
+
+    return {'by_depth': result}
+
+
+def bench_concurrent_writers(params, filename):
+    """ many connections writing at the same time, each one on its own branch """
+
+    rnd = random.Random(params.seed)
+    conn = create_master(filename, rnd, params)
+    c = conn.cursor()
+    head = head_commit(c, "master")
+    for n in range(params.writers):
+        c.execute("pragma new_branch=w" + str(n) + " at master." + str(head))
+    conn.close()
+
+    commits_per_writer = max(1, params.commits // params.writers)
+    latencies = [[] for n in range(params.writers)]
+    errors = []
+
+    def writer(n):
+        try:
+            wrnd = random.Random(params.seed + n + 1)
+            wconn = connect(filename)
+            wc = wconn.cursor()
+            wc.execute("pragma branch=w" + str(n))
+            for i in range(commits_per_writer):
+                start = timer()
+                write_commit(wc, wrnd, params)
+                latencies[n].append(timer() - start)
+            wconn.close()
+        except Exception as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(params.writers)]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer() - start
+
+    if errors:
+        raise Exception("writer failed: " + errors[0])
+
+    samples = [value for values in latencies for value in values]
+    return {
+        'writers': params.writers,
+        'commits': len(samples),
+        'seconds': elapsed,
+        'commits_per_second': len(samples) / elapsed,
+        'transaction_latency': summary(samples),
+    }
+
+
+def bench_history_reads(params, filename):
+    """ reads on old commits of master, at growing distances from the head """
+
+    rnd = random.Random(params.seed)
+    conn = create_master(filename, rnd, params, commits=params.commits)
+    c = conn.cursor()
+    head = head_commit(c, "master")
+
+    distances = [0]
+    distance = 1
+    while distance < head:
+        distances.append(distance)
+        distance *= 4
+
+    result = []
+    for distance in distances:
+        commit = head - distance
+        c.execute("pragma branch=master." + str(commit))
+        start = timer()
+        c.execute("select count(*), sum(length(value)) from t1")
+        c.fetchall()
+        cold_scan = timer() - start
+        samples = []
+        for n in range(params.reads):
+            rowid = rnd.randint(1, params.rows)
+            start = timer()
+            c.execute("select value from t1 where rowid = ?", (rowid,))
+            c.fetchall()
+            samples.append(timer() - start)
+        result.append({'distance': distance, 'commit': commit, 'cold_scan': cold_scan,
+                       'point_reads': summary(samples)})
+
+    conn.close()
+    return {'head': head, 'by_distance': result}
+
+
+def bench_maintenance(params, filename):
+    """ the cost of discarding, merging, truncating and deleting branches with many commits """
+
+    rnd = random.Random(params.seed)
+    conn = create_master(filename, rnd, params)
+    c = conn.cursor()
+    head = head_commit(c, "master")
+
+    num_branches = max(1, params.commits // params.branch_every)
+    for n in range(num_branches):
+        c.execute("pragma new_branch=m" + str(n) + " at master." + str(head))
+        for i in range(params.branch_every):
+            write_commit(c, rnd, params)
+
+    discard = []
+    merge = []
+    truncate = []
+    delete = []
+    for n in range(num_branches):
+        name = "m" + str(n)
+        c.execute("pragma branch=master")
+        # discard the first quarter of the commits of the branch
+        start = timer()
+        c.execute("pragma discard_commits " + name + "." + str(head + 1) + "-" +
+                  str(head + max(1, params.branch_every // 4)))
+        discard.append(timer() - start)
+        # move the commits of a child branch to the branch
+        last = head_commit(c, name)
+        child = "f" + str(n)
+        c.execute("pragma new_branch=" + child + " at " + name + "." + str(last))
+        num_commits = max(1, params.branch_every // 2)
+        for i in range(num_commits):
+            write_commit(c, rnd, params)
+        c.execute("pragma branch=master")
+        start = timer()
+        c.execute("pragma branch_merge --forward " + name + " " + child + " " + str(num_commits))
+        merge.append(timer() - start)
+        c.execute("pragma del_branch(" + child + ")")
+        # remove the second half of the commits of the branch
+        last = head_commit(c, name)
+        start = timer()
+        c.execute("pragma branch_truncate(" + name + "." + str(last - params.branch_every // 2) + ")")
+        truncate.append(timer() - start)
+        start = timer()
+        c.execute("pragma del_branch(" + name + ")")
+        delete.append(timer() - start)
+
+    conn.close()
+    return {'discard': summary(discard), 'merge': summary(merge),
+            'truncate': summary(truncate), 'delete': summary(delete)}
+
+
+def bench_file_growth(params, filename):
+    """ the growth of the db file for each commit """
+
+    rnd = random.Random(params.seed)
+    conn = create_master(filename, rnd, params)
+    c = conn.cursor()
+
+    initial = os.path.getsize(filename)
+    size = initial
+    growth = []
+    for n in range(params.commits):
+        write_commit(c, rnd, params)
+        new_size = os.path.getsize(filename)
+        growth.append(float(new_size - size))
+        size = new_size
+
+    conn.close()
+    return {
+        'initial_bytes': initial,
+        'final_bytes': size,
+        'commits': params.commits,
+        'bytes_per_commit': summary(growth),
+    }
+
+
+scenarios = [
+    ('branch_creation', bench_branch_creation),
+    ('ancestry_depth', bench_ancestry_depth),
+    ('concurrent_writers', bench_concurrent_writers),
+    ('history_reads', bench_history_reads),
+    ('maintenance', bench_maintenance),
+    ('file_growth', bench_file_growth),
+]
+
+
+def run(params, names=None):
+    results = {}
+    for name, function in scenarios:
+        if names and name not in names:
+            continue
+        filename = "bench-" + name + ".db"
+        try:
+            start = timer()
+            results[name] = function(params, filename)
+            results[name]['elapsed'] = timer() - start
+        finally:
+            delete_files(filename)
+    return {
+        'sqlite_version': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'params': vars(params),
+        'results': results,
+    }
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='LiteTree benchmark suite')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (default: all): ' +
+                        ', '.join(name for name, function in scenarios))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=10000, help='rows on the table')
+    parser.add_argument('--row-size', type=int, default=100, help='bytes per row')
+    parser.add_argument('--updates', type=int, default=20, help='rows updated per commit')
+    parser.add_argument('--inserts', type=int, default=5, help='rows inserted per commit')
+    parser.add_argument('--commits', type=int, default=200, help='commits per scenario')
+    parser.add_argument('--branch-every', type=int, default=10, help='commits between new branches')
+    parser.add_argument('--depth', type=int, default=16, help='max ancestry depth')
+    parser.add_argument('--writers', type=int, default=4, help='concurrent writers')
+    parser.add_argument('--reads', type=int, default=1000, help='point reads per measure')
+    parser.add_argument('--output', help='JSON output file (default: stdout)')
+    args = parser.parse_args()
+
+    for name in args.scenarios:
+        if name not in dict(scenarios):
+            parser.error('unknown scenario: ' + name)
+
+    names = args.scenarios
+    output = args.output
+    del args.scenarios
+    del args.output
+
+    result = json.dumps(run(args, names), indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(result + '\n')
+    else:
+        print(result)
@@ -0,0 +1,215 @@
+#
+# Workload generator that replays the branch pattern of a blockchain node
+#
+#  - a long master, one commit per block
+#  - short-lived speculative branches created at the head of master to
+#    execute the proposed blocks. they are deleted after use. the accepted
+#    blocks are then executed again on master, otherwise a new block is
+#    executed on master
+#  - rare long-lived forks that grow alongside master, are rewound with
+#    branch_truncate on reorgs and deleted when they die
+#  - a read-mostly API tier reading the head of master on a separate
+#    connection
+#
+# The operations are generated from a fixed seed, so the same options
+# always replay the same workload. The throughput and the latency
+# percentiles of each operation are printed as JSON:
+#
+#   python blockchain-workload.py --blocks 1000 --seed 7 --output run.json
+#
+# Copyright defined in LICENSE.txt
+#
+import argparse
+import json
+import random
+
+bench = __import__('benchmark-suite')
+timer = bench.timer
+
+
+class Workload(object):
+
+    def __init__(self, params, filename):
+        self.params = params
+        self.filename = filename
+        self.rnd = random.Random(params.seed)
+        self.latencies = {}
+        self.forks = {}     # name -> blocks left to live
+        self.height = 0
+
+    def branch_info(self, name):
+        self.c.execute("pragma branch_info(" + name + ")")
+        return json.loads(self.c.fetchone()[0])
+
+    def timed(self, operation, sql, args=()):
+        start = timer()
+        self.c.execute(sql, args)
+        self.latencies.setdefault(operation, []).append(timer() - start)
+
+    def new_block(self):
+        """ returns a block with params.txs transfers (amount, sender, receiver) """
+        params = self.params
+        rnd = self.rnd
+        transfers = [(rnd.randint(1, 100), rnd.randint(1, params.accounts), rnd.randint(1, params.accounts))
+                     for n in range(params.txs)]
+        return ("%016x" % rnd.getrandbits(64), transfers)
+
+    def execute_block(self, operation, block):
+        """ runs the block on the current branch """
+        hash, transfers = block
+        start = timer()
+        self.c.execute("begin")
+        for amount, sender, receiver in transfers:
+            self.c.execute("update accounts set balance = balance - ? where id = ?", (amount, sender))
+            self.c.execute("update accounts set balance = balance + ? where id = ?", (amount, receiver))
+        self.c.execute("insert into blocks (hash, txs) values (?, ?)", (hash, len(transfers)))
+        self.c.execute("commit")
+        self.latencies.setdefault(operation, []).append(timer() - start)
+
+    def api_reads(self):
+        params = self.params
+        rnd = self.rnd
+        for n in range(params.reads):
+            start = timer()
+            if rnd.random() < 0.9:
+                self.r.execute("select balance from accounts where id = ?", (rnd.randint(1, params.accounts),))
+            else:
+                self.r.execute("select * from blocks order by height desc limit 10")
+            self.r.fetchall()
+            self.latencies.setdefault('api_read', []).append(timer() - start)
+
+    def speculative(self):
+        """ executes the proposed blocks on a branch created at the head of master.
+            returns them if they were accepted """
+        params = self.params
+        name = "s" + str(self.height)
+        head = self.branch_info("master")["total_commits"]
+        self.timed('speculative_create', "pragma new_branch=" + name + " at master." + str(head))
+        blocks = [self.new_block() for n in range(self.rnd.randint(1, params.speculative_blocks))]
+        for block in blocks:
+            self.execute_block('speculative_block', block)
+        accepted = self.rnd.random() < params.accept_rate
+        self.timed('switch', "pragma branch=master")
+        self.timed('speculative_delete', "pragma del_branch(" + name + ")")
+        if accepted:
+            return blocks
+        return []
+
+    def advance_forks(self):
+        params = self.params
+        for name in sorted(self.forks):
+            self.forks[name] -= 1
+            if self.forks[name] <= 0:
+                self.timed('fork_delete', "pragma del_branch(" + name + ")")
+                del self.forks[name]
+                continue
+            self.timed('switch', "pragma branch=" + name)
+            # reorg: rewind the fork a few blocks and build on it again
+            if self.rnd.random() < params.reorg_rate:
+                info = self.branch_info(name)
+                last = info["total_commits"]
+                target = max(info["source_commit"] + 1, last - self.rnd.randint(1, params.reorg_depth))
+                if target < last:
+                    self.timed('switch', "pragma branch=master")
+                    self.timed('fork_truncate', "pragma branch_truncate(" + name + "." + str(target) + ")")
+                    self.timed('switch', "pragma branch=" + name)
+            self.execute_block('fork_block', self.new_block())
+        self.timed('switch', "pragma branch=master")
+
+    def run(self):
+        params = self.params
+        rnd = self.rnd
+        bench.delete_files(self.filename)
+        conn = bench.connect(self.filename)
+        self.c = conn.cursor()
+
+        self.c.execute("create table accounts (id integer primary key, balance integer)")
+        self.c.execute("create table blocks (height integer primary key, hash text, txs integer)")
+        self.c.execute("begin")
+        for n in range(params.accounts):
+            self.c.execute("insert into accounts (balance) values (?)", (1000000,))
+        self.c.execute("commit")
+
+        reader = bench.connect(self.filename)
+        self.r = reader.cursor()
+        self.r.execute("pragma branch=master")
+
+        start = timer()
+        accepted = 0
+        for self.height in range(1, params.blocks + 1):
+            blocks = []
+            if rnd.random() < params.speculative_rate:
+                blocks = self.speculative()
+            if blocks:
+                # the accepted blocks are executed again on master
+                for block in blocks:
+                    self.execute_block('accepted_block', block)
+                accepted += len(blocks)
+            else:
+                self.execute_block('master_block', self.new_block())
+            if rnd.random() < params.fork_rate:
+                name = "f" + str(self.height)
+                head = self.branch_info("master")["total_commits"]
+                self.timed('fork_create', "pragma new_branch=" + name + " at master." + str(head))
+                self.timed('switch', "pragma branch=master")
+                self.forks[name] = rnd.randint(params.fork_length // 2, params.fork_length)
+            if self.forks:
+                self.advance_forks()
+            self.api_reads()
+        elapsed = timer() - start
+
+        reader.close()
+        conn.close()
+
+        return {
+            'sqlite_version': bench.sqlite3.sqlite_version,
+            'params': vars(params),
+            'seconds': elapsed,
+            'blocks_per_second': params.blocks / elapsed,
+            'accepted_speculative_blocks': accepted,
+            'operations': dict((name, dict(bench.summary(values), per_second=len(values) / elapsed))
+                               for name, values in self.latencies.items()),
+        }
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='LiteTree blockchain workload generator')
+    parser.add_argument('--file', default='workload.db', help='db file (it is recreated)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--blocks', type=int, default=500, help='blocks on master')
+    parser.add_argument('--accounts', type=int, default=10000)
+    parser.add_argument('--txs', type=int, default=50, help='transactions per block')
+    parser.add_argument('--reads', type=int, default=100, help='API reads per block')
+    parser.add_argument('--speculative-rate', type=float, default=0.8,
+                        help='probability of a speculative branch before each block')
+    parser.add_argument('--speculative-blocks', type=int, default=2, help='max blocks on a speculative branch')
+    parser.add_argument('--accept-rate', type=float, default=0.9, help='probability of the speculative blocks being accepted')
+    parser.add_argument('--fork-rate', type=float, default=0.02, help='probability of a long-lived fork per block')
+    parser.add_argument('--fork-length', type=int, default=100, help='max blocks a fork lives')
+    parser.add_argument('--reorg-rate', type=float, default=0.05, help='probability of a reorg per fork block')
+    parser.add_argument('--reorg-depth', type=int, default=5, help='max blocks rewound on a reorg')
+    parser.add_argument('--keep', action='store_true', help='keep the db file')
+    parser.add_argument('--output', help='JSON output file (default: stdout)')
+    args = parser.parse_args()
+
+    filename = args.file
+    output = args.output
+    keep = args.keep
+    del args.file
+    del args.output
+    del args.keep
+
+    try:
+        result = Workload(args, filename).run()
+    finally:
+        if not keep:
+            bench.delete_files(filename)
+
+    result = json.dumps(result, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(result + '\n')
+    else:
+        print(result)
@@ -0,0 +1,50 @@
+#
+# Shows the storage statistics of the branches of a LiteTree db
+#
+# Copyright defined in LICENSE.txt
+#
+import sys
+import json
+import litetree
+
+
+def get_stats(filename, names=None, pages=False):
+    """ returns a dict {branch_name: stats}. with pages=True the distinct
+        pages of each branch are counted too, reading the keys """
+
+    result = {}
+    with litetree.LiteTreeFile(filename) as db:
+        if names is None:
+            names = [branch.name for branch in db.branches()]
+        for name in names:
+            stats = db.stats(name, pages)
+            branch = db.branch(name)
+            if branch.source_branch > 0:
+                stats['source_branch'] = db.catalog[branch.source_branch].name
+                stats['source_commit'] = branch.source_commit
+            stats['total_commits'] = branch.last_commit
+            result[name] = stats
+    return result
+
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    dedup = '--dedup' in args
+    pages = '--pages' in args
+    args = [arg for arg in args if arg not in ('--dedup', '--pages')]
+
+    if len(args) < 1:
+        print('usage: python ' + sys.argv[0] + ' <db_file> [--pages] [--dedup] [<branch>...]')
+        quit()
+
+    names = args[1:] or None
+
+    for name, stats in sorted(get_stats(args[0], names, pages).items()):
+        print(name + ' ' + json.dumps(stats, sort_keys=True))
+
+    # the space that would be saved by storing each page content once
+    if dedup:
+        with litetree.LiteTreeFile(args[0]) as db:
+            print('dedup ' + json.dumps(db.content_stats(), sort_keys=True))
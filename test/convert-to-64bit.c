@@ -0,0 +1,291 @@
+/*
+** Converts a LiteTree db file from the format with 32-bit commit ids
+** to the current format, with 64-bit commit ids stored as varints.
+**
+** Each sub-db is read with a cursor and written in key order using
+** MDB_APPEND, in large write transactions. The catalog is written at
+** the end, so if the conversion is interrupted it can be resumed by
+** running the same command again: each sub-db continues after the last
+** key already written on the new file.
+**
+** Build it with: make convert-to-64bit
+** Usage: convert-to-64bit <db_file>
+**
+** Copyright defined in LICENSE.txt
+*/
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <lmdb.h>
+#include "varint.c"
+
+/* number of entries written on each write transaction */
+#define BATCH_SIZE   50000
+
+typedef struct Converter Converter;
+struct Converter {
+  MDB_env *srcEnv;        /* the db in the old format */
+  MDB_env *dstEnv;        /* the converted db */
+  MDB_txn *srcTxn;        /* read transaction used for the whole conversion */
+  MDB_txn *dstTxn;        /* current write transaction */
+  int nPending;           /* entries written on the current write transaction */
+};
+
+#define CHECK(X)  do{ rc = (X); if( rc!=MDB_SUCCESS ){ \
+    fprintf(stderr, "\nerror at line %d: %s\n", __LINE__, mdb_strerror(rc)); \
+    goto end; } }while(0)
+
+static uint32_t getBigEndian32(const unsigned char *z){
+  return ((uint32_t)z[0]<<24) | ((uint32_t)z[1]<<16) | ((uint32_t)z[2]<<8) | z[3];
+}
+
+static void putBigEndian32(unsigned char *z, uint32_t x){
+  z[0] = (unsigned char)(x>>24);
+  z[1] = (unsigned char)(x>>16);
+  z[2] = (unsigned char)(x>>8);
+  z[3] = (unsigned char)x;
+}
+
+/*
+** Commits the current write transaction and starts a new one
+*/
+static int commitBatch(Converter *p){
+  int rc = mdb_txn_commit(p->dstTxn);
+  p->dstTxn = 0;
+  p->nPending = 0;
+  if( rc==MDB_SUCCESS ){
+    rc = mdb_txn_begin(p->dstEnv, NULL, 0, &p->dstTxn);
+  }
+  return rc;
+}
+
+/*
+** Reads a native int from the catalog of the old db
+*/
+static int getCatalogInt(Converter *p, MDB_dbi dbi, const char *zKey, int *pValue){
+  MDB_val key, data;
+  int rc;
+  key.mv_data = (void*)zKey;
+  key.mv_size = strlen(zKey);
+  rc = mdb_get(p->srcTxn, dbi, &key, &data);
+  if( rc==MDB_SUCCESS ){
+    if( data.mv_size!=sizeof(int) ) return MDB_CORRUPTED;
+    memcpy(pValue, data.mv_data, sizeof(int));
+  }
+  return rc;
+}
+
+/*
+** Converts the catalog value from a native int to a varint
+*/
+static int convertCatalogInt(Converter *p, MDB_dbi srcDbi, MDB_dbi dstDbi, const char *zKey){
+  unsigned char buf[9];
+  MDB_val key, data;
+  int value, rc;
+  rc = getCatalogInt(p, srcDbi, zKey, &value);
+  if( rc!=MDB_SUCCESS ) return rc;
+  key.mv_data = (void*)zKey;
+  key.mv_size = strlen(zKey);
+  data.mv_data = buf;
+  data.mv_size = putVarint64(buf, (uint64_t)value);
+  return mdb_put(p->dstTxn, dstDbi, &key, &data, 0);
+}
+
+/*
+** Copies the entries of a b<id>-pages or b<id>-maxpage sub-db, converting
+** the keys. It continues after the last key present on the new sub-db.
+*/
+static int convertSubDb(Converter *p, int branch_id, int isPages){
+  char zName[32];
+  unsigned char buf[18];
+  MDB_dbi srcDbi, dstDbi;
+  MDB_cursor *srcCursor = 0, *dstCursor = 0;
+  MDB_val key, data;
+  MDB_stat stat;
+  MDB_cursor_op op = MDB_FIRST;
+  size_t nDone = 0;
+  int rc;
+
+  sprintf(zName, "b%d-%s", branch_id, isPages ? "pages" : "maxpage");
+
+  rc = mdb_dbi_open(p->srcTxn, zName, isPages ? 0 : MDB_INTEGERKEY, &srcDbi);
+  if( rc==MDB_NOTFOUND ) return MDB_SUCCESS;  /* branch without commits */
+  if( rc!=MDB_SUCCESS ) return rc;
+  rc = mdb_stat(p->srcTxn, srcDbi, &stat);
+  if( rc!=MDB_SUCCESS ) return rc;
+
+  rc = mdb_dbi_open(p->dstTxn, zName, MDB_CREATE, &dstDbi);
+  if( rc!=MDB_SUCCESS ) return rc;
+  rc = mdb_cursor_open(p->srcTxn, srcDbi, &srcCursor);
+  if( rc!=MDB_SUCCESS ) return rc;
+
+  /* resume after the last converted key, if any */
+  rc = mdb_cursor_open(p->dstTxn, dstDbi, &dstCursor);
+  if( rc!=MDB_SUCCESS ) goto end;
+  rc = mdb_cursor_get(dstCursor, &key, &data, MDB_LAST);
+  mdb_cursor_close(dstCursor);
+  if( rc==MDB_SUCCESS ){
+    MDB_stat dstStat;
+    uint64_t pgno, commit;
+    unsigned char *z = key.mv_data;
+    int n = getVarint64(z, key.mv_size, isPages ? &pgno : &commit);
+    if( n==0 ){ rc = MDB_CORRUPTED; goto end; }
+    if( isPages ){
+      if( getVarint64(z+n, key.mv_size-n, &commit)==0 ){ rc = MDB_CORRUPTED; goto end; }
+      putBigEndian32(buf, (uint32_t)pgno);
+      putBigEndian32(buf+4, (uint32_t)commit);
+      key.mv_data = buf;
+      key.mv_size = 8;
+    }else{
+      int value = (int)commit;
+      memcpy(buf, &value, sizeof(int));
+      key.mv_data = buf;
+      key.mv_size = sizeof(int);
+    }
+    rc = mdb_cursor_get(srcCursor, &key, &data, MDB_SET);
+    if( rc!=MDB_SUCCESS ) goto end;
+    op = MDB_NEXT;
+    rc = mdb_stat(p->dstTxn, dstDbi, &dstStat);
+    if( rc!=MDB_SUCCESS ) goto end;
+    nDone = dstStat.ms_entries;
+  }else if( rc!=MDB_NOTFOUND ){
+    goto end;
+  }
+
+  while( (rc = mdb_cursor_get(srcCursor, &key, &data, op))==MDB_SUCCESS ){
+    unsigned char *z = key.mv_data;
+    MDB_val newKey;
+    op = MDB_NEXT;
+    if( isPages ){
+      int n;
+      if( key.mv_size!=8 ){ rc = MDB_CORRUPTED; goto end; }
+      n = putVarint64(buf, getBigEndian32(z));
+      n += putVarint64(buf+n, getBigEndian32(z+4));
+      newKey.mv_size = n;
+    }else{
+      int commit;
+      if( key.mv_size!=sizeof(int) ){ rc = MDB_CORRUPTED; goto end; }
+      memcpy(&commit, z, sizeof(int));
+      newKey.mv_size = putVarint64(buf, (uint64_t)commit);
+    }
+    newKey.mv_data = buf;
+    rc = mdb_put(p->dstTxn, dstDbi, &newKey, &data, MDB_APPEND);
+    if( rc!=MDB_SUCCESS ) goto end;
+    if( ++p->nPending>=BATCH_SIZE ){
+      rc = commitBatch(p);
+      if( rc!=MDB_SUCCESS ) goto end;
+    }
+    nDone++;
+    if( (nDone % 10000)==0 || nDone==stat.ms_entries ){
+      printf("\r  %s: %zu of %zu entries", zName, nDone, stat.ms_entries);
+      fflush(stdout);
+    }
+  }
+  if( rc==MDB_NOTFOUND ) rc = MDB_SUCCESS;
+  printf("\r  %s: %zu entries  done\n", zName, stat.ms_entries);
+
+end:
+  mdb_cursor_close(srcCursor);
+  return rc;
+}
+
+static int convertDb(Converter *p){
+  MDB_dbi srcMain, dstMain;
+  MDB_val key, data;
+  char zKey[64];
+  int num_branches, branch_id;
+  int rc;
+
+  CHECK( mdb_txn_begin(p->srcEnv, NULL, MDB_RDONLY, &p->srcTxn) );
+  CHECK( mdb_txn_begin(p->dstEnv, NULL, 0, &p->dstTxn) );
+  CHECK( mdb_dbi_open(p->srcTxn, NULL, 0, &srcMain) );
+  CHECK( mdb_dbi_open(p->dstTxn, NULL, 0, &dstMain) );
+
+  key.mv_data = "last_branch_id";
+  key.mv_size = strlen("last_branch_id");
+  if( mdb_get(p->dstTxn, dstMain, &key, &data)==MDB_SUCCESS ){
+    printf("the conversion was already completed\n");
+    rc = MDB_SUCCESS;
+    goto end;
+  }
+
+  CHECK( getCatalogInt(p, srcMain, "last_branch_id", &num_branches) );
+  printf("branches: %d\n", num_branches);
+
+  for(branch_id=1; branch_id<=num_branches; branch_id++){
+    printf("processing branch %d\n", branch_id);
+    CHECK( convertSubDb(p, branch_id, 1) );
+    CHECK( convertSubDb(p, branch_id, 0) );
+  }
+
+  /* the catalog is written last. its presence marks a completed conversion */
+  for(branch_id=1; branch_id<=num_branches; branch_id++){
+    sprintf(zKey, "b%d.name", branch_id);
+    key.mv_data = zKey;
+    key.mv_size = strlen(zKey);
+    rc = mdb_get(p->srcTxn, srcMain, &key, &data);
+    if( rc==MDB_NOTFOUND ) continue;  /* deleted branch */
+    CHECK( rc );
+    CHECK( mdb_put(p->dstTxn, dstMain, &key, &data, 0) );
+    sprintf(zKey, "b%d.visible", branch_id);
+    CHECK( convertCatalogInt(p, srcMain, dstMain, zKey) );
+    sprintf(zKey, "b%d.source_branch", branch_id);
+    CHECK( convertCatalogInt(p, srcMain, dstMain, zKey) );
+    sprintf(zKey, "b%d.source_commit", branch_id);
+    CHECK( convertCatalogInt(p, srcMain, dstMain, zKey) );
+    sprintf(zKey, "b%d.last_commit", branch_id);
+    CHECK( convertCatalogInt(p, srcMain, dstMain, zKey) );
+  }
+  CHECK( convertCatalogInt(p, srcMain, dstMain, "change_counter") );
+  CHECK( convertCatalogInt(p, srcMain, dstMain, "last_branch_id") );
+
+  rc = mdb_txn_commit(p->dstTxn);
+  p->dstTxn = 0;
+
+end:
+  if( p->dstTxn ) mdb_txn_abort(p->dstTxn);
+  if( p->srcTxn ) mdb_txn_abort(p->srcTxn);
+  return rc;
+}
+
+int main(int argc, char **argv){
+  Converter conv;
+  MDB_envinfo info;
+  char *zFilename2;
+  int rc;
+
+  if( argc!=2 ){
+    printf("usage: %s <db_file>\n", argv[0]);
+    return 1;
+  }
+
+  memset(&conv, 0, sizeof(conv));
+  zFilename2 = malloc(strlen(argv[1]) + 16);
+  if( zFilename2==0 ) return 1;
+  sprintf(zFilename2, "%s-converted", argv[1]);
+
+  CHECK( mdb_env_create(&conv.srcEnv) );
+  CHECK( mdb_env_set_maxdbs(conv.srcEnv, 1024) );
+  CHECK( mdb_env_open(conv.srcEnv, argv[1], MDB_NOSUBDIR | MDB_RDONLY, 0664) );
+  CHECK( mdb_env_info(conv.srcEnv, &info) );
+
+  CHECK( mdb_env_create(&conv.dstEnv) );
+  CHECK( mdb_env_set_maxdbs(conv.dstEnv, 1024) );
+  CHECK( mdb_env_set_mapsize(conv.dstEnv, info.me_mapsize) );
+  CHECK( mdb_env_open(conv.dstEnv, zFilename2, MDB_NOSUBDIR, 0664) );
+
+  printf("converting %s to %s ...\n", argv[1], zFilename2);
+
+  rc = convertDb(&conv);
+  if( rc==MDB_SUCCESS ){
+    CHECK( mdb_env_sync(conv.dstEnv, 1) );
+    printf("done. you can open it with the command: sqlite3 \"file:%s?branches=on\"\n", zFilename2);
+  }
+
+end:
+  if( conv.dstEnv ) mdb_env_close(conv.dstEnv);
+  if( conv.srcEnv ) mdb_env_close(conv.srcEnv);
+  free(zFilename2);
+  return rc==MDB_SUCCESS ? 0 : 1;
+}
@@ -0,0 +1,92 @@
+#
+# Exports a branch or commit from a LiteTree db to a normal SQLite db file
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import sys
+import struct
+import litetree
+
+# number of pages written on each call
+WRITE_BATCH = 256
+
+
+def export_snapshot(filename, location, output):
+
+    if not os.path.exists(filename):
+        raise IOError("the file does not exist: " + filename)
+
+    env = litetree.open_env(filename)
+    tmpname = output + '-tmp'
+    done = False
+
+    try:
+        with env.begin(buffers=True) as txn:
+
+            branches = litetree.read_branches(txn)
+            branch, commit = litetree.parse_location(branches, location)
+
+            reader = litetree.PageReader(env, txn, branches, branch, commit)
+
+            page1 = reader.get_page(1)
+            if page1 is None:
+                raise ValueError("the db is empty at " + location)
+
+            header = bytearray(page1[0:100])
+            page_size = struct.unpack('>H', bytes(header[16:18]))[0]
+            if page_size == 1:
+                page_size = 65536
+
+            num_pages = reader.get_max_page()
+
+            with open(tmpname, 'wb') as f:
+                batch = []
+                for pgno in range(1, num_pages + 1):
+                    page = reader.get_page(pgno)
+                    if page is None:
+                        raise ValueError("page " + str(pgno) + " not found at " + location)
+                    page = bytes(page)
+                    if pgno == 1:
+                        page = fix_header(page, num_pages)
+                    # the reserved space at the end of the page is not stored
+                    batch.append(page + '\x00' * (page_size - len(page)))
+                    if len(batch) == WRITE_BATCH:
+                        f.write(''.join(batch))
+                        batch = []
+                if len(batch) > 0:
+                    f.write(''.join(batch))
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.rename(tmpname, output)
+        done = True
+    finally:
+        env.close()
+        if not done and os.path.exists(tmpname):
+            os.remove(tmpname)
+
+    return num_pages
+
+
+def fix_header(page, num_pages):
+    header = bytearray(page)
+    # use the rollback journal
+    header[18] = 1
+    header[19] = 1
+    # in-header database size, valid for the current change counter
+    header[28:32] = struct.pack('>I', num_pages)
+    header[92:96] = header[24:28]
+    return bytes(header)
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 4:
+        print('usage: python ' + sys.argv[0] + ' <db_file> <branch>[.<commit>] <output_file>')
+        quit()
+
+    num_pages = export_snapshot(sys.argv[1], sys.argv[2], sys.argv[3])
+
+    print('exported ' + str(num_pages) + ' pages to ' + sys.argv[3])
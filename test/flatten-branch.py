@@ -0,0 +1,119 @@
+#
+# Makes a branch independent from its source branch
+#
+# The pages that the branch reads from its ancestors are copied to its own
+# sub-db, as versions of its first commit. Then the branch is changed to
+# have no source branch, so the lookups stop at its own sub-db and the
+# ancestors can be deleted:
+#
+#   python flatten-branch.py data.db <branch>
+#
+# The pages are copied on many small write transactions, so the db can
+# be used meanwhile. If it is interrupted it can be run again, the pages
+# already copied are skipped.
+#
+# After this the commits before the branch point (from its source) are
+# no longer visible on the branch.
+#
+# The pages are copied below the last commit of the branch, so they are
+# not on the commits exported after the watermarks of incremental-backup.py
+# and replicate.py, or checked after the one of page-checksums.py. These
+# watermarks also have a digest of the source of the branch, so on their
+# next run the flattened branch is exported or checked again in full.
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import sys
+import struct
+import lmdb
+import varint
+import litetree
+
+# pages copied on each write transaction
+batch_size = 1000
+
+
+def open_branch(txn, name, source_id=None):
+    """ returns the branch, checking that it can still be flattened """
+    branches = litetree.read_branches(txn)
+    branch = litetree.find_branch(branches, name)
+    if branch is None:
+        raise ValueError("branch not found: " + name)
+    if branch.source_branch == 0:
+        raise ValueError("the branch has no source branch: " + name)
+    if source_id is not None and branch.source_branch != source_id:
+        raise ValueError("the branch was modified: " + name)
+    if branch.last_commit == branch.source_commit:
+        raise ValueError("the branch has no commits: " + name)
+    return (branches, branch)
+
+
+def copy_pages(env, txn, branches, branch, pgnos):
+    """ copies the pages visible on the source, if not written on the first commit """
+    first_commit = branch.source_commit + 1
+    db = litetree.open_subdb(env, txn, branch.id, 'pages')
+    source = litetree.PageReader(env, txn, branches, branches[branch.source_branch], branch.source_commit)
+    count = 0
+    for pgno in pgnos:
+        key = varint.encode_key(pgno, first_commit)
+        if txn.get(key, db=db) is not None:
+            continue
+        page = source.get_page(pgno)
+        if page is None:
+            continue
+        txn.put(key, bytes(page), db=db)
+        count += 1
+    return count
+
+
+def flatten(filename, name):
+    """ returns the number of pages copied """
+
+    map_size = os.path.getsize(filename) * 2 + (1 << 30)
+    env = lmdb.open(filename, subdir=False, max_dbs=1024, map_size=map_size)
+    count = 0
+    try:
+        with env.begin() as txn:
+            branches, branch = open_branch(txn, name)
+            source_id = branch.source_branch
+            source = litetree.PageReader(env, txn, branches, branches[source_id], branch.source_commit)
+            num_pages = source.get_max_page()
+
+        for start in range(1, num_pages + 1, batch_size):
+            with env.begin(write=True) as txn:
+                branches, branch = open_branch(txn, name, source_id)
+                pgnos = range(start, min(start + batch_size, num_pages + 1))
+                count += copy_pages(env, txn, branches, branch, pgnos)
+
+        with env.begin(write=True) as txn:
+            branches, branch = open_branch(txn, name, source_id)
+            first_commit = branch.source_commit + 1
+            db = litetree.open_subdb(env, txn, branch.id, 'maxpage')
+            if txn.get(varint.encode(first_commit), db=db) is None:
+                txn.put(varint.encode(first_commit), struct.pack('I', num_pages), db=db)
+            # the source commit is kept: the branch still starts after it,
+            # the commits up to it have no pages or max page on the branch
+            txn.put('b' + str(branch.id) + '.source_branch', varint.encode(0))
+            change_counter = litetree.read_varint(txn, 'change_counter')
+            txn.put('change_counter', varint.encode(change_counter + 1))
+    finally:
+        env.close()
+
+    return count
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 3:
+        print('usage: python ' + sys.argv[0] + ' <db_file> <branch>')
+        quit()
+
+    try:
+        count = flatten(sys.argv[1], sys.argv[2])
+    except (ValueError, lmdb.Error) as e:
+        print('error: ' + str(e))
+        sys.exit(1)
+
+    print('copied ' + str(count) + ' pages')
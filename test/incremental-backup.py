@@ -0,0 +1,307 @@
+#
+# Incremental backup of a LiteTree db
+#
+# Exports only the page versions written after the last backup (the
+# watermark, the last commit of each branch) and applies them to a copy
+#
+# The watermark also has a digest of the last commit of each branch, so
+# a branch truncated and committed again with the same commit numbers is
+# detected. Such a branch is exported again in full.
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import sys
+import json
+import lmdb
+import varint
+import litetree
+
+MAGIC = 'LiteTree-incremental-1\n'
+
+# record types
+REC_BASE    = 'B'   # watermark of the db the increment applies to (json)
+REC_ARCH    = 'A'   # byte order of the native values
+REC_SUBDB   = 'P'   # entry of a sub-db
+REC_CATALOG = 'C'   # catalog key
+REC_DROP    = 'D'   # sub-dbs of a deleted branch, or of one exported again
+REC_END     = 'E'
+
+
+def write_record(f, rtype, name='', key='', value=''):
+    f.write(rtype + varint.encode(len(name)) + name +
+            varint.encode(len(key)) + key +
+            varint.encode(len(value)) + value)
+
+
+def read_field(f):
+    # the varint is at most 9 bytes long
+    first = f.read(1)
+    if first == '':
+        raise ValueError("truncated increment")
+    size = ord(first)
+    if size <= 240:
+        length = size
+    else:
+        if size < 249:
+            extra = 1
+        elif size == 249:
+            extra = 2
+        else:
+            extra = size - 247
+        length = varint.decode(first + f.read(extra))[0]
+    data = f.read(length)
+    if len(data) != length:
+        raise ValueError("truncated increment")
+    return data
+
+
+def read_records(f):
+    magic = f.read(len(MAGIC))
+    if magic == '':
+        return  # end of the stream
+    if magic != MAGIC:
+        raise ValueError("not a LiteTree increment")
+    while True:
+        rtype = f.read(1)
+        if rtype == '':
+            raise ValueError("truncated increment")
+        name = read_field(f)
+        key = read_field(f)
+        value = read_field(f)
+        yield (rtype, name, key, value)
+        if rtype == REC_END:
+            break
+
+
+def read_watermark(filename):
+    if filename is None or not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        obj = json.load(f)
+    return parse_watermark(obj)
+
+
+def parse_watermark(obj):
+    """ returns {branch_id: [commit, digest]}. the digest is None on the
+        watermarks saved by previous versions, without it """
+    watermark = {}
+    for branch_id, value in obj.items():
+        if not isinstance(value, list):
+            value = [value, None]
+        watermark[int(branch_id)] = value
+    return watermark
+
+
+def db_watermark(env, txn):
+    return dict((branch_id, [branch.last_commit, litetree.commit_digest(env, txn, branch_id, branch.last_commit)])
+                for branch_id, branch in litetree.read_branches(txn).items())
+
+
+def export_pages(env, txn, branch_id, since, f, dbname):
+    """ writes the entries with commit > since. the older versions
+        of each page are skipped instead of being read """
+    count = 0
+    for version in litetree.iter_page_versions(env, txn, branch_id, since + 1):
+        write_record(f, REC_SUBDB, dbname, version.key, bytes(version.data))
+        count += 1
+    return count
+
+
+def export_by_commit(txn, db, since, f, dbname):
+    """ writes the entries of a sub-db keyed by commit (maxpage, log) """
+    cursor = txn.cursor(db=db)
+    count = 0
+    found = cursor.set_range(varint.encode(since + 1))
+    while found:
+        write_record(f, REC_SUBDB, dbname, bytes(cursor.key()), bytes(cursor.value()))
+        count += 1
+        found = cursor.next()
+    return count
+
+
+def write_increment(env, txn, base, f):
+    """ writes the modifications made after the base watermark.
+        returns the number of entries and the new watermark """
+
+    count = 0
+    current = db_watermark(env, txn)
+
+    # the branches whose commits after the watermark were discarded
+    resync = set()
+    for branch_id, (commit, digest) in base.items():
+        if branch_id not in current:
+            continue
+        if current[branch_id][0] < commit or litetree.commit_digest(env, txn, branch_id, commit) != digest:
+            resync.add(branch_id)
+
+    f.write(MAGIC)
+    write_record(f, REC_BASE, value=json.dumps(base))
+    write_record(f, REC_ARCH, value=sys.byteorder)
+
+    # they are dropped and exported in full
+    for branch_id in sorted(resync):
+        write_record(f, REC_DROP, key=str(branch_id))
+
+    for key, value in txn.cursor():
+        key = bytes(key)
+        match = litetree.subdb_name.match(key)
+        if match is None:
+            write_record(f, REC_CATALOG, '', key, bytes(value))
+            continue
+        branch_id = int(match.group(1))
+        if branch_id not in current:
+            continue
+        if branch_id in base and branch_id not in resync:
+            since = base[branch_id][0]
+            if since == current[branch_id][0]:
+                continue  # no new commits
+        else:
+            since = 0
+        db = env.open_db(key, txn=txn, create=False)
+        kind = match.group(2)
+        if kind == 'pages':
+            count += export_pages(env, txn, branch_id, since, f, key)
+        elif kind in ('maxpage', 'log'):
+            count += export_by_commit(txn, db, since, f, key)
+        else:
+            for key2, value2 in txn.cursor(db=db):
+                write_record(f, REC_SUBDB, key, bytes(key2), bytes(value2))
+                count += 1
+
+    for branch_id in base:
+        if branch_id not in current:
+            write_record(f, REC_DROP, key=str(branch_id))
+
+    write_record(f, REC_END, value=json.dumps(current))
+
+    return (count, current)
+
+
+def apply_records(env, txn, records, dbs):
+    """ applies the records of one increment. dbs caches the sub-db handles """
+
+    count = 0
+    catalog = []
+    complete = False
+    swap = False
+    for rtype, name, key, value in records:
+
+        if rtype == REC_BASE:
+            base = parse_watermark(json.loads(value))
+            if db_watermark(env, txn) != base:
+                raise ValueError("the increment does not apply to this db")
+
+        elif rtype == REC_ARCH:
+            swap = (value != sys.byteorder)
+
+        elif rtype == REC_SUBDB:
+            # the values of the maxpage sub-dbs are native integers
+            if swap and name.endswith('-maxpage'):
+                value = value[::-1]
+            db = dbs.get(name)
+            if db is None:
+                db = env.open_db(name, txn=txn)
+                dbs[name] = db
+            txn.put(key, value, db=db)
+            count += 1
+
+        elif rtype == REC_CATALOG:
+            catalog.append((key, value))
+
+        elif rtype == REC_DROP:
+            prefix = 'b' + key + '-'
+            names = [bytes(k) for k, v in txn.cursor() if bytes(k).startswith(prefix)]
+            for name in names:
+                txn.drop(env.open_db(name, txn=txn), delete=True)
+                dbs.pop(name, None)
+
+        elif rtype == REC_END:
+            complete = True
+
+    if not complete:
+        raise ValueError("empty increment")
+
+    # replace the catalog
+    keys = [bytes(k) for k, v in txn.cursor()]
+    for key in keys:
+        if litetree.subdb_name.match(key) is None:
+            txn.delete(key)
+    for key, value in catalog:
+        txn.put(key, value)
+
+    return count
+
+
+def export_increment(filename, watermark_file, output):
+    """ exports the modifications made after the watermark and updates it.
+        with no watermark file the whole db is exported """
+
+    if not os.path.exists(filename):
+        raise IOError("the file does not exist: " + filename)
+
+    base = read_watermark(watermark_file)
+
+    env = litetree.open_env(filename)
+
+    with env.begin(buffers=True) as txn:
+        with open(output + '-tmp', 'wb') as f:
+            count, current = write_increment(env, txn, base, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    env.close()
+
+    os.rename(output + '-tmp', output)
+
+    if watermark_file is not None:
+        with open(watermark_file + '-tmp', 'w') as f:
+            json.dump(current, f)
+        os.rename(watermark_file + '-tmp', watermark_file)
+
+    return count
+
+
+def apply_increment(increment, filename):
+    """ applies the increment to the backup copy in a single transaction """
+
+    map_size = os.path.getsize(increment) * 2 + (1 << 30)
+    if os.path.exists(filename):
+        map_size += os.path.getsize(filename)
+    env = lmdb.open(filename, subdir=False, max_dbs=1024, map_size=map_size)
+
+    with open(increment, 'rb') as f:
+        with env.begin(write=True) as txn:
+            count = apply_records(env, txn, read_records(f), {})
+
+    env.close()
+    return count
+
+
+def save_watermark(filename, watermark_file):
+    """ saves the watermark of an existing backup, made with online-backup.py """
+
+    env = litetree.open_env(filename)
+    with env.begin(buffers=True) as txn:
+        current = db_watermark(env, txn)
+    env.close()
+
+    with open(watermark_file, 'w') as f:
+        json.dump(current, f)
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 5 and sys.argv[1] == 'export':
+        count = export_increment(sys.argv[2], sys.argv[3], sys.argv[4])
+        print('exported ' + str(count) + ' entries to ' + sys.argv[4])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'apply':
+        count = apply_increment(sys.argv[2], sys.argv[3])
+        print('applied ' + str(count) + ' entries to ' + sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'watermark':
+        save_watermark(sys.argv[2], sys.argv[3])
+    else:
+        print('usage: python ' + sys.argv[0] + ' export <db_file> <watermark_file> <increment_file>')
+        print('       python ' + sys.argv[0] + ' apply <increment_file> <backup_file>')
+        print('       python ' + sys.argv[0] + ' watermark <backup_file> <watermark_file>')
@@ -0,0 +1,597 @@
+#
+# Integrity check of all the branches of a LiteTree db
+#
+# Walks the b-trees of the db at the head of each branch and checks the
+# page headers, the cells, the free space, the order of the rowids, the
+# depth of the trees, the overflow chains, the freelist and that each page
+# is used exactly once.
+#
+# The branches are checked after their source branch. Only the pages
+# whose version differs from the one seen at the head of the source are
+# read again: the subtrees without such pages are the same on both and
+# their results are reused. A page version is parsed only once, whatever
+# the number of branches where it is visible. So the time grows with the
+# data written on each branch, not with the number of branches.
+#
+#   python integrity-check.py data.db [<branch>...]
+#
+# The pointer map pages (auto_vacuum) are accounted for but not checked.
+#
+# Copyright defined in LICENSE.txt
+#
+import sys
+import struct
+import litetree
+
+TABLE_INTERIOR = 5
+TABLE_LEAF = 13
+INDEX_INTERIOR = 2
+INDEX_LEAF = 10
+
+
+def read_sqlite_varint(data, offset):
+    """ returns (value, offset after it) for a SQLite record varint """
+    value = 0
+    for n in range(8):
+        byte = ord(data[offset + n])
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return (value, offset + n + 1)
+    return ((value << 8) | ord(data[offset + 8]), offset + 9)
+
+
+def local_payload(usable_size, size, is_table_leaf):
+    """ returns the number of payload bytes stored on the b-tree page """
+    if is_table_leaf:
+        max_local = usable_size - 35
+    else:
+        max_local = (usable_size - 12) * 64 // 255 - 23
+    if size <= max_local:
+        return size
+    min_local = (usable_size - 12) * 32 // 255 - 23
+    local = min_local + (size - min_local) % (usable_size - 4)
+    if local > max_local:
+        local = min_local
+    return local
+
+
+def parse_btree_page(page, pgno, usable_size):
+    """ checks a b-tree page on its own. returns a dict with the page type,
+        the child pages, the overflow chains, the rowids and the errors """
+
+    info = {'type': None, 'children': [], 'overflows': [], 'keys': [], 'cells': [], 'errors': []}
+    errors = info['errors']
+    h = 100 if pgno == 1 else 0
+
+    page_type = ord(page[h])
+    if page_type not in (TABLE_INTERIOR, TABLE_LEAF, INDEX_INTERIOR, INDEX_LEAF):
+        errors.append("invalid page type " + str(page_type))
+        return info
+    info['type'] = page_type
+    is_leaf = page_type in (TABLE_LEAF, INDEX_LEAF)
+    is_table = page_type in (TABLE_INTERIOR, TABLE_LEAF)
+    header_size = 8 if is_leaf else 12
+
+    first_freeblock, num_cells, content_start, fragmented = struct.unpack('>HHHB', page[h + 1:h + 8])
+    if content_start == 0:
+        content_start = 65536
+    cells_start = h + header_size
+    pointers_end = cells_start + 2 * num_cells
+    if pointers_end > content_start or content_start > usable_size:
+        errors.append("invalid cell content area")
+        return info
+
+    used = []   # (start, end) of the cells and freeblocks
+    try:
+        for n in range(num_cells):
+            offset = struct.unpack('>H', page[cells_start + 2 * n:cells_start + 2 * n + 2])[0]
+            if offset < content_start or offset >= usable_size:
+                errors.append("cell " + str(n) + " out of the content area")
+                return info
+            pos = offset
+            if not is_leaf:
+                info['children'].append(struct.unpack('>I', page[pos:pos + 4])[0])
+                pos += 4
+            if page_type == TABLE_INTERIOR:
+                key, pos = read_sqlite_varint(page, pos)
+                info['keys'].append(key)
+                size = pos - offset
+            else:
+                payload, pos = read_sqlite_varint(page, pos)
+                if is_table:
+                    key, pos = read_sqlite_varint(page, pos)
+                    info['keys'].append(key)
+                local = local_payload(usable_size, payload, is_table)
+                size = pos - offset + local
+                if local < payload:
+                    first = struct.unpack('>I', page[offset + size:offset + size + 4])[0]
+                    count = (payload - local + usable_size - 5) // (usable_size - 4)
+                    info['overflows'].append((first, count))
+                    size += 4
+                if page_type == TABLE_LEAF:
+                    info['cells'].append((pos, payload, local, first if local < payload else 0))
+                size = max(size, 4)
+            if offset + size > usable_size:
+                errors.append("cell " + str(n) + " extends past the end of the page")
+                return info
+            used.append((offset, offset + size))
+    except (IndexError, struct.error):
+        errors.append("truncated cell")
+        return info
+
+    if not is_leaf:
+        info['children'].append(struct.unpack('>I', page[h + 8:h + 12])[0])
+
+    freeblocks = 0
+    offset = first_freeblock
+    while offset != 0:
+        if offset < content_start or offset + 4 > usable_size:
+            errors.append("invalid freeblock offset " + str(offset))
+            return info
+        next_offset, size = struct.unpack('>HH', page[offset:offset + 4])
+        if size < 4 or offset + size > usable_size or (next_offset != 0 and next_offset <= offset + size):
+            errors.append("invalid freeblock at offset " + str(offset))
+            return info
+        used.append((offset, offset + size))
+        freeblocks += size
+        offset = next_offset
+
+    used.sort()
+    for n in range(1, len(used)):
+        if used[n][0] < used[n - 1][1]:
+            errors.append("overlapping cells at offset " + str(used[n][0]))
+            return info
+
+    cell_bytes = sum(end - start for start, end in used) - freeblocks
+    free = freeblocks + fragmented + content_start - pointers_end
+    if cell_bytes + free != usable_size - pointers_end:
+        errors.append("free space mismatch")
+
+    keys = info['keys']
+    for n in range(1, len(keys)):
+        if keys[n] <= keys[n - 1]:
+            errors.append("rowid " + str(keys[n]) + " out of order")
+            break
+
+    return info
+
+
+def read_record(data):
+    """ returns the values of a SQLite record """
+    header_size, pos = read_sqlite_varint(data, 0)
+    types = []
+    while pos < header_size:
+        serial_type, pos = read_sqlite_varint(data, pos)
+        types.append(serial_type)
+    values = []
+    pos = header_size
+    sizes = {0: 0, 1: 1, 2: 2, 3: 3, 4: 4, 5: 6, 6: 8, 7: 8, 8: 0, 9: 0}
+    for serial_type in types:
+        if serial_type in sizes:
+            size = sizes[serial_type]
+            if serial_type in (8, 9):
+                values.append(serial_type - 8)
+            elif serial_type in (0, 7):
+                values.append(None)
+            else:
+                raw = data[pos:pos + size]
+                value = 0
+                for char in raw:
+                    value = (value << 8) | ord(char)
+                if ord(raw[0]) & 0x80:
+                    value -= 1 << (8 * size)
+                values.append(value)
+        else:
+            size = (serial_type - 12) // 2
+            values.append(data[pos:pos + size])
+        pos += size
+    return values
+
+
+class View(object):
+    """ the tree structure of the db at a branch head. parent has the page
+        referencing each b-tree and overflow page (0 for the roots), nodes the
+        version of these pages and summary the result of their subtrees """
+
+    def __init__(self):
+        self.parent = {}
+        self.nodes = {}
+        self.summary = {}
+        self.roots = []
+        self.num_pages = 0
+
+
+class IntegrityChecker(object):
+
+    def __init__(self, db):
+        self.db = db
+        self.pages = {}     # b-tree page version -> parse_btree_page() result
+        self.overflow = {}  # overflow page version -> next overflow page
+        self.latest = {}    # branch_id -> {pgno: last commit}
+
+    def latest_commits(self, branch_id):
+        if branch_id not in self.latest:
+            latest = {}
+            for version in litetree.iter_page_versions(self.db.env, self.db.txn, branch_id):
+                latest[version.pgno] = version.commit
+            self.latest[branch_id] = latest
+        return self.latest[branch_id]
+
+    def changed_pages(self, ancestry1, ancestry2):
+        """ the pages that can have a different version on the two views """
+        bounds1 = dict(ancestry1)
+        bounds2 = dict(ancestry2)
+        changed = set()
+        for branch_id in set(bounds1) | set(bounds2):
+            low = bounds1.get(branch_id, 0)
+            high = bounds2.get(branch_id, 0)
+            if low > high:
+                low, high = high, low
+            if low == high:
+                continue
+            if high == self.db.catalog[branch_id].last_commit:
+                changed.update(pgno for pgno, commit in self.latest_commits(branch_id).items() if commit > low)
+            else:
+                for version in litetree.iter_page_versions(self.db.env, self.db.txn, branch_id, low + 1, high):
+                    changed.add(version.pgno)
+        return changed
+
+    def children_of(self, view, pgno):
+        ident = view.nodes.get(pgno)
+        summary = view.summary.get(pgno)
+        if (summary is not None and summary[0] == 'overflow') or ident not in self.pages:
+            next_pgno = self.overflow.get(ident, 0)
+            return [next_pgno] if next_pgno != 0 else []
+        info = self.pages[ident]
+        return info['children'] + [first for first, count in info['overflows']]
+
+    def error(self, message):
+        self.errors.append(message)
+
+    def read(self, pgno):
+        """ returns the parsed page. the page versions are parsed only once """
+        page = self.reader.get_page(pgno)
+        if page is None:
+            self.error("page " + str(pgno) + " not found")
+            return None
+        ident = self.reader.found
+        self.view.nodes[pgno] = ident
+        info = self.pages.get(ident)
+        if info is None:
+            info = parse_btree_page(bytes(page), pgno, self.usable_size)
+            self.pages[ident] = info
+        for message in info['errors']:
+            self.error("page " + str(pgno) + ": " + message)
+        return info
+
+    def reference(self, pgno, parent):
+        """ marks the page as used. returns False if it is invalid """
+        if pgno < 1 or pgno > self.num_pages:
+            self.error("page " + str(pgno) + " referenced by page " + str(parent) + " is out of the db")
+            return False
+        if pgno in self.view.parent:
+            self.error("page " + str(pgno) + " referenced by page " + str(parent) + " is already in use")
+            return False
+        self.view.parent[pgno] = parent
+        return True
+
+    def reusable(self, pgno):
+        return self.dirty is not None and pgno not in self.dirty and pgno in self.view.summary
+
+    def walk_overflow(self, first, owner, count):
+        view = self.view
+        chain = []
+        length = 0
+        pgno = first
+        parent = owner
+        while pgno != 0 and length <= count:
+            if not self.reference(pgno, parent):
+                return
+            if self.reusable(pgno):
+                length += view.summary[pgno][1]
+                break
+            page = self.reader.get_page(pgno)
+            if page is None:
+                self.error("overflow page " + str(pgno) + " not found")
+                return
+            view.nodes[pgno] = self.reader.found
+            next_pgno = struct.unpack('>I', bytes(page[0:4]))[0]
+            self.overflow[self.reader.found] = next_pgno
+            chain.append(pgno)
+            length += 1
+            parent = pgno
+            pgno = next_pgno
+        if length != count:
+            self.error("overflow chain of page " + str(owner) + " has " + str(length) +
+                       " pages, expected " + str(count))
+            return
+        for n, pgno in enumerate(chain):
+            view.summary[pgno] = ('overflow', length - n)
+
+    def walk(self, pgno, parent):
+        """ checks the subtree and returns its summary:
+            ('btree', is_table, depth, min_rowid, max_rowid) or None if invalid """
+        view = self.view
+        if not self.reference(pgno, parent):
+            return None
+        if self.reusable(pgno):
+            return view.summary[pgno]
+        view.summary.pop(pgno, None)
+        num_errors = len(self.errors)
+
+        info = self.read(pgno)
+        if info is None or info['type'] is None:
+            return None
+        is_table = info['type'] in (TABLE_INTERIOR, TABLE_LEAF)
+
+        for first, count in info['overflows']:
+            self.walk_overflow(first, pgno, count)
+
+        if info['type'] in (TABLE_LEAF, INDEX_LEAF):
+            keys = info['keys']
+            if keys:
+                result = ('btree', is_table, 0, keys[0], keys[-1])
+            else:
+                result = ('btree', is_table, 0, None, None)
+        else:
+            depth = None
+            min_key = max_key = None
+            valid = True
+            for n, child in enumerate(info['children']):
+                summary = self.walk(child, pgno)
+                if summary is None:
+                    valid = False
+                    continue
+                if summary[0] != 'btree':
+                    self.error("page " + str(child) + " referenced by page " + str(pgno) + " is not a b-tree page")
+                    valid = False
+                    continue
+                if summary[1] != is_table:
+                    self.error("page " + str(child) + " has a different b-tree type than its parent " + str(pgno))
+                    valid = False
+                    continue
+                if depth is None:
+                    depth = summary[2]
+                elif summary[2] != depth:
+                    self.error("page " + str(child) + " is at a different depth than its siblings")
+                    valid = False
+                if is_table and summary[3] is not None:
+                    if n > 0 and summary[3] <= info['keys'][n - 1]:
+                        self.error("rowid " + str(summary[3]) + " on the subtree of page " + str(child) +
+                                   " is out of order")
+                    if n < len(info['keys']) and summary[4] > info['keys'][n]:
+                        self.error("rowid " + str(summary[4]) + " on the subtree of page " + str(child) +
+                                   " is out of order")
+                    if min_key is None:
+                        min_key = summary[3]
+                    max_key = summary[4]
+            if not valid or depth is None:
+                return None
+            result = ('btree', is_table, depth + 1, min_key, max_key)
+
+        # the subtrees with errors are checked again on each branch
+        if len(self.errors) == num_errors:
+            view.summary[pgno] = result
+        return result
+
+    def read_payload(self, page, cell):
+        """ returns the payload of a table leaf cell """
+        pos, size, local, first = cell
+        data = page[pos:pos + local]
+        pgno = first
+        while len(data) < size and pgno != 0:
+            page = self.reader.get_page(pgno)
+            if page is None:
+                break
+            page = bytes(page)
+            data += page[4:self.usable_size][0:size - len(data)]
+            pgno = struct.unpack('>I', page[0:4])[0]
+        return data
+
+    def read_roots(self, pgno, seen=None):
+        """ returns the root pages listed on the schema table """
+        if seen is None:
+            seen = set()
+        seen.add(pgno)
+        page = self.reader.get_page(pgno)
+        if page is None:
+            return []
+        page = bytes(page)
+        info = parse_btree_page(page, pgno, self.usable_size)
+        if info['errors']:
+            return []
+        roots = []
+        for child in info['children']:
+            if child >= 1 and child <= self.num_pages and child not in seen:
+                roots += self.read_roots(child, seen)
+        for cell in info['cells']:
+            try:
+                values = read_record(self.read_payload(page, cell))
+            except (IndexError, struct.error):
+                continue
+            if len(values) > 3 and isinstance(values[3], (int, long)) and values[3] > 0:
+                roots.append(values[3])
+        return roots
+
+    def check_freelist(self, page1):
+        trunk, count = struct.unpack('>II', page1[32:40])
+        freelist = set()
+        while trunk != 0:
+            if trunk < 1 or trunk > self.num_pages or trunk in freelist or trunk in self.view.parent:
+                self.error("invalid freelist trunk page " + str(trunk))
+                return freelist
+            freelist.add(trunk)
+            page = self.reader.get_page(trunk)
+            if page is None:
+                self.error("freelist trunk page " + str(trunk) + " not found")
+                return freelist
+            page = bytes(page)
+            next_trunk, num_leaves = struct.unpack('>II', page[0:8])
+            if num_leaves > self.usable_size // 4 - 2:
+                self.error("invalid number of leaves on freelist trunk page " + str(trunk))
+                return freelist
+            for n in range(num_leaves):
+                leaf = struct.unpack('>I', page[8 + 4 * n:12 + 4 * n])[0]
+                if leaf < 1 or leaf > self.num_pages or leaf in freelist or leaf in self.view.parent:
+                    self.error("invalid freelist leaf page " + str(leaf))
+                    continue
+                freelist.add(leaf)
+            trunk = next_trunk
+        if len(freelist) != count:
+            self.error("freelist has " + str(len(freelist)) + " pages, expected " + str(count))
+        return freelist
+
+    def check(self, branch, ref=None, ref_ancestry=None):
+        """ checks the head of the branch, reusing the results of the ref view.
+            returns (view, errors) """
+
+        self.errors = []
+        self.view = view = View()
+        self.reader = self.db.reader(branch.name)
+        ancestry = litetree.ancestry(self.db.catalog, branch, branch.last_commit)
+        self.num_pages = view.num_pages = self.reader.get_max_page()
+        if self.num_pages == 0:
+            return (view, self.errors)
+
+        page1 = bytes(self.reader.get_page(1)[0:100])
+        page_size = struct.unpack('>H', page1[16:18])[0]
+        if page_size == 1:
+            page_size = 65536
+        self.usable_size = page_size - ord(page1[20])
+
+        removed = set()
+        if ref is None:
+            self.dirty = None
+        else:
+            view.parent = ref.parent.copy()
+            view.nodes = ref.nodes.copy()
+            view.summary = ref.summary.copy()
+            # the pages written and the ones referencing them
+            self.dirty = set()
+            for pgno in self.changed_pages(ref_ancestry, ancestry):
+                while pgno != 0 and pgno not in self.dirty:
+                    self.dirty.add(pgno)
+                    pgno = ref.parent.get(pgno, 0)
+            # the pages that will be referenced again by the walk
+            for pgno in self.dirty:
+                removed.update(self.children_of(ref, pgno))
+            removed.update(self.dirty)
+            removed.update(ref.roots)
+            for pgno in removed:
+                view.parent.pop(pgno, None)
+            for pgno in self.dirty:
+                view.nodes.pop(pgno, None)
+                view.summary.pop(pgno, None)
+
+        view.roots = [1] + self.read_roots(1)
+        for root in view.roots:
+            if root in view.parent and view.parent[root] == 0:
+                self.error("page " + str(root) + " is the root of more than one b-tree")
+                continue
+            self.walk(root, 0)
+
+        # the pages that are not used anymore, with their subtrees
+        stack = [pgno for pgno in removed if pgno not in view.parent]
+        detached = set()
+        while stack:
+            pgno = stack.pop()
+            if pgno in detached:
+                continue
+            detached.add(pgno)
+            view.nodes.pop(pgno, None)
+            view.summary.pop(pgno, None)
+            for child in self.children_of(ref, pgno):
+                if ref.parent.get(child) == pgno and view.parent.get(child) == pgno:
+                    del view.parent[child]
+                    stack.append(child)
+
+        # pages out of the db that are still referenced
+        if ref is not None:
+            for pgno in range(self.num_pages + 1, ref.num_pages + 1):
+                if pgno in view.parent:
+                    self.error("page " + str(pgno) + " referenced by page " + str(view.parent[pgno]) +
+                               " is out of the db")
+
+        freelist = self.check_freelist(page1)
+
+        # every page must be used once
+        special = set()
+        if struct.unpack('>I', page1[52:56])[0] != 0:
+            special.update(range(2, self.num_pages + 1, self.usable_size // 5 + 1))
+        pending_byte_page = 0x40000000 // page_size + 1
+        if pending_byte_page <= self.num_pages:
+            special.add(pending_byte_page)
+        used = len(view.parent) + len(freelist)
+        used += len([pgno for pgno in special if pgno not in view.parent and pgno not in freelist])
+        if used != self.num_pages:
+            unused = [pgno for pgno in range(1, self.num_pages + 1)
+                      if pgno not in view.parent and pgno not in freelist and pgno not in special]
+            for pgno in unused[0:10]:
+                self.error("page " + str(pgno) + " is never used")
+            if len(unused) > 10:
+                self.error(str(len(unused) - 10) + " more pages are never used")
+
+        return (view, self.errors)
+
+
+def check(filename, names=None):
+    """ returns a list of dicts with the results of each branch """
+
+    results = []
+    with litetree.LiteTreeFile(filename) as db:
+        if names is None:
+            branches = db.branches()
+        else:
+            branches = sorted((db.branch(name) for name in names), key=lambda branch: branch.id)
+
+        checker = IntegrityChecker(db)
+        views = {}
+        # keep the views while their derived branches are not checked
+        pending = {}
+        for branch in branches:
+            pending[branch.source_branch] = pending.get(branch.source_branch, 0) + 1
+
+        for branch in branches:
+            ref = views.get(branch.source_branch)
+            ref_ancestry = None
+            if ref is not None:
+                source = db.catalog[branch.source_branch]
+                ref_ancestry = litetree.ancestry(db.catalog, source, source.last_commit)
+            view, errors = checker.check(branch, ref, ref_ancestry)
+            lookups = checker.reader.replay_stats['lookups']
+
+            pending[branch.source_branch] -= 1
+            if pending[branch.source_branch] == 0:
+                views.pop(branch.source_branch, None)
+            # the structure of a db with errors is not reused
+            if pending.get(branch.id, 0) > 0 and not errors:
+                views[branch.id] = view
+
+            results.append({
+                'branch': branch.name,
+                'pages': view.num_pages,
+                'pages_read': lookups,
+                'errors': errors,
+            })
+
+    return results
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print('usage: python ' + sys.argv[0] + ' <db_file> [<branch>...]')
+        quit()
+
+    failed = False
+    for result in check(sys.argv[1], sys.argv[2:] or None):
+        for message in result['errors']:
+            print(result['branch'] + ': ' + message)
+        if result['errors']:
+            failed = True
+        else:
+            print(result['branch'] + ': ok (' + str(result['pages']) + ' pages, ' +
+                  str(result['pages_read']) + ' read)')
+    if failed:
+        sys.exit(1)
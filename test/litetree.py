@@ -0,0 +1,461 @@
+#
+# Read access to the LMDB storage used by LiteTree
+#
+# Example:
+#
+#   with litetree.LiteTreeFile('data.db') as db:
+#       for branch in db.branches():
+#           print(branch.name, branch.last_commit, db.stats(branch.name))
+#       for version in db.page_versions('master', min_commit=100):
+#           print(version.pgno, version.commit, version.size)
+#
+# The file is opened read-only and everything is read from a single LMDB
+# read transaction. The page data is returned as buffers pointing to the
+# LMDB map (no copy), valid until the file is closed.
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import re
+import shutil
+import struct
+import hashlib
+import tempfile
+import lmdb
+import varint
+
+# names of the sub-dbs (b<id>-pages, b<id>-maxpage...) and of the catalog keys (b<id>.name...)
+subdb_name = re.compile(r'^b(\d+)-(.*)$')
+catalog_key = re.compile(r'^b(\d+)\.')
+
+# content digests stored on each write transaction by content_stats
+digest_batch = 10000
+
+
+def read_varint(txn, key, default=0):
+    value = txn.get(key)
+    if value is None:
+        return default
+    return varint.decode(value)[0]
+
+
+def open_env(filename, readonly=True):
+    return lmdb.open(filename, subdir=False, max_dbs=1024, readonly=readonly)
+
+
+def open_subdb(env, txn, branch_id, kind):
+    """ returns the b<id>-<kind> sub-db or None if it does not exist """
+    try:
+        return env.open_db('b' + str(branch_id) + '-' + kind, txn=txn, create=False)
+    except lmdb.NotFoundError:
+        return None
+
+
+class Branch(object):
+    """ a branch from the catalog """
+
+    def __init__(self, id, name, visible, source_branch, source_commit, last_commit):
+        self.id = id
+        self.name = name
+        self.visible = visible
+        self.source_branch = source_branch    # id of the source branch, 0 if none
+        self.source_commit = source_commit
+        self.last_commit = last_commit
+
+    def __repr__(self):
+        return 'Branch(id=%d, name=%r, source_branch=%d, source_commit=%d, last_commit=%d)' % (
+            self.id, self.name, self.source_branch, self.source_commit, self.last_commit)
+
+
+class PageVersion(object):
+    """ a version of a page stored on a b<id>-pages sub-db. the key is
+        decoded only when the pgno or the commit is used """
+
+    def __init__(self, key, value):
+        self.key = key
+        self.data = value
+        self._pgno = None
+        self._commit = None
+
+    def _decode(self):
+        self._pgno, self._commit = varint.decode_key(self.key)
+
+    @property
+    def pgno(self):
+        if self._pgno is None:
+            self._decode()
+        return self._pgno
+
+    @property
+    def commit(self):
+        if self._commit is None:
+            self._decode()
+        return self._commit
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return 'PageVersion(pgno=%d, commit=%d, size=%d)' % (self.pgno, self.commit, self.size)
+
+
+def read_branches(txn):
+    """ returns a dict {branch_id: Branch} with the branches stored on the catalog """
+
+    branches = {}
+    num_branches = read_varint(txn, 'last_branch_id')
+
+    for branch_id in range(1, num_branches + 1):
+        prefix = 'b' + str(branch_id)
+        name = txn.get(prefix + '.name')
+        if name is None:
+            continue  # deleted branch
+        branches[branch_id] = Branch(
+            branch_id,
+            bytes(name).rstrip('\x00'),
+            read_varint(txn, prefix + '.visible'),
+            read_varint(txn, prefix + '.source_branch'),
+            read_varint(txn, prefix + '.source_commit'),
+            read_varint(txn, prefix + '.last_commit'))
+
+    return branches
+
+
+def find_branch(branches, name):
+    for branch in branches.values():
+        if branch.name == name:
+            return branch
+    return None
+
+
+def parse_location(branches, location):
+    """ converts '<name>[.<commit>]' into a (branch, commit) tuple """
+
+    name = location
+    commit = None
+    if '.' in location:
+        prefix, suffix = location.rsplit('.', 1)
+        if suffix.isdigit() and find_branch(branches, prefix) is not None:
+            name = prefix
+            commit = int(suffix)
+
+    branch = find_branch(branches, name)
+    if branch is None:
+        raise ValueError("branch not found: " + name)
+    if commit is None:
+        commit = branch.last_commit
+    if commit > branch.last_commit:
+        raise ValueError("commit not found: " + location)
+
+    return (branch, commit)
+
+
+def ancestry(branches, branch, commit):
+    """ returns the list of (branch_id, max_commit) to search for pages,
+        starting from the given branch and going up through its sources """
+
+    result = []
+    while branch is not None:
+        if commit > branch.source_commit:
+            result.append((branch.id, commit))
+        commit = min(commit, branch.source_commit)
+        if commit == 0:
+            break
+        branch = branches.get(branch.source_branch)
+    return result
+
+
+def iter_page_versions(env, txn, branch_id, min_commit=0, max_commit=None, min_pgno=0, max_pgno=None):
+    """ yields the PageVersion stored on the branch sub-db within the commit range,
+        ordered by pgno and commit. the versions outside of the range are skipped
+        with cursor seeks instead of being read """
+
+    db = open_subdb(env, txn, branch_id, 'pages')
+    if db is None:
+        return
+    cursor = txn.cursor(db=db)
+    if min_pgno > 0:
+        found = cursor.set_range(varint.encode(min_pgno))
+    else:
+        found = cursor.first()
+    while found:
+        key = bytes(cursor.key())
+        pgno, size = varint.decode(key)
+        if max_pgno is not None and pgno > max_pgno:
+            break
+        prefix = key[0:size]
+        if min_commit > 0:
+            found = cursor.set_range(prefix + varint.encode(min_commit))
+        while found:
+            key = bytes(cursor.key())
+            if key[0:size] != prefix:
+                break
+            version = PageVersion(key, cursor.value())
+            if max_commit is not None and version.commit > max_commit:
+                found = cursor.set_range(varint.encode(pgno + 1))
+                break
+            yield version
+            found = cursor.next()
+
+
+def iter_commits(env, txn, branch_id, min_commit=0, max_commit=None):
+    """ yields (commit, max_page) for the commits stored on the branch """
+
+    db = open_subdb(env, txn, branch_id, 'maxpage')
+    if db is None:
+        return
+    cursor = txn.cursor(db=db)
+    found = cursor.set_range(varint.encode(min_commit))
+    while found:
+        commit = varint.decode(cursor.key())[0]
+        if max_commit is not None and commit > max_commit:
+            break
+        yield (commit, struct.unpack('I', bytes(cursor.value())[0:4])[0])
+        found = cursor.next()
+
+
+def commit_digest(env, txn, branch_id, commit):
+    """ returns a digest of the branch source, of the max page and of the page
+        versions written on the commit, to detect a commit discarded and
+        written again or a branch that was flattened """
+
+    prefix = 'b' + str(branch_id)
+    digest = hashlib.sha1()
+    digest.update(varint.encode(read_varint(txn, prefix + '.source_branch')) +
+                  varint.encode(read_varint(txn, prefix + '.source_commit')))
+    for n, max_page in iter_commits(env, txn, branch_id, commit, commit):
+        digest.update(struct.pack('>I', max_page))
+    for version in iter_page_versions(env, txn, branch_id, commit, commit):
+        digest.update(varint.encode(len(version.key)) + version.key)
+        digest.update(varint.encode(version.size) + bytes(version.data))
+    return digest.hexdigest()
+
+
+def count_pages(env, txn, branch_id, max_pgno=None):
+    """ returns the number of distinct pages stored on the branch sub-db,
+        jumping from one page to the next with cursor seeks """
+
+    db = open_subdb(env, txn, branch_id, 'pages')
+    if db is None:
+        return 0
+    cursor = txn.cursor(db=db)
+    count = 0
+    found = cursor.first()
+    while found:
+        pgno = varint.decode(cursor.key())[0]
+        if max_pgno is not None and pgno > max_pgno:
+            break
+        count += 1
+        found = cursor.set_range(varint.encode(pgno + 1))
+    return count
+
+
+def branch_stats(env, txn, branches, branch, pages=False):
+    """ returns the storage statistics of the branch, read from the LMDB stats
+        of the sub-dbs. with pages=True the distinct pages are also counted,
+        with one cursor seek per page """
+
+    stats = {'page_versions': 0, 'bytes': 0, 'commits': 0, 'depth': 0}
+
+    for kind in ('pages', 'maxpage'):
+        db = open_subdb(env, txn, branch.id, kind)
+        if db is None:
+            continue
+        stat = txn.stat(db)
+        stats['bytes'] += stat['psize'] * (stat['branch_pages'] + stat['leaf_pages'] + stat['overflow_pages'])
+        if kind == 'pages':
+            stats['page_versions'] = stat['entries']
+            stats['depth'] = stat['depth']
+        else:
+            stats['commits'] = stat['entries']
+
+    if not pages:
+        return stats
+
+    stats['shared_pages'] = 0
+    stats['pages'] = count_pages(env, txn, branch.id)
+    if stats['pages'] > 0:
+        stats['versions_per_page'] = float(stats['page_versions']) / stats['pages']
+    else:
+        stats['versions_per_page'] = 0.0
+
+    # the pages at the head of the branch that are read from the ancestors
+    if branch.source_branch > 0:
+        reader = PageReader(env, txn, branches, branch, branch.last_commit)
+        max_page = reader.get_max_page()
+        own_pages = stats['pages']
+        if own_pages > 0:
+            own_pages = count_pages(env, txn, branch.id, max_page)
+        stats['shared_pages'] = max(0, max_page - own_pages)
+
+    return stats
+
+
+def content_stats(env, txn, branches):
+    """ returns how many page versions on the db have the same content,
+        whatever branch or commit stored them. the digests of the contents
+        are kept on a temporary LMDB file instead of in memory """
+
+    entries = 0
+    for branch_id in branches:
+        db = open_subdb(env, txn, branch_id, 'pages')
+        if db is not None:
+            entries += txn.stat(db)['entries']
+
+    stats = {'page_versions': 0, 'bytes': 0, 'unique_contents': 0, 'unique_bytes': 0}
+    tmpdir = tempfile.mkdtemp()
+    digests = lmdb.open(os.path.join(tmpdir, 'digests'), subdir=False, lock=False,
+                        sync=False, metasync=False, map_size=entries * 128 + (1 << 24))
+    try:
+        wtxn = digests.begin(write=True)
+        try:
+            for branch_id in sorted(branches):
+                for version in iter_page_versions(env, txn, branch_id):
+                    size = version.size
+                    stats['page_versions'] += 1
+                    stats['bytes'] += size
+                    digest = hashlib.sha1(version.data).digest()
+                    if wtxn.put(digest, '', overwrite=False):
+                        stats['unique_contents'] += 1
+                        stats['unique_bytes'] += size
+                    if stats['page_versions'] % digest_batch == 0:
+                        wtxn.commit()
+                        wtxn = digests.begin(write=True)
+        finally:
+            wtxn.abort()
+    finally:
+        digests.close()
+        shutil.rmtree(tmpdir)
+
+    stats['duplicate_bytes'] = stats['bytes'] - stats['unique_bytes']
+    return stats
+
+
+class PageReader(object):
+    """ resolves the page versions visible at a given branch and commit.
+        the counters on self.replay_stats show how much work the lookups took
+        on this offline replay: levels_probed / lookups is the average
+        resolution depth. they estimate the work of the engine for the same
+        reads, they are not measured on it.
+        self.found has the (branch_id, key) of the last version returned """
+
+    def __init__(self, env, txn, branches, branch, commit):
+        self.env = env
+        self.txn = txn
+        self.replay_stats = {'lookups': 0, 'levels_probed': 0, 'seeks': 0, 'bytes_read': 0, 'not_found': 0}
+        self.levels = []
+        self.found = None
+        for branch_id, max_commit in ancestry(branches, branch, commit):
+            db = open_subdb(env, txn, branch_id, 'pages')
+            if db is not None:
+                self.levels.append((branch_id, txn.cursor(db=db), max_commit))
+
+    def get_page(self, pgno):
+        """ returns the content of the page or None if it was not found """
+        stats = self.replay_stats
+        stats['lookups'] += 1
+        prefix = varint.encode(pgno)
+        for branch_id, cursor, max_commit in self.levels:
+            stats['levels_probed'] += 1
+            stats['seeks'] += 2
+            # position on the first key bigger than (pgno, max_commit) and go back one
+            if cursor.set_range(prefix + varint.encode(max_commit + 1)):
+                found = cursor.prev()
+            else:
+                found = cursor.last()
+            if not found:
+                continue
+            key = bytes(cursor.key())
+            if key[0:len(prefix)] == prefix:
+                value = cursor.value()
+                stats['bytes_read'] += len(value)
+                self.found = (branch_id, key)
+                return value
+        stats['not_found'] += 1
+        return None
+
+    def get_max_page(self):
+        """ returns the number of pages in the db at this commit """
+        page = self.get_page(1)
+        if page is not None:
+            page = bytes(page[0:100])
+            # the in-header db size is valid when the change counter matches
+            if page[24:28] == page[92:96]:
+                num_pages = struct.unpack('>I', page[28:32])[0]
+                if num_pages > 0:
+                    return num_pages
+        # use the info stored on the maxpage sub-db
+        for branch_id, cursor, max_commit in self.levels:
+            db = open_subdb(self.env, self.txn, branch_id, 'maxpage')
+            if db is None:
+                continue
+            cursor = self.txn.cursor(db=db)
+            if cursor.set_range(varint.encode(max_commit + 1)):
+                found = cursor.prev()
+            else:
+                found = cursor.last()
+            if found:
+                return struct.unpack('I', bytes(cursor.value())[0:4])[0]
+        return 0
+
+
+class LiteTreeFile(object):
+    """ read-only access to a LiteTree db file """
+
+    def __init__(self, filename):
+        self.env = open_env(filename)
+        self.txn = self.env.begin(buffers=True)
+        self.catalog = read_branches(self.txn)
+
+    def close(self):
+        if self.txn is not None:
+            self.txn.abort()
+            self.txn = None
+            self.env.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def branches(self):
+        """ returns the list of branches, ordered by id """
+        return [self.catalog[branch_id] for branch_id in sorted(self.catalog)]
+
+    def branch(self, name):
+        branch = find_branch(self.catalog, name)
+        if branch is None:
+            raise ValueError("branch not found: " + name)
+        return branch
+
+    def page_versions(self, name, min_commit=0, max_commit=None):
+        """ iterates over the page versions written on the branch """
+        return iter_page_versions(self.env, self.txn, self.branch(name).id, min_commit, max_commit)
+
+    def commits(self, name, min_commit=0, max_commit=None):
+        """ iterates over the (commit, max_page) written on the branch """
+        return iter_commits(self.env, self.txn, self.branch(name).id, min_commit, max_commit)
+
+    def reader(self, location):
+        """ returns a PageReader for '<name>[.<commit>]' """
+        branch, commit = parse_location(self.catalog, location)
+        return PageReader(self.env, self.txn, self.catalog, branch, commit)
+
+    def stats(self, name, pages=False):
+        return branch_stats(self.env, self.txn, self.catalog, self.branch(name), pages)
+
+    def content_stats(self):
+        return content_stats(self.env, self.txn, self.catalog)
+
+    def env_status(self):
+        """ returns the LMDB environment info, including the reader slots in use """
+        info = self.env.info()
+        return {
+            'num_readers': info['num_readers'],
+            'max_readers': info['max_readers'],
+            'map_size': info['map_size'],
+            'map_used': (info['last_pgno'] + 1) * self.env.stat()['psize'],
+            'last_txnid': info['last_txnid'],
+        }
@@ -0,0 +1,563 @@
+/*
+** Microbenchmarks for the storage layer
+**
+** Creates a db file with a synthetic layout (a chain of branches, each
+** one created at the head of the previous one) and times the operations
+** done by LiteTree on it, without the SQLite layers on top:
+**
+**   - page key encode and decode
+**   - page version resolution through the ancestry, at the head of the
+**     deepest branch and at old commits of master
+**   - lookups on the -maxpage sub-db
+**   - commit of N dirty pages, with the current pgno-major layout and
+**     with an append-only commit-major log
+**
+** Each branch after the first one writes 1/depth of the pages, so the
+** lookups at the head of the deepest branch are resolved at all levels.
+** The file is a valid LiteTree db and is kept when -keep is used.
+**
+** Build it with: make bench
+** Usage: microbench [options]   (run with -help to see them)
+**
+** Copyright defined in LICENSE.txt
+*/
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <errno.h>
+#include <time.h>
+#include <unistd.h>
+#include <lmdb.h>
+#include "varint.c"
+
+#define MAX_DEPTH   64
+
+/* keeps the compiler from removing the key loops */
+static volatile uint64_t sink;
+
+typedef struct Level Level;
+struct Level {
+  MDB_cursor *cursor;     /* cursor on the b<id>-pages sub-db */
+  uint64_t maxCommit;     /* the last commit visible from this level */
+};
+
+typedef struct Bench Bench;
+struct Bench {
+  const char *zFile;      /* the db file */
+  int nDepth;             /* number of branches on the chain */
+  int nPage;              /* number of pages on the db */
+  int nVersion;           /* versions of each page written per branch */
+  int szPage;             /* page size */
+  int nDirty;             /* dirty pages per commit on the commit benchmark */
+  int nIter;              /* iterations on the lookup benchmarks */
+  int nCommit;            /* commits on the commit benchmark */
+  int noSync;             /* open the env with MDB_NOSYNC */
+  int keep;               /* do not delete the file at the end */
+  uint64_t rand;          /* state of the random number generator */
+  MDB_env *env;
+  uint64_t aSource[MAX_DEPTH+2];     /* source commit of each branch */
+  uint64_t aLast[MAX_DEPTH+2];       /* last commit of each branch */
+};
+
+#define CHECK(X)  do{ rc = (X); if( rc!=MDB_SUCCESS ){ \
+    fprintf(stderr, "\nerror at line %d: %s\n", __LINE__, mdb_strerror(rc)); \
+    goto end; } }while(0)
+
+static uint64_t nextRandom(Bench *p){
+  /* xorshift64 */
+  p->rand ^= p->rand << 13;
+  p->rand ^= p->rand >> 7;
+  p->rand ^= p->rand << 17;
+  return p->rand;
+}
+
+static double now(void){
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static int pageKey(unsigned char *z, uint64_t pgno, uint64_t commit){
+  int n = putVarint64(z, pgno);
+  return n + putVarint64(z+n, commit);
+}
+
+static int openSubDb(MDB_txn *txn, int branch_id, const char *zKind, unsigned flags, MDB_dbi *pDbi){
+  char zName[64];
+  sprintf(zName, "b%d-%s", branch_id, zKind);
+  return mdb_dbi_open(txn, zName, flags, pDbi);
+}
+
+static int putCatalogVarint(MDB_txn *txn, MDB_dbi dbi, const char *zKey, uint64_t value){
+  unsigned char buf[9];
+  MDB_val key, data;
+  key.mv_data = (void*)zKey;
+  key.mv_size = strlen(zKey);
+  data.mv_data = buf;
+  data.mv_size = putVarint64(buf, value);
+  return mdb_put(txn, dbi, &key, &data, 0);
+}
+
+/*
+** Writes the catalog entries of the branch
+*/
+static int writeBranchInfo(Bench *p, MDB_txn *txn, int branch_id, const char *zName){
+  MDB_dbi dbi;
+  MDB_val key, data;
+  char zKey[64];
+  int rc;
+
+  CHECK( mdb_dbi_open(txn, NULL, 0, &dbi) );
+  sprintf(zKey, "b%d.name", branch_id);
+  key.mv_data = zKey;
+  key.mv_size = strlen(zKey);
+  data.mv_data = (void*)zName;
+  data.mv_size = strlen(zName) + 1;
+  CHECK( mdb_put(txn, dbi, &key, &data, 0) );
+  sprintf(zKey, "b%d.visible", branch_id);
+  CHECK( putCatalogVarint(txn, dbi, zKey, 1) );
+  sprintf(zKey, "b%d.source_branch", branch_id);
+  CHECK( putCatalogVarint(txn, dbi, zKey, branch_id>1 ? branch_id-1 : 0) );
+  sprintf(zKey, "b%d.source_commit", branch_id);
+  CHECK( putCatalogVarint(txn, dbi, zKey, p->aSource[branch_id]) );
+  sprintf(zKey, "b%d.last_commit", branch_id);
+  CHECK( putCatalogVarint(txn, dbi, zKey, p->aLast[branch_id]) );
+  CHECK( putCatalogVarint(txn, dbi, "last_branch_id", branch_id) );
+  CHECK( putCatalogVarint(txn, dbi, "change_counter", p->aLast[branch_id]) );
+
+end:
+  return rc;
+}
+
+/*
+** Creates the branches with their page versions. The keys are written
+** in order using MDB_APPEND
+*/
+static int createLayout(Bench *p){
+  unsigned char *aPage = 0;
+  unsigned char zKey[18];
+  MDB_txn *txn = 0;
+  MDB_dbi pages, maxpage;
+  MDB_val key, data;
+  uint32_t max_page = p->nPage;
+  uint64_t pgno, commit;
+  char zName[32];
+  int b, rc;
+
+  aPage = malloc(p->szPage);
+  if( aPage==0 ) return ENOMEM;
+  memset(aPage, 0, p->szPage);
+
+  for(b=1; b<=p->nDepth; b++){
+    p->aSource[b] = b>1 ? p->aLast[b-1] : 0;
+    p->aLast[b] = p->aSource[b] + p->nVersion;
+
+    CHECK( mdb_txn_begin(p->env, NULL, 0, &txn) );
+    CHECK( openSubDb(txn, b, "pages", MDB_CREATE, &pages) );
+    CHECK( openSubDb(txn, b, "maxpage", MDB_CREATE, &maxpage) );
+
+    for(pgno=1; pgno<=(uint64_t)p->nPage; pgno++){
+      /* master has all the pages, the other branches 1/depth of them */
+      if( b>1 && (int)((pgno-1) % p->nDepth)!=b-1 ) continue;
+      for(commit=p->aSource[b]+1; commit<=p->aLast[b]; commit++){
+        memcpy(aPage, &commit, sizeof(commit));
+        key.mv_data = zKey;
+        key.mv_size = pageKey(zKey, pgno, commit);
+        data.mv_data = aPage;
+        data.mv_size = p->szPage;
+        CHECK( mdb_put(txn, pages, &key, &data, MDB_APPEND) );
+      }
+    }
+
+    for(commit=p->aSource[b]+1; commit<=p->aLast[b]; commit++){
+      key.mv_data = zKey;
+      key.mv_size = putVarint64(zKey, commit);
+      data.mv_data = &max_page;
+      data.mv_size = sizeof(max_page);
+      CHECK( mdb_put(txn, maxpage, &key, &data, MDB_APPEND) );
+    }
+
+    if( b==1 ){
+      strcpy(zName, "master");
+    }else{
+      sprintf(zName, "d%d", b-1);
+    }
+    CHECK( writeBranchInfo(p, txn, b, zName) );
+
+    rc = mdb_txn_commit(txn);
+    txn = 0;
+    if( rc!=MDB_SUCCESS ) goto end;
+  }
+
+end:
+  if( txn ) mdb_txn_abort(txn);
+  free(aPage);
+  return rc;
+}
+
+/*
+** Returns the page version visible from the levels. Works like the
+** page lookup on LiteTree: position on the first key after (pgno,
+** maxCommit) and go back one
+*/
+static int lookupPage(Level *aLevel, int nLevel, uint64_t pgno, MDB_val *pData, int *pnProbe){
+  unsigned char zKey[18];
+  unsigned char zPrefix[9];
+  MDB_val key;
+  int nPrefix = putVarint64(zPrefix, pgno);
+  int i, rc;
+
+  for(i=0; i<nLevel; i++){
+    (*pnProbe)++;
+    memcpy(zKey, zPrefix, nPrefix);
+    key.mv_data = zKey;
+    key.mv_size = nPrefix + putVarint64(zKey+nPrefix, aLevel[i].maxCommit+1);
+    rc = mdb_cursor_get(aLevel[i].cursor, &key, pData, MDB_SET_RANGE);
+    if( rc==MDB_SUCCESS ){
+      rc = mdb_cursor_get(aLevel[i].cursor, &key, pData, MDB_PREV);
+    }else if( rc==MDB_NOTFOUND ){
+      rc = mdb_cursor_get(aLevel[i].cursor, &key, pData, MDB_LAST);
+    }
+    if( rc==MDB_NOTFOUND ) continue;
+    if( rc!=MDB_SUCCESS ) return rc;
+    if( key.mv_size>(size_t)nPrefix && memcmp(key.mv_data, zPrefix, nPrefix)==0 ){
+      return MDB_SUCCESS;
+    }
+  }
+  return MDB_NOTFOUND;
+}
+
+static void report(const char *zName, double elapsed, int nOp, const char *zExtra){
+  double perOp = elapsed / nOp;
+  if( perOp<1e-3 ){
+    printf("%-28s %12.1f ns/op  %s\n", zName, perOp * 1e9, zExtra);
+  }else{
+    printf("%-28s %12.3f ms/op  %s\n", zName, perOp * 1e3, zExtra);
+  }
+}
+
+static int benchKeys(Bench *p){
+  unsigned char zKey[18];
+  uint64_t pgno, commit, sum = 0;
+  double start;
+  int i, n;
+
+  start = now();
+  for(i=0; i<p->nIter; i++){
+    n = pageKey(zKey, nextRandom(p) % p->nPage + 1, nextRandom(p) & 0xffffffffff);
+    sum += zKey[n-1];
+  }
+  report("key encode", now() - start, p->nIter, "");
+
+  start = now();
+  for(i=0; i<p->nIter; i++){
+    n = pageKey(zKey, (uint64_t)i % p->nPage + 1, (uint64_t)i * 7919);
+    n = getVarint64(zKey, n, &pgno);
+    getVarint64(zKey+n, 9, &commit);
+    sum += pgno + commit;
+  }
+  report("key encode + decode", now() - start, p->nIter, "");
+
+  sink = sum;
+  return MDB_SUCCESS;
+}
+
+/*
+** Times the page lookups from the branch at the commit
+*/
+static int benchLookups(Bench *p, const char *zName, int branch_id, uint64_t commit, int randomCommit){
+  Level aLevel[MAX_DEPTH];
+  MDB_txn *txn = 0;
+  MDB_dbi dbi;
+  MDB_val data;
+  char zExtra[64];
+  int nLevel = 0, nProbe = 0, nFound = 0;
+  double start;
+  int i, b, rc;
+
+  memset(aLevel, 0, sizeof(aLevel));
+  CHECK( mdb_txn_begin(p->env, NULL, MDB_RDONLY, &txn) );
+  for(b=branch_id; b>=1; b--){
+    uint64_t maxCommit = b==branch_id ? commit : p->aSource[b+1];
+    CHECK( openSubDb(txn, b, "pages", 0, &dbi) );
+    CHECK( mdb_cursor_open(txn, dbi, &aLevel[nLevel].cursor) );
+    aLevel[nLevel].maxCommit = maxCommit;
+    nLevel++;
+  }
+
+  start = now();
+  for(i=0; i<p->nIter; i++){
+    if( randomCommit ){
+      aLevel[0].maxCommit = nextRandom(p) % commit + 1;
+    }
+    rc = lookupPage(aLevel, nLevel, nextRandom(p) % p->nPage + 1, &data, &nProbe);
+    if( rc==MDB_SUCCESS ){
+      nFound++;
+    }else if( rc!=MDB_NOTFOUND ){
+      goto end;
+    }
+  }
+  sprintf(zExtra, "%.2f levels/lookup", (double)nProbe / p->nIter);
+  report(zName, now() - start, p->nIter, zExtra);
+  rc = nFound==p->nIter ? MDB_SUCCESS : MDB_NOTFOUND;
+
+end:
+  for(i=0; i<nLevel; i++){
+    mdb_cursor_close(aLevel[i].cursor);
+  }
+  if( txn ) mdb_txn_abort(txn);
+  return rc;
+}
+
+static int benchMaxPage(Bench *p){
+  unsigned char zKey[9];
+  MDB_cursor *cursor = 0;
+  MDB_txn *txn = 0;
+  MDB_dbi dbi;
+  MDB_val key, data;
+  double start;
+  int i, rc;
+
+  CHECK( mdb_txn_begin(p->env, NULL, MDB_RDONLY, &txn) );
+  CHECK( openSubDb(txn, 1, "maxpage", 0, &dbi) );
+  CHECK( mdb_cursor_open(txn, dbi, &cursor) );
+
+  start = now();
+  for(i=0; i<p->nIter; i++){
+    uint64_t commit = nextRandom(p) % p->aLast[1] + 1;
+    key.mv_data = zKey;
+    key.mv_size = putVarint64(zKey, commit + 1);
+    rc = mdb_cursor_get(cursor, &key, &data, MDB_SET_RANGE);
+    if( rc==MDB_SUCCESS ){
+      rc = mdb_cursor_get(cursor, &key, &data, MDB_PREV);
+    }else if( rc==MDB_NOTFOUND ){
+      rc = mdb_cursor_get(cursor, &key, &data, MDB_LAST);
+    }
+    if( rc!=MDB_SUCCESS ) goto end;
+  }
+  report("maxpage lookup", now() - start, p->nIter, "");
+
+end:
+  if( cursor ) mdb_cursor_close(cursor);
+  if( txn ) mdb_txn_abort(txn);
+  return rc;
+}
+
+static int cmpPgno(const void *a, const void *b){
+  uint64_t x = *(const uint64_t*)a, y = *(const uint64_t*)b;
+  return x<y ? -1 : x>y;
+}
+
+/*
+** Fills aPgno with up to nDirty distinct random page numbers, in order,
+** as the pager writes them. Returns how many were selected
+*/
+static int selectDirtyPages(Bench *p, uint64_t *aPgno){
+  int i, n = 0;
+  for(i=0; i<p->nDirty; i++){
+    aPgno[i] = nextRandom(p) % p->nPage + 1;
+  }
+  qsort(aPgno, p->nDirty, sizeof(uint64_t), cmpPgno);
+  for(i=0; i<p->nDirty; i++){
+    if( n==0 || aPgno[i]!=aPgno[n-1] ) aPgno[n++] = aPgno[i];
+  }
+  return n;
+}
+
+/*
+** Times commits of nDirty pages on a new branch created at the head of
+** the deepest branch. Each commit writes the pages, the -maxpage entry
+** and updates the catalog, as done by LiteTree.
+**
+** With the commit-major layout the pages are written to a log keyed by
+** varint(commit) + varint(pgno) instead, so all the keys of a commit are
+** appended at the end of the B-tree with MDB_APPEND. The pgno-major
+** index needed by the lookups would be built later, so it is not timed.
+** The log is kept on a separate sub-db, not used by LiteTree.
+*/
+static int benchCommit(Bench *p, int commitMajor){
+  int branch_id = p->nDepth + 1;
+  unsigned char *aPage = 0;
+  unsigned char zKey[18];
+  uint64_t *aPgno = 0;
+  MDB_txn *txn = 0;
+  MDB_dbi pages, maxpage, mainDb;
+  MDB_val key, data;
+  uint32_t max_page = p->nPage;
+  uint64_t commit;
+  char zKeyName[64];
+  char zExtra[64];
+  double start;
+  int nPage = 0;
+  int i, j, n, rc;
+
+  aPage = malloc(p->szPage);
+  aPgno = malloc(p->nDirty * sizeof(uint64_t));
+  if( aPage==0 || aPgno==0 ){
+    rc = ENOMEM;
+    goto end;
+  }
+  memset(aPage, 0, p->szPage);
+
+  if( p->aLast[branch_id]==0 ){
+    p->aSource[branch_id] = p->aLast[p->nDepth];
+    p->aLast[branch_id] = p->aLast[p->nDepth];
+    CHECK( mdb_txn_begin(p->env, NULL, 0, &txn) );
+    CHECK( writeBranchInfo(p, txn, branch_id, "bench") );
+    rc = mdb_txn_commit(txn);
+    txn = 0;
+    if( rc!=MDB_SUCCESS ) goto end;
+  }
+
+  start = now();
+  for(i=0; i<p->nCommit; i++){
+    commit = ++p->aLast[branch_id];
+    CHECK( mdb_txn_begin(p->env, NULL, 0, &txn) );
+    if( commitMajor ){
+      CHECK( mdb_dbi_open(txn, "bench-log", MDB_CREATE, &pages) );
+    }else{
+      CHECK( openSubDb(txn, branch_id, "pages", MDB_CREATE, &pages) );
+    }
+    CHECK( openSubDb(txn, branch_id, "maxpage", MDB_CREATE, &maxpage) );
+    CHECK( mdb_dbi_open(txn, NULL, 0, &mainDb) );
+    n = selectDirtyPages(p, aPgno);
+    nPage += n;
+    for(j=0; j<n; j++){
+      memcpy(aPage, &commit, sizeof(commit));
+      key.mv_data = zKey;
+      if( commitMajor ){
+        key.mv_size = pageKey(zKey, commit, aPgno[j]);
+      }else{
+        key.mv_size = pageKey(zKey, aPgno[j], commit);
+      }
+      data.mv_data = aPage;
+      data.mv_size = p->szPage;
+      CHECK( mdb_put(txn, pages, &key, &data, commitMajor ? MDB_APPEND : 0) );
+    }
+    key.mv_data = zKey;
+    key.mv_size = putVarint64(zKey, commit);
+    data.mv_data = &max_page;
+    data.mv_size = sizeof(max_page);
+    CHECK( mdb_put(txn, maxpage, &key, &data, MDB_APPEND) );
+    sprintf(zKeyName, "b%d.last_commit", branch_id);
+    CHECK( putCatalogVarint(txn, mainDb, zKeyName, commit) );
+    CHECK( putCatalogVarint(txn, mainDb, "change_counter", commit) );
+    rc = mdb_txn_commit(txn);
+    txn = 0;
+    if( rc!=MDB_SUCCESS ) goto end;
+  }
+  sprintf(zExtra, "%.0f dirty pages%s", (double)nPage / p->nCommit, p->noSync ? ", no sync" : "");
+  report(commitMajor ? "commit (commit-major log)" : "commit (pgno-major)",
+         now() - start, p->nCommit, zExtra);
+
+end:
+  if( txn ) mdb_txn_abort(txn);
+  free(aPgno);
+  free(aPage);
+  return rc;
+}
+
+static void usage(const char *zProg){
+  printf("usage: %s [options]\n", zProg);
+  printf("  -file FILE        db file to create (default: microbench.db)\n");
+  printf("  -depth N          branches on the chain (default: 8, max: %d)\n", MAX_DEPTH);
+  printf("  -pages N          pages on the db (default: 2000)\n");
+  printf("  -versions N       versions of each page per branch (default: 10)\n");
+  printf("  -pagesize N       page size (default: 4096)\n");
+  printf("  -dirty N          dirty pages per commit (default: 100)\n");
+  printf("  -commits N        commits to time (default: 100)\n");
+  printf("  -iterations N     lookups to time (default: 1000000)\n");
+  printf("  -seed N           random seed (default: 1)\n");
+  printf("  -nosync           do not flush the commits to disk\n");
+  printf("  -keep             keep the db file\n");
+}
+
+int main(int argc, char **argv){
+  Bench bench;
+  Bench *p = &bench;
+  char zLock[1024];
+  size_t mapSize;
+  int i, rc = MDB_SUCCESS;
+
+  memset(p, 0, sizeof(bench));
+  p->zFile = "microbench.db";
+  p->nDepth = 8;
+  p->nPage = 2000;
+  p->nVersion = 10;
+  p->szPage = 4096;
+  p->nDirty = 100;
+  p->nCommit = 100;
+  p->nIter = 1000000;
+  p->rand = 1;
+
+  for(i=1; i<argc; i++){
+    const char *z = argv[i];
+    if( strcmp(z, "-nosync")==0 ){
+      p->noSync = 1;
+    }else if( strcmp(z, "-keep")==0 ){
+      p->keep = 1;
+    }else if( i+1<argc && strcmp(z, "-file")==0 ){
+      p->zFile = argv[++i];
+    }else if( i+1<argc && strcmp(z, "-depth")==0 ){
+      p->nDepth = atoi(argv[++i]);
+    }else if( i+1<argc && strcmp(z, "-pages")==0 ){
+      p->nPage = atoi(argv[++i]);
+    }else if( i+1<argc && strcmp(z, "-versions")==0 ){
+      p->nVersion = atoi(argv[++i]);
+    }else if( i+1<argc && strcmp(z, "-pagesize")==0 ){
+      p->szPage = atoi(argv[++i]);
+    }else if( i+1<argc && strcmp(z, "-dirty")==0 ){
+      p->nDirty = atoi(argv[++i]);
+    }else if( i+1<argc && strcmp(z, "-commits")==0 ){
+      p->nCommit = atoi(argv[++i]);
+    }else if( i+1<argc && strcmp(z, "-iterations")==0 ){
+      p->nIter = atoi(argv[++i]);
+    }else if( i+1<argc && strcmp(z, "-seed")==0 ){
+      p->rand = strtoull(argv[++i], 0, 10);
+    }else{
+      usage(argv[0]);
+      return 1;
+    }
+  }
+  if( p->nDepth<1 || p->nDepth>MAX_DEPTH || p->nPage<1 || p->nVersion<1 || p->szPage<8
+   || p->nDirty<1 || p->nCommit<1 || p->nIter<1 ){
+    usage(argv[0]);
+    return 1;
+  }
+  if( p->rand==0 ) p->rand = 1;
+
+  if( access(p->zFile, F_OK)==0 ){
+    fprintf(stderr, "the file already exists: %s\n", p->zFile);
+    return 1;
+  }
+
+  /* room for all the page versions, with the LMDB overhead */
+  mapSize = ((size_t)p->nPage * p->nVersion * 2 + (size_t)p->nDirty * p->nCommit * 2)
+            * (p->szPage + 64) * 3 + (64 << 20);
+
+  CHECK( mdb_env_create(&p->env) );
+  CHECK( mdb_env_set_maxdbs(p->env, 1024) );
+  CHECK( mdb_env_set_mapsize(p->env, mapSize) );
+  CHECK( mdb_env_open(p->env, p->zFile, MDB_NOSUBDIR | (p->noSync ? MDB_NOSYNC : 0), 0664) );
+
+  printf("layout: depth=%d pages=%d versions=%d page_size=%d\n",
+         p->nDepth, p->nPage, p->nVersion, p->szPage);
+  CHECK( createLayout(p) );
+
+  CHECK( benchKeys(p) );
+  CHECK( benchLookups(p, "page lookup (head)", p->nDepth, p->aLast[p->nDepth], 0) );
+  CHECK( benchLookups(p, "page lookup (master history)", 1, p->aLast[1], 1) );
+  CHECK( benchMaxPage(p) );
+  CHECK( benchCommit(p, 0) );
+  CHECK( benchCommit(p, 1) );
+
+end:
+  if( p->env ) mdb_env_close(p->env);
+  if( !p->keep ){
+    sprintf(zLock, "%.1000s-lock", p->zFile);
+    remove(p->zFile);
+    remove(zLock);
+  }
+  return rc==MDB_SUCCESS ? 0 : 1;
+}
@@ -0,0 +1,78 @@
+#
+# Creates many branches from the same commit at once
+#
+# All the catalog entries are written on a single LMDB write transaction,
+# instead of one transaction per PRAGMA new_branch. The branches are
+# named <prefix>1 to <prefix><count>:
+#
+#   python new-branches.py data.db tx 16 master.1000
+#
+# The new branches have no commits, so only the catalog is written. As on
+# PRAGMA new_branch, a commit made before the branch point is searched on
+# the source branches, and the branch that has it becomes the source.
+#
+# Copyright defined in LICENSE.txt
+#
+import re
+import sys
+import lmdb
+import varint
+import litetree
+
+valid_name = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+
+def new_branches(filename, prefix, count, location):
+    """ creates the branches and returns their names """
+
+    if count < 1:
+        raise ValueError("invalid number of branches: " + str(count))
+    names = [prefix + str(n) for n in range(1, count + 1)]
+    for name in names:
+        if not valid_name.match(name):
+            raise ValueError("invalid branch name: " + name)
+
+    env = litetree.open_env(filename, readonly=False)
+    try:
+        with env.begin(write=True) as txn:
+            branches = litetree.read_branches(txn)
+            source, commit = litetree.parse_location(branches, location)
+            if commit < 1:
+                raise ValueError("commit not found: " + location)
+            while commit <= source.source_commit:
+                source = branches[source.source_branch]
+            for name in names:
+                if litetree.find_branch(branches, name) is not None:
+                    raise ValueError("the branch already exists: " + name)
+
+            last_branch_id = litetree.read_varint(txn, 'last_branch_id')
+            for branch_id, name in enumerate(names, last_branch_id + 1):
+                prefix_key = 'b' + str(branch_id)
+                txn.put(prefix_key + '.name', name + '\x00')
+                txn.put(prefix_key + '.visible', varint.encode(1))
+                txn.put(prefix_key + '.source_branch', varint.encode(source.id))
+                txn.put(prefix_key + '.source_commit', varint.encode(commit))
+                txn.put(prefix_key + '.last_commit', varint.encode(commit))
+            txn.put('last_branch_id', varint.encode(last_branch_id + count))
+            change_counter = litetree.read_varint(txn, 'change_counter')
+            txn.put('change_counter', varint.encode(change_counter + 1))
+    finally:
+        env.close()
+
+    return names
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 5 or not sys.argv[3].isdigit():
+        print('usage: python ' + sys.argv[0] + ' <db_file> <prefix> <count> <branch>.<commit>')
+        quit()
+
+    try:
+        names = new_branches(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    except (ValueError, lmdb.Error) as e:
+        print('error: ' + str(e))
+        sys.exit(1)
+
+    print('created ' + str(len(names)) + ' branches: ' + names[0] + ' to ' + names[-1])
@@ -0,0 +1,218 @@
+#
+# Online backup of a LiteTree db
+#
+# The copy is made from a LMDB read snapshot, so the writers are not
+# blocked while the backup is running. The interface is similar to the
+# sqlite3_backup API: step(), remaining(), pagecount() and finish()
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import sys
+import time
+import lmdb
+import varint
+import litetree
+
+
+def backup_ranges(branches, names):
+    """ returns a dict {branch_id: max_commit} with the branches to be copied.
+        the ancestors of the selected branches are copied up to the commit
+        used by their children. None means the whole branch """
+
+    if names is None:
+        return dict((branch_id, None) for branch_id in branches)
+
+    ranges = {}
+    for name in names:
+        branch = litetree.find_branch(branches, name)
+        if branch is None:
+            raise ValueError("branch not found: " + name)
+        ranges[branch.id] = None
+        while branch.source_branch > 0:
+            commit = branch.source_commit
+            branch = branches[branch.source_branch]
+            if branch.id in ranges:
+                if ranges[branch.id] is None or ranges[branch.id] >= commit:
+                    break
+            ranges[branch.id] = commit
+
+    return ranges
+
+
+class Backup(object):
+
+    def __init__(self, filename, target, branches=None, max_rate=0):
+        """ branches: list of branch names to copy, or None for all
+            max_rate: maximum number of bytes copied per second, 0 for no limit """
+
+        if not os.path.exists(filename):
+            raise IOError("the file does not exist: " + filename)
+        if os.path.exists(target):
+            raise IOError("the target file already exists: " + target)
+
+        self.env = litetree.open_env(filename)
+        self.txn = self.env.begin(buffers=True)
+
+        self.catalog = litetree.read_branches(self.txn)
+        try:
+            self.ranges = backup_ranges(self.catalog, branches)
+        except ValueError:
+            self.txn.abort()
+            self.env.close()
+            raise
+
+        self.target = lmdb.open(target, subdir=False, max_dbs=1024,
+                                map_size=self.env.info()['map_size'])
+
+        self.max_rate = max_rate
+        self.bytes_copied = 0
+        self.start_time = time.time()
+
+        # the sub-dbs to be copied, with the number of entries on each one
+        self.jobs = []
+        self.total = 0
+        for key, value in self.txn.cursor():
+            match = litetree.subdb_name.match(bytes(key))
+            if match is None:
+                continue
+            branch_id = int(match.group(1))
+            if branch_id not in self.ranges:
+                continue
+            db = self.env.open_db(bytes(key), txn=self.txn, create=False)
+            entries = self.txn.stat(db)['entries']
+            self.jobs.append((bytes(key), db, match.group(2), self.ranges[branch_id]))
+            self.total += entries
+
+        self.target_dbs = {}
+        self.copied = 0
+        self.cursor = None
+        self.done = False
+
+    def pagecount(self):
+        return self.total
+
+    def remaining(self):
+        return self.total - self.copied
+
+    def step(self, num_entries=-1):
+        """ copies up to num_entries entries. returns True when the backup is complete """
+
+        if self.done:
+            return True
+
+        with self.target.begin(write=True) as txn:
+            count = 0
+            while len(self.jobs) > 0 and (num_entries < 0 or count < num_entries):
+                dbname, db, kind, max_commit = self.jobs[0]
+                target_db = self.target_dbs.get(dbname)
+                if target_db is None:
+                    target_db = self.target.open_db(dbname, txn=txn)
+                    self.target_dbs[dbname] = target_db
+                if self.cursor is None:
+                    self.cursor = self.txn.cursor(db=db)
+                    if not self.cursor.first():
+                        self.next_job()
+                        continue
+                key = self.cursor.key()
+                value = self.cursor.value()
+                if self.in_range(kind, bytes(key), max_commit):
+                    txn.put(key, value, db=target_db, append=True)
+                    self.bytes_copied += len(key) + len(value)
+                self.copied += 1
+                count += 1
+                if not self.cursor.next():
+                    self.next_job()
+            if len(self.jobs) == 0:
+                self.copy_catalog(txn)
+                self.done = True
+
+        self.throttle()
+        return self.done
+
+    def next_job(self):
+        self.jobs.pop(0)
+        self.cursor = None
+
+    def in_range(self, kind, key, max_commit):
+        if max_commit is None:
+            return True
+        if kind == 'pages':
+            return varint.decode_key(key)[1] <= max_commit
+        if kind in ('maxpage', 'log'):
+            return varint.decode(key)[0] <= max_commit
+        # other sub-dbs are only copied for the selected branches
+        return False
+
+    def copy_catalog(self, txn):
+        # it is written at the end so an incomplete backup cannot be opened
+        for key, value in self.txn.cursor():
+            key = bytes(key)
+            if litetree.subdb_name.match(key):
+                continue
+            match = litetree.catalog_key.match(key)
+            if match is not None:
+                branch_id = int(match.group(1))
+                if branch_id not in self.ranges:
+                    continue
+                max_commit = self.ranges[branch_id]
+                if max_commit is not None and key.endswith('.last_commit'):
+                    value = varint.encode(max_commit)
+            txn.put(key, value)
+
+    def throttle(self):
+        if self.max_rate > 0:
+            expected = float(self.bytes_copied) / self.max_rate
+            elapsed = time.time() - self.start_time
+            if expected > elapsed:
+                time.sleep(expected - elapsed)
+
+    def finish(self):
+        self.txn.abort()
+        self.env.close()
+        self.target.sync(True)
+        self.target.close()
+        return self.done
+
+
+def backup(filename, target, branches=None, max_rate=0, step_size=1000, progress=None):
+
+    if os.path.exists(target):
+        raise IOError("the target file already exists: " + target)
+
+    if branches is None and max_rate == 0:
+        # full copy made by LMDB with compaction (mdb_env_copy2)
+        env = litetree.open_env(filename)
+        env.copy(target, compact=True)
+        env.close()
+        return
+
+    bkp = Backup(filename, target, branches, max_rate)
+    try:
+        while not bkp.step(step_size):
+            if progress is not None:
+                progress(bkp.remaining(), bkp.pagecount())
+    finally:
+        bkp.finish()
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='online backup of a LiteTree db')
+    parser.add_argument('db_file')
+    parser.add_argument('target_file')
+    parser.add_argument('--branch', action='append', dest='branches',
+                        help='copy only this branch and its ancestor ranges. can be repeated')
+    parser.add_argument('--max-rate', type=int, default=0,
+                        help='maximum bytes copied per second')
+    args = parser.parse_args()
+
+    def progress(remaining, total):
+        sys.stdout.write('\r%d of %d entries copied' % (total - remaining, total))
+        sys.stdout.flush()
+
+    backup(args.db_file, args.target_file, args.branches, args.max_rate, progress=progress)
+
+    print('\ndone')
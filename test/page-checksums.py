@@ -0,0 +1,287 @@
+#
+# Checksums of the page versions, to detect silent corruption
+#
+# The CRC-32 of each page version is stored on a separate LMDB file,
+# <db_file>-checksums, with one sub-db per branch (b<id>) using the same
+# keys as the b<id>-pages sub-db. The db file is only read.
+#
+# update adds the checksums of the versions written since the last update
+# (the watermark is the last commit of each branch, with a digest of its
+# content). It must run again after new commits. The checksums of a branch
+# are recomputed when its last commit went back or the digest changed, as
+# the commits discarded (branch_truncate, discard_commits) can be written
+# again with the same numbers.
+#
+# verify reads the page versions on many processes. Each version is
+# stored once, on the branch that wrote it, so it is checked once even
+# when it is visible on many branches. With branch names only the
+# versions visible on these branches are checked:
+#
+#   python page-checksums.py update data.db
+#   python page-checksums.py verify data.db [--processes <n>] [<branch>...]
+#
+# ChecksumReader checks the pages returned by a PageReader.
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import sys
+import zlib
+import struct
+import multiprocessing
+import lmdb
+import varint
+import litetree
+
+# page versions checked on each verification job
+job_size = 10000
+
+
+def checksum(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def open_checksums(filename, readonly=True):
+    path = filename + '-checksums'
+    if readonly and not os.path.exists(path):
+        raise ValueError("no checksums for the db. run: update " + filename)
+    map_size = os.path.getsize(filename) // 8 + (1 << 24)
+    if os.path.exists(path):
+        map_size += os.path.getsize(path)
+    return lmdb.open(path, subdir=False, max_dbs=1024, readonly=readonly, map_size=map_size)
+
+
+def open_branch_db(env, txn, branch_id, create=False):
+    try:
+        return env.open_db('b' + str(branch_id), txn=txn, create=create)
+    except lmdb.NotFoundError:
+        return None
+
+
+def update(filename):
+    """ stores the checksums of the new page versions and returns how many were added """
+
+    count = 0
+    env = litetree.open_env(filename)
+    out = open_checksums(filename, readonly=False)
+    try:
+        with env.begin(buffers=True) as txn:
+            branches = litetree.read_branches(txn)
+            with out.begin(write=True) as wtxn:
+                # drop the checksums of the deleted branches
+                for key, value in list(wtxn.cursor()):
+                    if not key.endswith('.last_commit'):
+                        continue
+                    branch_id = int(key[1:].split('.')[0])
+                    if branch_id not in branches:
+                        db = open_branch_db(out, wtxn, branch_id)
+                        if db is not None:
+                            wtxn.drop(db)
+                        wtxn.delete(key)
+                        wtxn.delete('b' + str(branch_id) + '.digest')
+
+            for branch_id in sorted(branches):
+                branch = branches[branch_id]
+                prefix = 'b' + str(branch_id)
+                with out.begin(write=True) as wtxn:
+                    watermark = litetree.read_varint(wtxn, prefix + '.last_commit')
+                    digest = wtxn.get(prefix + '.digest')
+                    if watermark > 0 and (branch.last_commit < watermark or
+                            litetree.commit_digest(env, txn, branch_id, watermark) != digest):
+                        # the commits were discarded, and maybe written again
+                        db = open_branch_db(out, wtxn, branch_id)
+                        if db is not None:
+                            wtxn.drop(db)
+                        watermark = 0
+                    if branch.last_commit == watermark:
+                        continue
+                    db = open_branch_db(out, wtxn, branch_id, create=True)
+                    for version in litetree.iter_page_versions(env, txn, branch_id, watermark + 1):
+                        wtxn.put(version.key, struct.pack('>I', checksum(version.data)), db=db)
+                        count += 1
+                    wtxn.put(prefix + '.last_commit', varint.encode(branch.last_commit))
+                    wtxn.put(prefix + '.digest', litetree.commit_digest(env, txn, branch_id, branch.last_commit))
+    finally:
+        out.close()
+        env.close()
+
+    return count
+
+
+def verify_job(job):
+    """ checks the versions of a sub-db within a range of pages.
+        returns (checked, unchecked, [(branch_id, pgno, commit)]) """
+
+    filename, branch_id, min_pgno, max_pgno, max_commit = job
+    checked = 0
+    unchecked = 0
+    errors = []
+    env = litetree.open_env(filename)
+    sums = open_checksums(filename)
+    try:
+        with env.begin(buffers=True) as txn:
+            with sums.begin(buffers=True) as stxn:
+                db = open_branch_db(sums, stxn, branch_id)
+                versions = litetree.iter_page_versions(env, txn, branch_id, max_commit=max_commit,
+                                                       min_pgno=min_pgno, max_pgno=max_pgno)
+                for version in versions:
+                    expected = None
+                    if db is not None:
+                        expected = stxn.get(version.key, db=db)
+                    if expected is None:
+                        unchecked += 1
+                        continue
+                    checked += 1
+                    if struct.unpack('>I', bytes(expected))[0] != checksum(version.data):
+                        errors.append((branch_id, version.pgno, version.commit))
+    finally:
+        sums.close()
+        env.close()
+    return (checked, unchecked, errors)
+
+
+def make_jobs(env, txn, filename, branch_id, max_commit):
+    """ splits the sub-db in ranges of pages with about job_size versions each """
+
+    db = litetree.open_subdb(env, txn, branch_id, 'pages')
+    if db is None:
+        return []
+    cursor = txn.cursor(db=db)
+    if not cursor.first():
+        return []
+    first = varint.decode(cursor.key())[0]
+    cursor.last()
+    last = varint.decode(cursor.key())[0]
+    num_jobs = max(1, txn.stat(db)['entries'] // job_size)
+    step = (last - first) // num_jobs + 1
+    return [(filename, branch_id, pgno, pgno + step - 1, max_commit)
+            for pgno in range(first, last + 1, step)]
+
+
+def verify(filename, names=None, processes=None):
+    """ returns a dict with the number of versions checked, the ones without
+        checksum and the list of corrupted versions (branch, pgno, commit) """
+
+    # the commits to check on each sub-db
+    ranges = {}
+    env = litetree.open_env(filename)
+    try:
+        with env.begin(buffers=True) as txn:
+            branches = litetree.read_branches(txn)
+            if names is None:
+                for branch_id in branches:
+                    ranges[branch_id] = None
+            else:
+                for name in names:
+                    branch = litetree.find_branch(branches, name)
+                    if branch is None:
+                        raise ValueError("branch not found: " + name)
+                    for branch_id, max_commit in litetree.ancestry(branches, branch, branch.last_commit):
+                        if branch_id in ranges:
+                            max_commit = max(max_commit, ranges[branch_id])
+                        ranges[branch_id] = max_commit
+            jobs = []
+            for branch_id in sorted(ranges):
+                jobs += make_jobs(env, txn, filename, branch_id, ranges[branch_id])
+    finally:
+        env.close()
+
+    # fail early if there are no checksums
+    open_checksums(filename).close()
+
+    if processes == 1 or len(jobs) <= 1:
+        results = [verify_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(verify_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    result = {'checked': 0, 'unchecked': 0, 'errors': []}
+    for checked, unchecked, errors in results:
+        result['checked'] += checked
+        result['unchecked'] += unchecked
+        for branch_id, pgno, commit in errors:
+            result['errors'].append((branches[branch_id].name, pgno, commit))
+    result['errors'].sort()
+    return result
+
+
+class ChecksumReader(object):
+    """ a PageReader that checks the pages it returns. the versions without
+        checksum are returned unchecked """
+
+    def __init__(self, db, location):
+        self.reader = db.reader(location)
+        self.env = open_checksums(db.env.path())
+        self.txn = self.env.begin(buffers=True)
+        self.dbs = {}
+
+    def close(self):
+        if self.txn is not None:
+            self.txn.abort()
+            self.txn = None
+            self.env.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_page(self, pgno):
+        page = self.reader.get_page(pgno)
+        if page is None:
+            return None
+        branch_id, key = self.reader.found
+        if branch_id not in self.dbs:
+            self.dbs[branch_id] = open_branch_db(self.env, self.txn, branch_id)
+        db = self.dbs[branch_id]
+        expected = None
+        if db is not None:
+            expected = self.txn.get(key, db=db)
+        if expected is not None and struct.unpack('>I', bytes(expected))[0] != checksum(page):
+            raise ValueError("checksum mismatch on page " + str(pgno) + " commit " +
+                             str(varint.decode_key(key)[1]) + " of branch id " + str(branch_id))
+        return page
+
+    def get_max_page(self):
+        return self.reader.get_max_page()
+
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    processes = None
+    if '--processes' in args:
+        n = args.index('--processes')
+        if n + 1 >= len(args) or not args[n + 1].isdigit():
+            args = []
+        else:
+            processes = int(args[n + 1])
+            del args[n:n + 2]
+
+    if len(args) < 2 or args[0] not in ('update', 'verify') or (args[0] == 'update' and len(args) != 2):
+        print('usage: python ' + sys.argv[0] + ' update <db_file>')
+        print('       python ' + sys.argv[0] + ' verify <db_file> [--processes <n>] [<branch>...]')
+        quit()
+
+    if args[0] == 'update':
+        print('added ' + str(update(args[1])) + ' checksums')
+        sys.exit(0)
+
+    try:
+        result = verify(args[1], args[2:] or None, processes)
+    except ValueError as e:
+        print('error: ' + str(e))
+        sys.exit(1)
+
+    for name, pgno, commit in result['errors']:
+        print('corrupted: branch ' + name + ' page ' + str(pgno) + ' commit ' + str(commit))
+    print('checked ' + str(result['checked']) + ' page versions, ' +
+          str(len(result['errors'])) + ' corrupted, ' + str(result['unchecked']) + ' without checksum')
+    if result['errors']:
+        sys.exit(1)
@@ -0,0 +1,65 @@
+#
+# Moves a LiteTree db between architectures
+#
+# The LMDB file format depends on the architecture. This dumps the db
+# to a stream that does not depend on it (the increment format with no
+# watermark) and loads it on the target machine, with no text encoding
+# as done by mdb_dump and mdb_load:
+#
+#   python portable-dump.py dump data.db - | ssh arm-node python portable-dump.py load - data.db
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import sys
+import lmdb
+import litetree
+
+incremental_backup = __import__('incremental-backup')
+
+
+def dump(filename, out):
+    if not os.path.exists(filename):
+        raise IOError("the file does not exist: " + filename)
+    env = litetree.open_env(filename)
+    with env.begin(buffers=True) as txn:
+        count, current = incremental_backup.write_increment(env, txn, {}, out)
+    env.close()
+    out.flush()
+    return count
+
+
+def load(inp, filename):
+    if os.path.exists(filename):
+        raise IOError("the target file already exists: " + filename)
+    # the size of the stream is not known. the file only grows as needed
+    if sys.maxsize > 2**32:
+        map_size = 1 << 40
+    else:
+        map_size = 1 << 30
+    env = lmdb.open(filename, subdir=False, max_dbs=1024, map_size=map_size)
+    records = incremental_backup.read_records(inp)
+    with env.begin(write=True) as txn:
+        count = incremental_backup.apply_records(env, txn, records, {})
+    env.close()
+    return count
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 4 and sys.argv[1] == 'dump':
+        if sys.argv[3] == '-':
+            dump(sys.argv[2], sys.stdout)
+        else:
+            with open(sys.argv[3], 'wb') as f:
+                dump(sys.argv[2], f)
+    elif len(sys.argv) == 4 and sys.argv[1] == 'load':
+        if sys.argv[2] == '-':
+            load(sys.stdin, sys.argv[3])
+        else:
+            with open(sys.argv[2], 'rb') as f:
+                load(f, sys.argv[3])
+    else:
+        print('usage: python ' + sys.argv[0] + ' dump <db_file> <output_file|->')
+        print('       python ' + sys.argv[0] + ' load <input_file|-> <db_file>')
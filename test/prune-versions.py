@@ -0,0 +1,141 @@
+#
+# Removes the page versions that are equal to the version they replace
+#
+# SQLite can write a page without changing its content, and each write
+# is stored as a new page version. A version is removed when it is equal
+# to the previous version of the same page on the branch or, for the
+# first version on a branch, to the version visible on its source at the
+# source commit. The lookups then find the previous version, with the
+# same content, so the db is read exactly as before.
+#
+#   python prune-versions.py data.db [--dry-run] [<branch>...]
+#
+# The versions are found on a read snapshot and removed on separate write
+# transactions, where each one is compared again with the version it
+# replaces: the commits can be truncated and written again meanwhile.
+#
+# Copyright defined in LICENSE.txt
+#
+import sys
+import varint
+import litetree
+
+# number of versions removed on each write transaction
+batch_size = 10000
+
+
+def source_reader(env, txn, branches, branch):
+    """ reads the pages visible on the source of the branch at the branch point """
+    if branch.source_branch not in branches:
+        return None
+    return litetree.PageReader(env, txn, branches, branches[branch.source_branch], branch.source_commit)
+
+
+def find_duplicates(env, txn, branches, branch):
+    """ yields (key, size) for the versions equal to the version they replace """
+
+    parent = source_reader(env, txn, branches, branch)
+
+    last_pgno = None
+    previous = None
+    for version in litetree.iter_page_versions(env, txn, branch.id):
+        if version.pgno != last_pgno:
+            last_pgno = version.pgno
+            previous = None
+            if parent is not None:
+                previous = parent.get_page(version.pgno)
+                if previous is not None:
+                    previous = bytes(previous)
+        data = bytes(version.data)
+        if data == previous:
+            yield (version.key, len(data))
+        else:
+            previous = data
+
+
+def previous_version(txn, db, parent, key):
+    """ returns the content of the version replaced by the one on key """
+    pgno = varint.decode_key(key)[0]
+    cursor = txn.cursor(db=db)
+    if cursor.set_key(key) and cursor.prev() and varint.decode_key(bytes(cursor.key()))[0] == pgno:
+        return bytes(cursor.value())
+    if parent is None:
+        return None
+    page = parent.get_page(pgno)
+    if page is None:
+        return None
+    return bytes(page)
+
+
+def prune(filename, names=None, dry_run=False):
+    """ returns a tuple (versions removed, bytes removed) """
+
+    env = litetree.open_env(filename, readonly=dry_run)
+    try:
+        # find the versions on a read snapshot
+        duplicates = {}
+        total_bytes = 0
+        with env.begin(buffers=True) as txn:
+            branches = litetree.read_branches(txn)
+            if names is None:
+                selected = list(branches.values())
+            else:
+                selected = []
+                for name in names:
+                    branch = litetree.find_branch(branches, name)
+                    if branch is None:
+                        raise ValueError("branch not found: " + name)
+                    selected.append(branch)
+            for branch in selected:
+                keys = []
+                for key, size in find_duplicates(env, txn, branches, branch):
+                    keys.append(key)
+                    total_bytes += size
+                if keys:
+                    duplicates[branch.id] = keys
+
+        count = sum(len(keys) for keys in duplicates.values())
+        if dry_run:
+            return (count, total_bytes)
+
+        # remove the ones that are still equal to the version they replace
+        count = 0
+        total_bytes = 0
+        for branch_id, keys in sorted(duplicates.items()):
+            for start in range(0, len(keys), batch_size):
+                with env.begin(write=True) as txn:
+                    branches = litetree.read_branches(txn)
+                    db = litetree.open_subdb(env, txn, branch_id, 'pages')
+                    if branch_id not in branches or db is None:
+                        break  # the branch was deleted
+                    parent = source_reader(env, txn, branches, branches[branch_id])
+                    for key in keys[start:start + batch_size]:
+                        data = txn.get(key, db=db)
+                        if data is None or data != previous_version(txn, db, parent, key):
+                            continue
+                        txn.delete(key, db=db)
+                        count += 1
+                        total_bytes += len(data)
+    finally:
+        env.close()
+
+    return (count, total_bytes)
+
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    dry_run = '--dry-run' in args
+    args = [arg for arg in args if arg != '--dry-run']
+
+    if len(args) < 1:
+        print('usage: python ' + sys.argv[0] + ' <db_file> [--dry-run] [<branch>...]')
+        quit()
+
+    count, size = prune(args[0], args[1:] or None, dry_run)
+
+    if dry_run:
+        print(str(count) + ' page versions (' + str(size) + ' bytes) can be removed')
+    else:
+        print('removed ' + str(count) + ' page versions (' + str(size) + ' bytes)')
@@ -0,0 +1,176 @@
+#
+# Replication of a LiteTree db to read replicas
+#
+# The feed polls the primary db and sends the new commits, in the same
+# framed format used by the incremental backups. Each increment is
+# applied on the replica in a single LMDB write transaction, so the
+# connections reading the replica are not blocked and see it atomically.
+#
+# A branch truncated on the primary, even if committed again with the same
+# commit numbers, is sent again in full and replaced on the replica.
+#
+# Copyright defined in LICENSE.txt
+#
+import os
+import sys
+import json
+import time
+import socket
+import itertools
+import tempfile
+import lmdb
+import litetree
+
+incremental_backup = __import__('incremental-backup')
+
+
+def feed(filename, out, base=None, interval=0.1, stop=None):
+    """ sends the commits made on the primary db to the output stream.
+        base is the watermark of the replica, None if it is empty """
+
+    if not os.path.exists(filename):
+        raise IOError("the file does not exist: " + filename)
+
+    if base is None:
+        base = {}
+    last_txn = None
+
+    env = litetree.open_env(filename)
+    try:
+        while stop is None or not stop():
+            with env.begin(buffers=True) as txn:
+                # each LMDB write transaction has a new id
+                if txn.id() != last_txn:
+                    count, base = incremental_backup.write_increment(env, txn, base, out)
+                    out.flush()
+                    last_txn = txn.id()
+            time.sleep(interval)
+    finally:
+        env.close()
+
+
+def spool_records(records, spool):
+    """ yields the records, keeping a copy on the spool file """
+    for record in records:
+        incremental_backup.write_record(spool, *record)
+        yield record
+
+
+def read_spool(spool):
+    spool.seek(0)
+    while True:
+        rtype = spool.read(1)
+        if rtype == '':
+            break
+        name = incremental_backup.read_field(spool)
+        key = incremental_backup.read_field(spool)
+        value = incremental_backup.read_field(spool)
+        yield (rtype, name, key, value)
+
+
+def apply_stream(filename, inp, map_size=1 << 30):
+    """ applies the increments read from the input stream until it is closed """
+
+    env = lmdb.open(filename, subdir=False, max_dbs=1024, map_size=map_size)
+    dbs = {}
+    total = 0
+
+    try:
+        while True:
+            records = incremental_backup.read_records(inp)
+            first = next(records, None)
+            if first is None:
+                break  # end of the stream
+            # the records are applied as they are read. they are also copied
+            # to a temporary file to apply them again if the map is full
+            spool = tempfile.TemporaryFile()
+            source = itertools.chain([first], records)
+            while True:
+                try:
+                    with env.begin(write=True) as txn:
+                        total += incremental_backup.apply_records(env, txn, spool_records(source, spool), dbs)
+                    break
+                except lmdb.MapFullError:
+                    # the sub-dbs opened on the aborted transaction are not valid
+                    dbs = {}
+                    env.set_mapsize(env.info()['map_size'] * 2)
+                    # the records already read, then the rest of the stream
+                    source = itertools.chain(read_spool(spool), records)
+                    spool = tempfile.TemporaryFile()
+            spool.close()
+    finally:
+        env.close()
+
+    return total
+
+
+def replica_watermark(filename):
+    if not os.path.exists(filename):
+        return {}
+    env = litetree.open_env(filename)
+    with env.begin(buffers=True) as txn:
+        watermark = incremental_backup.db_watermark(env, txn)
+    env.close()
+    return watermark
+
+
+def serve(filename, port, interval):
+    """ waits for a replica to connect and sends the commits to it """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(1)
+    conn, addr = server.accept()
+    stream = conn.makefile('rwb')
+    # the replica informs its current state
+    base = incremental_backup.parse_watermark(json.loads(stream.readline()))
+    try:
+        feed(filename, stream, base, interval)
+    except socket.error:
+        pass  # the replica disconnected
+    conn.close()
+    server.close()
+
+
+def connect(filename, address):
+    """ connects to the primary and applies the commits received """
+    host, port = address.rsplit(':', 1)
+    conn = socket.create_connection((host, int(port)))
+    stream = conn.makefile('rwb')
+    stream.write(json.dumps(replica_watermark(filename)) + '\n')
+    stream.flush()
+    total = apply_stream(filename, stream)
+    conn.close()
+    return total
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='replication of a LiteTree db')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('feed', help='send the commits of the primary db to stdout or to a socket')
+    p.add_argument('db_file')
+    p.add_argument('--since', help='watermark file of the replica, when using stdout')
+    p.add_argument('--listen', type=int, metavar='PORT', help='wait for a replica on this port')
+    p.add_argument('--interval', type=float, default=0.1, help='polling interval in seconds')
+
+    p = subparsers.add_parser('apply', help='apply the commits from stdin or from a socket to the replica')
+    p.add_argument('db_file')
+    p.add_argument('--connect', metavar='HOST:PORT', help='connect to a feed on this address')
+
+    args = parser.parse_args()
+
+    if args.command == 'feed':
+        if args.listen is not None:
+            serve(args.db_file, args.listen, args.interval)
+        else:
+            base = incremental_backup.read_watermark(args.since)
+            feed(args.db_file, sys.stdout, base, args.interval)
+    else:
+        if args.connect is not None:
+            connect(args.db_file, args.connect)
+        else:
+            apply_stream(args.db_file, sys.stdin)
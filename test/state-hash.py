@@ -0,0 +1,214 @@
+#
+# Merkle state hash of a branch at a commit
+#
+# The leaves are the SHA-256 hashes of the pages of the db at the commit
+# (with the reserved space at the end of the pages filled with zeros) and
+# the state hash also covers the number of pages:
+#
+#   leaf(pgno)  = sha256(0x00 + pgno as 4 bytes big endian + page)
+#   node        = sha256(0x01 + left + right)
+#   state hash  = sha256(0x02 + num_pages as 4 bytes big endian + root)
+#
+# The tree has a power of 2 leaves, the ones after the last page are zeros.
+#
+# When the hashes of all the commits of the branch are computed (--all) the
+# tree is updated with only the pages written between the commits, and the
+# commits that were discarded are skipped. A proof that
+# a page is part of the state is returned with --proof <pgno>:
+#
+#   python state-hash.py data.db master.1000
+#   python state-hash.py data.db master --all
+#   python state-hash.py data.db master.1000 --proof 7
+#
+# Copyright defined in LICENSE.txt
+#
+import sys
+import json
+import struct
+import hashlib
+import binascii
+import litetree
+
+EMPTY = b'\x00' * 32
+
+
+def hash_page(pgno, page):
+    return hashlib.sha256(b'\x00' + struct.pack('>I', pgno) + page).digest()
+
+
+def hash_node(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def state_hash(num_pages, root):
+    return hashlib.sha256(b'\x02' + struct.pack('>I', num_pages) + root).digest()
+
+
+class MerkleTree(object):
+    """ binary Merkle tree over the page hashes. levels[0] has the leaves
+        and levels[-1] the root """
+
+    def __init__(self, leaves):
+        self.build(list(leaves))
+
+    def build(self, leaves):
+        self.num_pages = len(leaves)
+        capacity = 1
+        while capacity < len(leaves):
+            capacity *= 2
+        level = leaves + [EMPTY] * (capacity - len(leaves))
+        self.levels = [level]
+        while len(level) > 1:
+            level = [hash_node(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def resize(self, num_pages):
+        leaves = self.levels[0][0:num_pages]
+        leaves += [EMPTY] * (num_pages - len(leaves))
+        self.build(leaves)
+
+    def update(self, pgno, leaf):
+        """ replaces the leaf of the page and the nodes above it """
+        index = pgno - 1
+        self.levels[0][index] = leaf
+        for depth in range(1, len(self.levels)):
+            index //= 2
+            below = self.levels[depth - 1]
+            self.levels[depth][index] = hash_node(below[2 * index], below[2 * index + 1])
+
+    def root(self):
+        return self.levels[-1][0]
+
+    def state_hash(self):
+        return state_hash(self.num_pages, self.root())
+
+    def proof(self, pgno):
+        """ returns the sibling hashes from the leaf up to the root """
+        index = pgno - 1
+        result = []
+        for level in self.levels[:-1]:
+            result.append(level[index ^ 1])
+            index //= 2
+        return result
+
+
+def verify_proof(expected, num_pages, pgno, page, proof):
+    """ checks that the page is part of the state with the expected hash """
+    node = hash_page(pgno, page)
+    index = pgno - 1
+    for sibling in proof:
+        if index % 2 == 0:
+            node = hash_node(node, sibling)
+        else:
+            node = hash_node(sibling, node)
+        index //= 2
+    return state_hash(num_pages, node) == expected
+
+
+class StateHasher(object):
+    """ computes the state hashes of a branch. the tree of the last commit
+        is kept, so moving to a near commit only hashes the pages written
+        in between """
+
+    def __init__(self, db, name):
+        self.db = db
+        self.branch = db.branch(name)
+        self.commit = None
+        self.tree = None
+        self.page_size = None
+
+    def read_page(self, reader, pgno):
+        page = reader.get_page(pgno)
+        if page is None:
+            page = b''
+        page = bytes(page)
+        # the reserved space at the end of the page is not stored
+        return page + b'\x00' * (self.page_size - len(page))
+
+    def get_reader(self, commit):
+        reader = self.db.reader(self.branch.name + '.' + str(commit))
+        if self.page_size is None:
+            page1 = reader.get_page(1)
+            if page1 is None:
+                raise ValueError("the db is empty at " + self.branch.name + '.' + str(commit))
+            self.page_size = struct.unpack('>H', bytes(page1[16:18]))[0]
+            if self.page_size == 1:
+                self.page_size = 65536
+        return reader
+
+    def changed_pages(self, commit):
+        """ the pages written on the branch between the current commit and the given one """
+        low = min(self.commit, commit)
+        high = max(self.commit, commit)
+        pgnos = set()
+        for version in self.db.page_versions(self.branch.name, low + 1, high):
+            pgnos.add(version.pgno)
+        return pgnos
+
+    def move_to(self, commit):
+        """ updates the tree to the commit and returns the state hash """
+        reader = self.get_reader(commit)
+        num_pages = reader.get_max_page()
+
+        # the pages from the ancestors do not change above the source commit
+        source_commit = self.branch.source_commit
+        if self.tree is None or min(self.commit, commit) <= source_commit:
+            self.tree = MerkleTree(hash_page(pgno, self.read_page(reader, pgno))
+                                   for pgno in range(1, num_pages + 1))
+        else:
+            pgnos = self.changed_pages(commit)
+            old_pages = self.tree.num_pages
+            if num_pages != old_pages:
+                self.tree.resize(num_pages)
+                # pages that were not on the db at the previous commit
+                pgnos.update(range(old_pages + 1, num_pages + 1))
+            for pgno in sorted(pgnos):
+                if pgno <= num_pages:
+                    self.tree.update(pgno, hash_page(pgno, self.read_page(reader, pgno)))
+
+        self.commit = commit
+        self.reader = reader
+        return self.tree.state_hash()
+
+    def all_hashes(self):
+        """ yields (commit, state hash) for each commit stored on the branch,
+            carrying the tree from one commit to the next """
+        for commit, max_page in list(self.db.commits(self.branch.name)):
+            yield (commit, self.move_to(commit))
+
+    def proof(self, pgno):
+        """ returns (page, proof) for the page at the current commit """
+        if pgno < 1 or pgno > self.tree.num_pages:
+            raise ValueError("invalid page number: " + str(pgno))
+        return (self.read_page(self.reader, pgno), self.tree.proof(pgno))
+
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    if len(args) not in (2, 3, 4) or (len(args) == 3 and args[2] != '--all') \
+            or (len(args) == 4 and (args[2] != '--proof' or not args[3].isdigit())):
+        print('usage: python ' + sys.argv[0] + ' <db_file> <branch>[.<commit>] [--all | --proof <pgno>]')
+        quit()
+
+    with litetree.LiteTreeFile(args[0]) as db:
+        branch, commit = litetree.parse_location(db.catalog, args[1])
+        hasher = StateHasher(db, branch.name)
+
+        if len(args) == 3:
+            # one hash per commit of the branch
+            for commit, digest in hasher.all_hashes():
+                print(str(commit) + ' ' + binascii.hexlify(digest).decode())
+        else:
+            print(binascii.hexlify(hasher.move_to(commit)).decode())
+
+        if len(args) == 4:
+            pgno = int(args[3])
+            page, proof = hasher.proof(pgno)
+            print(json.dumps({
+                'pgno': pgno,
+                'num_pages': hasher.tree.num_pages,
+                'page_sha256': hashlib.sha256(page).hexdigest(),
+                'proof': [binascii.hexlify(node).decode() for node in proof],
+            }))
@@ -0,0 +1,215 @@
+#
+# Multi-process stress benchmark
+#
+# Runs writer and reader processes against the same db file, for each
+# combination of the given numbers of writers and readers. The writers
+# are spread over the branches and each one commits small transactions
+# as fast as it can. The readers do point reads on the same branches.
+#
+# For each run it reports the commit throughput, the time waiting for the
+# write lock (BEGIN IMMEDIATE), the commit latency and the read latency
+# percentiles. The point where the throughput stops growing with more
+# writers shows the saturation of the write lock:
+#
+#   python stress-benchmark.py --writers 1,2,4,8,16 --readers 0,16 --branches 4
+#
+# Copyright defined in LICENSE.txt
+#
+import argparse
+import json
+import multiprocessing
+import Queue
+import random
+import time
+
+bench = __import__('benchmark-suite')
+timer = bench.timer
+
+
+def branch_name(index, params):
+    """ the branch used by the writer or reader number index """
+    num_branches = params.branches or params.max_writers
+    n = index % num_branches
+    if n == 0:
+        return "master"
+    return "b" + str(n)
+
+
+def wait_until(start_at):
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def writer(filename, index, params, start_at, queue):
+    try:
+        rnd = random.Random(params.seed + index)
+        conn = bench.connect(filename)
+        c = conn.cursor()
+        c.execute("pragma branch=" + branch_name(index, params))
+        lock_wait = []
+        commit = []
+        wait_until(start_at)
+        end = time.time() + params.duration
+        while time.time() < end:
+            start = timer()
+            c.execute("begin immediate")
+            locked = timer()
+            for n in range(params.updates):
+                c.execute("update t1 set value = ? where rowid = ?",
+                          (bench.random_value(rnd, params.row_size), rnd.randint(1, params.rows)))
+            start_commit = timer()
+            c.execute("commit")
+            lock_wait.append(locked - start)
+            commit.append(timer() - start_commit)
+        conn.close()
+        queue.put(('writer', index, {'lock_wait': lock_wait, 'commit': commit}, None))
+    except Exception as e:
+        queue.put(('writer', index, None, str(e)))
+
+
+def reader(filename, index, params, start_at, queue):
+    try:
+        rnd = random.Random(params.seed + 1000 + index)
+        conn = bench.connect(filename)
+        c = conn.cursor()
+        c.execute("pragma branch=" + branch_name(index, params))
+        read = []
+        wait_until(start_at)
+        end = time.time() + params.duration
+        while time.time() < end:
+            start = timer()
+            c.execute("select value from t1 where rowid = ?", (rnd.randint(1, params.rows),))
+            c.fetchall()
+            read.append(timer() - start)
+        conn.close()
+        queue.put(('reader', index, {'read': read}, None))
+    except Exception as e:
+        queue.put(('reader', index, None, str(e)))
+
+
+def create_db(filename, params):
+    rnd = random.Random(params.seed)
+    conn = bench.create_master(filename, rnd, params)
+    c = conn.cursor()
+    head = bench.head_commit(c, "master")
+    names = set(branch_name(n, params) for n in range(max(params.max_writers, params.max_readers)))
+    for name in sorted(names):
+        if name != "master":
+            c.execute("pragma new_branch=" + name + " at master." + str(head))
+    conn.close()
+
+
+def run(filename, params, num_writers, num_readers):
+    """ runs the processes and returns the statistics of the run """
+
+    create_db(filename, params)
+
+    queue = multiprocessing.Queue()
+    start_at = time.time() + params.startup
+    processes = {}
+    for n in range(num_writers):
+        processes[('writer', n)] = multiprocessing.Process(target=writer, args=(filename, n, params, start_at, queue))
+    for n in range(num_readers):
+        processes[('reader', n)] = multiprocessing.Process(target=reader, args=(filename, n, params, start_at, queue))
+    for process in processes.values():
+        process.start()
+
+    # read the results before joining, the queue could block the processes.
+    # a process that dies or hangs does not send its result
+    samples = {'lock_wait': [], 'commit': [], 'read': []}
+    errors = []
+    pending = dict(processes)
+    deadline = start_at + params.duration + params.timeout
+    while pending:
+        try:
+            kind, index, result, error = queue.get(timeout=1)
+        except Queue.Empty:
+            for key in sorted(pending):
+                process = pending[key]
+                if process.exitcode is not None and process.exitcode != 0:
+                    errors.append(key[0] + ' ' + str(key[1]) + ': exited with code ' + str(process.exitcode))
+                    del pending[key]
+                elif time.time() > deadline:
+                    process.terminate()
+                    errors.append(key[0] + ' ' + str(key[1]) + ': no result after ' + str(params.timeout) +
+                                  ' seconds, terminated')
+                    del pending[key]
+            continue
+        if pending.pop((kind, index), None) is None:
+            continue  # late result of a process already reported as failed
+        if error is not None:
+            errors.append(kind + ' ' + str(index) + ': ' + error)
+            continue
+        for name, values in result.items():
+            samples[name].extend(values)
+    for process in processes.values():
+        process.join()
+
+    bench.delete_files(filename)
+    if errors:
+        raise Exception(str(len(errors)) + ' processes failed:\n' + '\n'.join(errors))
+
+    commits = len(samples['commit'])
+    reads = len(samples['read'])
+    return {
+        'writers': num_writers,
+        'readers': num_readers,
+        'branches': len(set(branch_name(n, params) for n in range(max(num_writers, num_readers, 1)))),
+        'commits': commits,
+        'commits_per_second': commits / params.duration,
+        'reads_per_second': reads / params.duration,
+        'lock_wait': bench.summary(samples['lock_wait']),
+        'commit_latency': bench.summary(samples['commit']),
+        'read_latency': bench.summary(samples['read']),
+    }
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='LiteTree multi-process stress benchmark')
+    parser.add_argument('--file', default='stress.db', help='db file (it is recreated on each run)')
+    parser.add_argument('--writers', type=int_list, default=[1, 2, 4, 8, 16],
+                        help='comma separated numbers of writer processes')
+    parser.add_argument('--readers', type=int_list, default=[0, 16],
+                        help='comma separated numbers of reader processes')
+    parser.add_argument('--branches', type=int, default=0,
+                        help='branches used by the processes (default: one per writer)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--startup', type=float, default=2, help='seconds to start the processes')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for the results after the end of a run')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=10000, help='rows on the table')
+    parser.add_argument('--row-size', type=int, default=100, help='bytes per row')
+    parser.add_argument('--updates', type=int, default=10, help='rows updated per commit')
+    parser.add_argument('--output', help='JSON output file (default: stdout)')
+    args = parser.parse_args()
+
+    filename = args.file
+    output = args.output
+    del args.file
+    del args.output
+    args.max_writers = max(max(args.writers), 1)
+    args.max_readers = max(args.readers)
+
+    runs = []
+    for num_writers in args.writers:
+        for num_readers in args.readers:
+            runs.append(run(filename, args, num_writers, num_readers))
+
+    result = json.dumps({
+        'sqlite_version': bench.sqlite3.sqlite_version,
+        'params': vars(args),
+        'runs': runs,
+    }, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(result + '\n')
+    else:
+        print(result)
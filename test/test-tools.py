@@ -0,0 +1,864 @@
+#
+# Copyright defined in LICENSE.txt
+#
+import unittest
+import json
+import os
+import platform
+
+if platform.system() == "Darwin":
+    import pysqlite2.dbapi2 as sqlite3
+else:
+    import sqlite3
+
+sqlite_version = "3.27.2"
+
+if sqlite3.sqlite_version != sqlite_version:
+    print "wrong SQLite version. expected: " + sqlite_version + " found: " + sqlite3.sqlite_version
+    import sys
+    sys.exit(1)
+
+export_snapshot = __import__('export-snapshot')
+online_backup = __import__('online-backup')
+incremental_backup = __import__('incremental-backup')
+import replicate
+portable_dump = __import__('portable-dump')
+branch_stats = __import__('branch-stats')
+new_branches = __import__('new-branches')
+prune_versions = __import__('prune-versions')
+import varint
+state_hash = __import__('state-hash')
+page_checksums = __import__('page-checksums')
+integrity_check = __import__('integrity-check')
+flatten_branch = __import__('flatten-branch')
+import litetree
+
+def delete_file(filepath):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+def delete_files(filepath):
+    delete_file(filepath)
+    delete_file(filepath + "-journal")
+    delete_file(filepath + "-lock")
+
+
+class TestTools(unittest.TestCase):
+
+    def test01_create_database(self):
+        delete_files("tools.db")
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+
+        c.execute("pragma journal_mode")
+        self.assertEqual(c.fetchone()[0], "branches")
+
+        c.execute("create table t1(name)")
+        conn.commit()
+        c.execute("insert into t1 values ('first')")
+        conn.commit()
+        c.execute("insert into t1 values ('second')")
+        conn.commit()
+
+        c.execute("begin")
+        for n in range(200):
+            c.execute("insert into t1 values ('record " + str(n) + "')")
+        conn.commit()
+
+        c.execute("pragma new_branch=test at master.2")
+        c.execute("insert into t1 values ('from test branch')")
+        conn.commit()
+
+        c.execute("pragma new_branch=sub-test at test.3")
+        c.execute("create table t2(name)")
+        conn.commit()
+        c.execute("insert into t2 values ('from sub-test branch')")
+        conn.commit()
+
+        conn.close()
+
+
+    def test02_export_snapshot(self):
+
+        def check_export(location, expected):
+            delete_files("export.db")
+            export_snapshot.export_snapshot("tools.db", location, "export.db")
+
+            # it must be readable by normal SQLite
+            conn = sqlite3.connect('export.db')
+            c = conn.cursor()
+            c.execute("pragma integrity_check")
+            self.assertEqual(c.fetchone()[0], "ok")
+            c.execute("select * from t1 where name not like 'record %'")
+            self.assertListEqual(c.fetchall(), expected)
+            conn.close()
+
+        check_export("master.1", [])
+        check_export("master.2", [("first",)])
+        check_export("master", [("first",),("second",)])
+        check_export("test", [("first",),("from test branch",)])
+        check_export("sub-test.4", [("first",),("from test branch",)])
+        check_export("sub-test", [("first",),("from test branch",)])
+
+        conn = sqlite3.connect('export.db')
+        c = conn.cursor()
+        c.execute("select * from t2")
+        self.assertListEqual(c.fetchall(), [("from sub-test branch",)])
+        c.execute("select count(*) from t1")
+        self.assertEqual(c.fetchone()[0], 2)
+        conn.close()
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+        c.execute("select count(*) from t1")
+        self.assertEqual(c.fetchone()[0], 202)
+        conn.close()
+
+        check_export("master", [("first",),("second",)])
+        conn = sqlite3.connect('export.db')
+        c = conn.cursor()
+        c.execute("select count(*) from t1")
+        self.assertEqual(c.fetchone()[0], 202)
+        conn.close()
+
+        with self.assertRaises(ValueError):
+            export_snapshot.export_snapshot("tools.db", "non-existent", "export.db")
+        with self.assertRaises(ValueError):
+            export_snapshot.export_snapshot("tools.db", "master.100", "export.db")
+
+
+    def test03_online_backup(self):
+        delete_files("backup.db")
+        delete_files("backup2.db")
+        delete_files("backup3.db")
+        delete_file("backup3.json")
+        delete_file("backup3.inc1")
+        delete_file("backup3.inc2")
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+
+        # a backup with a read transaction open on another connection
+        c.execute("pragma branch=master")
+        c.execute("begin")
+        c.execute("select count(*) from t1")
+        self.assertEqual(c.fetchone()[0], 202)
+
+        online_backup.backup("tools.db", "backup.db")
+        online_backup.backup("tools.db", "backup2.db", branches=["sub-test"], max_rate=10000000, step_size=10)
+
+        conn.commit()
+        conn.close()
+
+        conn = sqlite3.connect('file:backup.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branches")
+        self.assertListEqual(c.fetchall(), [("master",),("test",),("sub-test",)])
+        c.execute("select count(*) from t1")
+        self.assertEqual(c.fetchone()[0], 202)
+        c.execute("pragma branch=sub-test")
+        c.execute("select * from t2")
+        self.assertListEqual(c.fetchall(), [("from sub-test branch",)])
+        conn.close()
+
+        # only the selected branch and the ancestor ranges are copied
+        conn = sqlite3.connect('file:backup2.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branches")
+        self.assertListEqual(c.fetchall(), [("master",),("test",),("sub-test",)])
+        c.execute("pragma branch_info(master)")
+        obj = json.loads(c.fetchone()[0])
+        self.assertEqual(obj["total_commits"], 2)
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",)])
+        c.execute("pragma branch=sub-test")
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",),("from test branch",)])
+        c.execute("select * from t2")
+        self.assertListEqual(c.fetchall(), [("from sub-test branch",)])
+        conn.close()
+
+        with self.assertRaises(IOError):
+            online_backup.backup("tools.db", "backup.db")
+        with self.assertRaises(ValueError):
+            online_backup.backup("tools.db", "backup3.db", branches=["non-existent"])
+
+
+    def test04_incremental_backup(self):
+        delete_files("backup3.db")
+        delete_file("backup3.json")
+        delete_file("backup3.inc1")
+        delete_file("backup3.inc2")
+
+        # the first increment contains the whole db
+        incremental_backup.export_increment("tools.db", "backup3.json", "backup3.inc1")
+        incremental_backup.apply_increment("backup3.inc1", "backup3.db")
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+        c.execute("insert into t1 values ('third')")
+        conn.commit()
+        c.execute("pragma branch=test")
+        c.execute("insert into t1 values ('from test branch 2')")
+        conn.commit()
+        c.execute("pragma new_branch=test2 at master.3")
+        c.execute("insert into t1 values ('from test2 branch')")
+        conn.commit()
+        conn.close()
+
+        incremental_backup.export_increment("tools.db", "backup3.json", "backup3.inc2")
+        self.assertLess(os.path.getsize("backup3.inc2"), os.path.getsize("backup3.inc1"))
+
+        # it cannot be applied before the previous one
+        delete_files("backup4.db")
+        with self.assertRaises(ValueError):
+            incremental_backup.apply_increment("backup3.inc2", "backup4.db")
+        delete_files("backup4.db")
+
+        incremental_backup.apply_increment("backup3.inc2", "backup3.db")
+
+        conn = sqlite3.connect('file:backup3.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branches")
+        self.assertListEqual(c.fetchall(), [("master",),("test",),("sub-test",),("test2",)])
+        c.execute("select * from t1 where name not like 'record %'")
+        self.assertListEqual(c.fetchall(), [("first",),("second",),("third",)])
+        c.execute("pragma branch=test")
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",),("from test branch",),("from test branch 2",)])
+        c.execute("pragma branch=test2")
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",),("second",),("from test2 branch",)])
+        c.execute("pragma branch=sub-test")
+        c.execute("select * from t2")
+        self.assertListEqual(c.fetchall(), [("from sub-test branch",)])
+        conn.close()
+
+        # the same increment cannot be applied twice
+        with self.assertRaises(ValueError):
+            incremental_backup.apply_increment("backup3.inc2", "backup3.db")
+
+        # a branch truncated and committed again with the same commit numbers
+        import shutil
+        delete_files("trunc.db")
+        delete_files("trunc-backup.db")
+        delete_file("trunc.json")
+        delete_file("trunc.inc")
+        shutil.copy("tools.db", "trunc.db")
+        incremental_backup.export_increment("trunc.db", "trunc.json", "trunc.inc")
+        incremental_backup.apply_increment("trunc.inc", "trunc-backup.db")
+
+        conn = sqlite3.connect('file:trunc.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branch_truncate(master.3)")
+        c.execute("insert into t1 values ('other third')")
+        conn.commit()
+        c.execute("insert into t1 values ('other fourth')")
+        conn.commit()
+        conn.close()
+
+        incremental_backup.export_increment("trunc.db", "trunc.json", "trunc.inc")
+        incremental_backup.apply_increment("trunc.inc", "trunc-backup.db")
+
+        conn = sqlite3.connect('file:trunc-backup.db?branches=on')
+        c = conn.cursor()
+        c.execute("select * from t1 where name not like 'record %'")
+        self.assertListEqual(c.fetchall(), [("first",),("second",),("other third",),("other fourth",)])
+        c.execute("pragma branch=test2")
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",),("second",),("from test2 branch",)])
+        conn.close()
+
+
+    def test05_replication(self):
+        import threading
+        import time
+        delete_files("replica.db")
+
+        rfd, wfd = os.pipe()
+        output = os.fdopen(wfd, 'wb')
+        input = os.fdopen(rfd, 'rb')
+        stop = threading.Event()
+
+        feeder = threading.Thread(target=replicate.feed, args=("tools.db", output, None, 0.05, stop.is_set))
+        applier = threading.Thread(target=replicate.apply_stream, args=("replica.db", input))
+        feeder.start()
+        applier.start()
+
+        def wait_replica(branch, expected):
+            for i in range(100):
+                time.sleep(0.05)
+                if not os.path.exists("replica.db"):
+                    continue
+                conn = sqlite3.connect('file:replica.db?branches=on')
+                c = conn.cursor()
+                try:
+                    c.execute("pragma branch=" + branch)
+                    c.execute("select * from t1 where name not like 'record %'")
+                    result = c.fetchall()
+                except sqlite3.OperationalError:
+                    result = None
+                conn.close()
+                if result == expected:
+                    return True
+            return False
+
+        self.assertTrue(wait_replica("master", [("first",),("second",),("third",)]))
+
+        # the replica stays in sync while being read
+        reader = sqlite3.connect('file:replica.db?branches=on')
+        rc = reader.cursor()
+        rc.execute("pragma branch=test")
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+        c.execute("insert into t1 values ('fourth')")
+        conn.commit()
+        c.execute("pragma new_branch=test3 at master.6")
+        c.execute("insert into t1 values ('from test3 branch')")
+        conn.commit()
+        conn.close()
+
+        self.assertTrue(wait_replica("master", [("first",),("second",),("third",),("fourth",)]))
+        self.assertTrue(wait_replica("test3", [("first",),("second",),("third",),("fourth",),("from test3 branch",)]))
+
+        # a branch truncated and committed again with the same commit numbers
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branch=test3")
+        c.execute("insert into t1 values ('second from test3')")
+        conn.commit()
+        c.execute("pragma branch_truncate(test3.7)")
+        c.execute("insert into t1 values ('other from test3')")
+        conn.commit()
+        conn.close()
+
+        self.assertTrue(wait_replica("test3", [("first",),("second",),("third",),("fourth",),("from test3 branch",),("other from test3",)]))
+
+        rc.execute("select * from t1")
+        self.assertListEqual(rc.fetchall(), [("first",),("from test branch",),("from test branch 2",)])
+        reader.close()
+
+        stop.set()
+        feeder.join()
+        output.close()
+        applier.join()
+        input.close()
+
+
+    def test06_portable_dump(self):
+        delete_files("portable.db")
+        delete_file("portable.dump")
+
+        with open("portable.dump", "wb") as f:
+            portable_dump.dump("tools.db", f)
+        with open("portable.dump", "rb") as f:
+            portable_dump.load(f, "portable.db")
+
+        conn1 = sqlite3.connect('file:tools.db?branches=on')
+        conn2 = sqlite3.connect('file:portable.db?branches=on')
+        c1 = conn1.cursor()
+        c2 = conn2.cursor()
+
+        c1.execute("pragma branches")
+        c2.execute("pragma branches")
+        branches = c1.fetchall()
+        self.assertListEqual(c2.fetchall(), branches)
+
+        for branch in branches:
+            c1.execute("pragma branch_info('" + branch[0] + "')")
+            c2.execute("pragma branch_info('" + branch[0] + "')")
+            self.assertEqual(json.loads(c2.fetchone()[0]), json.loads(c1.fetchone()[0]))
+            c1.execute("pragma branch='" + branch[0] + "'")
+            c2.execute("pragma branch='" + branch[0] + "'")
+            c1.execute("select * from t1")
+            c2.execute("select * from t1")
+            self.assertListEqual(c2.fetchall(), c1.fetchall())
+
+        conn1.close()
+        conn2.close()
+
+        with self.assertRaises(IOError):
+            with open("portable.dump", "rb") as f:
+                portable_dump.load(f, "portable.db")
+
+
+    def test07_inspection_library(self):
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branches")
+        names = [row[0] for row in c.fetchall()]
+        info = {}
+        for name in names:
+            c.execute("pragma branch_info('" + name + "')")
+            info[name] = json.loads(c.fetchone()[0])
+        conn.close()
+
+        with litetree.LiteTreeFile("tools.db") as db:
+
+            branches = db.branches()
+            self.assertListEqual([branch.name for branch in branches], names)
+
+            for branch in branches:
+                self.assertEqual(branch.last_commit, info[branch.name]["total_commits"])
+                if branch.source_branch > 0:
+                    source = [b for b in branches if b.id == branch.source_branch][0]
+                    self.assertEqual(source.name, info[branch.name]["source_branch"])
+                    self.assertEqual(branch.source_commit, info[branch.name]["source_commit"])
+
+                commits = [commit for commit, max_page in db.commits(branch.name)]
+                self.assertEqual(commits, sorted(commits))
+                if len(commits) > 0:
+                    self.assertEqual(commits[-1], branch.last_commit)
+                    self.assertGreater(commits[0], branch.source_commit)
+
+                versions = list(db.page_versions(branch.name))
+                stats = db.stats(branch.name, pages=True)
+                self.assertEqual(len(versions), stats["page_versions"])
+                self.assertEqual(len(set(v.pgno for v in versions)), stats["pages"])
+                for version in versions:
+                    self.assertGreater(version.commit, branch.source_commit)
+                    self.assertLessEqual(version.commit, branch.last_commit)
+
+            # commit ranges
+            versions = list(db.page_versions("master", min_commit=2, max_commit=3))
+            self.assertGreater(len(versions), 0)
+            for version in versions:
+                self.assertIn(version.commit, [2, 3])
+
+            commits = [commit for commit, max_page in db.commits("master", 2, 3)]
+            self.assertListEqual(commits, [2, 3])
+
+            with self.assertRaises(ValueError):
+                db.branch("non-existent")
+
+
+    def test08_branch_stats(self):
+
+        stats = branch_stats.get_stats("tools.db", pages=True)
+
+        with litetree.LiteTreeFile("tools.db") as db:
+            self.assertListEqual(sorted(stats.keys()), sorted(branch.name for branch in db.branches()))
+
+            for branch in db.branches():
+                result = stats[branch.name]
+                self.assertEqual(result["total_commits"], branch.last_commit)
+                self.assertGreater(result["bytes"], 0)
+                if result["pages"] > 0:
+                    self.assertAlmostEqual(result["versions_per_page"],
+                                           float(result["page_versions"]) / result["pages"])
+
+                # the pages at the head of the branch not written on it come from the parent
+                if branch.source_branch > 0:
+                    self.assertIn("source_branch", result)
+                    max_page = db.reader(branch.name).get_max_page()
+                    own_pages = set(v.pgno for v in db.page_versions(branch.name) if v.pgno <= max_page)
+                    self.assertEqual(result["shared_pages"], max_page - len(own_pages))
+                else:
+                    self.assertEqual(result["shared_pages"], 0)
+
+        only = branch_stats.get_stats("tools.db", ["test"], pages=True)
+        self.assertListEqual(list(only.keys()), ["test"])
+        self.assertEqual(only["test"], stats["test"])
+
+        # without pages only the LMDB stats are read
+        quick = branch_stats.get_stats("tools.db", ["test"])["test"]
+        self.assertNotIn("pages", quick)
+        self.assertNotIn("shared_pages", quick)
+        self.assertEqual(quick["page_versions"], stats["test"]["page_versions"])
+        self.assertEqual(quick["bytes"], stats["test"]["bytes"])
+        self.assertGreater(quick["depth"], 0)
+
+
+    def test09_counters(self):
+
+        with litetree.LiteTreeFile("tools.db") as db:
+
+            # the sub-test branch has 3 levels: sub-test, test and master
+            reader = db.reader("sub-test")
+            self.assertEqual(len(reader.levels), 3)
+            max_page = reader.get_max_page()
+            stats = dict(reader.replay_stats)
+            for pgno in range(1, max_page + 1):
+                self.assertIsNotNone(reader.get_page(pgno))
+            lookups = reader.replay_stats["lookups"] - stats["lookups"]
+            probed = reader.replay_stats["levels_probed"] - stats["levels_probed"]
+            self.assertEqual(lookups, max_page)
+            self.assertGreaterEqual(probed, lookups)
+            self.assertLessEqual(probed, 3 * lookups)
+            self.assertEqual(reader.replay_stats["seeks"], 2 * reader.replay_stats["levels_probed"])
+            self.assertGreater(reader.replay_stats["bytes_read"], 0)
+
+            self.assertIsNone(reader.get_page(max_page + 1000))
+            self.assertGreater(reader.replay_stats["not_found"], 0)
+
+            status = db.env_status()
+            self.assertGreaterEqual(status["num_readers"], 1)
+            self.assertLessEqual(status["num_readers"], status["max_readers"])
+            self.assertLessEqual(status["map_used"], status["map_size"])
+
+
+    def test10_new_branches(self):
+
+        names = new_branches.new_branches("tools.db", "par", 4, "master.3")
+        self.assertListEqual(names, ["par1", "par2", "par3", "par4"])
+
+        with self.assertRaises(ValueError):
+            new_branches.new_branches("tools.db", "par", 2, "master.3")
+        with self.assertRaises(ValueError):
+            new_branches.new_branches("tools.db", "bad.", 2, "master.3")
+        with self.assertRaises(ValueError):
+            new_branches.new_branches("tools.db", "new", 2, "non-existent.1")
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branches")
+        branches = [row[0] for row in c.fetchall()]
+        for name in names:
+            self.assertIn(name, branches)
+            c.execute("pragma branch_info(" + name + ")")
+            obj = json.loads(c.fetchone()[0])
+            self.assertEqual(obj["source_branch"], "master")
+            self.assertEqual(obj["source_commit"], 3)
+
+        c.execute("pragma branch=par2")
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",),("second",)])
+
+        c.execute("insert into t1 values ('from par2')")
+        conn.commit()
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",),("second",),("from par2",)])
+
+        c.execute("pragma branch=par3")
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",),("second",)])
+        conn.close()
+
+        # a commit made before the branch point is on the source branch
+        new_branches.new_branches("tools.db", "anc", 1, "sub-test.2")
+
+        conn = sqlite3.connect('file:tools.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branch_info(anc1)")
+        obj = json.loads(c.fetchone()[0])
+        self.assertEqual(obj["source_branch"], "master")
+        self.assertEqual(obj["source_commit"], 2)
+        c.execute("pragma branch=anc1")
+        c.execute("select * from t1")
+        self.assertListEqual(c.fetchall(), [("first",)])
+        conn.close()
+
+
+    def test11_prune_versions(self):
+
+        def read_all():
+            conn = sqlite3.connect('file:tools.db?branches=on')
+            c = conn.cursor()
+            c.execute("pragma branches")
+            result = {}
+            for name in [row[0] for row in c.fetchall()]:
+                c.execute("pragma branch=" + name)
+                c.execute("select * from t1")
+                result[name] = c.fetchall()
+            conn.close()
+            return result
+
+        # store a copy of a page as a new version on the last commit of master
+        env = litetree.open_env("tools.db", readonly=False)
+        with env.begin(write=True, buffers=True) as txn:
+            branches = litetree.read_branches(txn)
+            master = litetree.find_branch(branches, "master")
+            last = {}
+            for version in litetree.iter_page_versions(env, txn, master.id):
+                last[version.pgno] = version
+            pgno = [pgno for pgno, version in sorted(last.items()) if version.commit < master.last_commit][0]
+            db = litetree.open_subdb(env, txn, master.id, 'pages')
+            txn.put(varint.encode_key(pgno, master.last_commit), bytes(last[pgno].data), db=db)
+        env.close()
+
+        before = read_all()
+
+        count, size = prune_versions.prune("tools.db", dry_run=True)
+        self.assertGreaterEqual(count, 1)
+        self.assertEqual(prune_versions.prune("tools.db"), (count, size))
+        self.assertEqual(prune_versions.prune("tools.db"), (0, 0))
+
+        with litetree.LiteTreeFile("tools.db") as db:
+            keys = [version.key for version in db.page_versions("master")]
+            self.assertNotIn(varint.encode_key(pgno, master.last_commit), keys)
+
+        self.assertEqual(read_all(), before)
+
+
+    def test12_content_stats(self):
+
+        with litetree.LiteTreeFile("tools.db") as db:
+            stats = db.content_stats()
+            contents = {}
+            for branch in db.branches():
+                for version in db.page_versions(branch.name):
+                    contents[bytes(version.data)] = version.size
+            self.assertEqual(stats["page_versions"], sum(db.stats(b.name)["page_versions"] for b in db.branches()))
+            self.assertEqual(stats["unique_contents"], len(contents))
+            self.assertEqual(stats["unique_bytes"], sum(contents.values()))
+            self.assertEqual(stats["duplicate_bytes"], stats["bytes"] - stats["unique_bytes"])
+
+
+    def test13_state_hash(self):
+
+        with litetree.LiteTreeFile("tools.db") as db:
+            master = db.branch("master")
+
+            # full computation for each commit
+            full = {}
+            for commit in range(1, master.last_commit + 1):
+                full[commit] = state_hash.StateHasher(db, "master").move_to(commit)
+            self.assertEqual(len(set(full.values())), len(full))
+
+            # incremental, forward and backward
+            hasher = state_hash.StateHasher(db, "master")
+            commits = list(range(1, master.last_commit + 1))
+            for commit in commits + list(reversed(commits)):
+                self.assertEqual(hasher.move_to(commit), full[commit])
+
+            # all the commits stored on the branch
+            hashes = list(state_hash.StateHasher(db, "master").all_hashes())
+            self.assertListEqual(hashes, [(commit, full[commit]) for commit, max_page in db.commits("master")])
+            for commit, digest in state_hash.StateHasher(db, "par2").all_hashes():
+                self.assertGreater(commit, db.branch("par2").source_commit)
+                self.assertEqual(digest, state_hash.StateHasher(db, "par2").move_to(commit))
+
+            # the same state on another branch has the same hash
+            self.assertEqual(state_hash.StateHasher(db, "par3").move_to(3), full[3])
+            self.assertNotEqual(state_hash.StateHasher(db, "par2").move_to(4), full[4])
+
+            # inclusion proofs
+            hasher.move_to(master.last_commit)
+            num_pages = hasher.tree.num_pages
+            for pgno in range(1, num_pages + 1):
+                page, proof = hasher.proof(pgno)
+                self.assertTrue(state_hash.verify_proof(full[master.last_commit], num_pages, pgno, page, proof))
+                changed = page[:-1] + chr(ord(page[-1]) ^ 1)
+                self.assertFalse(state_hash.verify_proof(full[master.last_commit], num_pages, pgno, changed, proof))
+
+
+    def test14_page_checksums(self):
+
+        delete_files("tools.db-checksums")
+        self.assertRaises(ValueError, page_checksums.verify, "tools.db")
+
+        with litetree.LiteTreeFile("tools.db") as db:
+            total = sum(db.stats(branch.name)["page_versions"] for branch in db.branches())
+            master = db.branch("master")
+
+        self.assertEqual(page_checksums.update("tools.db"), total)
+        self.assertEqual(page_checksums.update("tools.db"), 0)
+
+        result = page_checksums.verify("tools.db", processes=2)
+        self.assertEqual(result, {"checked": total, "unchecked": 0, "errors": []})
+
+        # only the versions visible on the branch
+        result = page_checksums.verify("tools.db", ["par2"])
+        self.assertGreater(result["checked"], 0)
+        self.assertLess(result["checked"], total)
+
+        # corrupt a page version
+        env = litetree.open_env("tools.db", readonly=False)
+        with env.begin(write=True) as txn:
+            db = litetree.open_subdb(env, txn, master.id, 'pages')
+            key = varint.encode_key(1, 1)
+            original = txn.get(key, db=db)
+            txn.put(key, original[:-1] + chr(ord(original[-1]) ^ 1), db=db)
+        env.close()
+
+        result = page_checksums.verify("tools.db", ["par2"], processes=2)
+        self.assertEqual(result["errors"], [("master", 1, 1)])
+        with litetree.LiteTreeFile("tools.db") as db:
+            with page_checksums.ChecksumReader(db, "master.1") as reader:
+                self.assertRaises(ValueError, reader.get_page, 1)
+            with page_checksums.ChecksumReader(db, "master") as reader:
+                self.assertIsNotNone(reader.get_page(2))
+
+        env = litetree.open_env("tools.db", readonly=False)
+        with env.begin(write=True) as txn:
+            db = litetree.open_subdb(env, txn, master.id, 'pages')
+            txn.put(key, original, db=db)
+        env.close()
+        self.assertEqual(page_checksums.verify("tools.db")["errors"], [])
+
+        # a branch truncated and committed again past the watermark
+        import shutil
+        delete_files("trunc.db")
+        delete_files("trunc.db-checksums")
+        shutil.copy("tools.db", "trunc.db")
+        self.assertEqual(page_checksums.update("trunc.db"), total)
+
+        conn = sqlite3.connect('file:trunc.db?branches=on')
+        c = conn.cursor()
+        c.execute("pragma branch=test3")
+        c.execute("pragma branch_truncate(test3.7)")
+        c.execute("insert into t1 values ('third from test3')")
+        conn.commit()
+        c.execute("insert into t1 values ('fourth from test3')")
+        conn.commit()
+        conn.close()
+
+        self.assertGreater(page_checksums.update("trunc.db"), 0)
+        result = page_checksums.verify("trunc.db")
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(result["unchecked"], 0)
+
+
+    def test15_integrity_check(self):
+
+        def check_each_branch():
+            errors = {}
+            with litetree.LiteTreeFile("tools.db") as db:
+                for branch in db.branches():
+                    checker = integrity_check.IntegrityChecker(db)
+                    view, errors[branch.name] = checker.check(branch)
+            return errors
+
+        results = integrity_check.check("tools.db")
+        self.assertListEqual(sorted(result["branch"] for result in results), sorted(check_each_branch().keys()))
+        for result in results:
+            self.assertListEqual(result["errors"], [])
+            self.assertGreater(result["pages"], 0)
+
+        # corrupt the type of a page at the head of master
+        with litetree.LiteTreeFile("tools.db") as db:
+            reader = db.reader("master")
+            reader.get_page(2)
+            branch_id, key = reader.found
+        env = litetree.open_env("tools.db", readonly=False)
+        with env.begin(write=True) as txn:
+            db = litetree.open_subdb(env, txn, branch_id, 'pages')
+            original = txn.get(key, db=db)
+            txn.put(key, '\x00' + original[1:], db=db)
+        env.close()
+
+        results = dict((result["branch"], result["errors"]) for result in integrity_check.check("tools.db"))
+        self.assertIn("page 2: invalid page type 0", results["master"])
+        expected = check_each_branch()
+        for name in expected:
+            self.assertEqual(len(results[name]) > 0, len(expected[name]) > 0)
+
+        env = litetree.open_env("tools.db", readonly=False)
+        with env.begin(write=True) as txn:
+            db = litetree.open_subdb(env, txn, branch_id, 'pages')
+            txn.put(key, original, db=db)
+        env.close()
+        self.assertListEqual([result["errors"] for result in integrity_check.check("tools.db", ["master"])], [[]])
+
+        # a derived branch only reads the pages that differ from its source
+        delete_files("check.db")
+        conn = sqlite3.connect('file:check.db?branches=on')
+        c = conn.cursor()
+        c.execute("create table t1(name)")
+        conn.commit()
+        c.execute("begin")
+        for n in range(2000):
+            c.execute("insert into t1 values (?)", ("row " + str(n) + " " + "x" * 100,))
+        conn.commit()
+        c.execute("pragma new_branch=child at master.2")
+        c.execute("update t1 set name = 'changed' where rowid = 1000")
+        conn.commit()
+        conn.close()
+
+        results = dict((result["branch"], result) for result in integrity_check.check("check.db"))
+        self.assertEqual(results["child"]["errors"], [])
+        self.assertLess(results["child"]["pages_read"], results["child"]["pages"] // 4)
+        with litetree.LiteTreeFile("check.db") as db:
+            checker = integrity_check.IntegrityChecker(db)
+            checker.check(db.branch("child"))
+            self.assertLess(results["child"]["pages_read"], checker.reader.replay_stats["lookups"] // 4)
+
+
+    def test16_flatten_branch(self):
+
+        def read_pages(name):
+            pages = {}
+            with litetree.LiteTreeFile("tools.db") as db:
+                branch = db.branch(name)
+                for commit in range(branch.source_commit + 1, branch.last_commit + 1):
+                    reader = db.reader(name + "." + str(commit))
+                    pages[commit] = [bytes(reader.get_page(pgno)) for pgno in range(1, reader.get_max_page() + 1)]
+            return pages
+
+        def read_rows(name, filename="tools.db"):
+            conn = sqlite3.connect('file:' + filename + '?branches=on')
+            c = conn.cursor()
+            c.execute("pragma branch=" + name)
+            c.execute("select * from t1")
+            rows = c.fetchall()
+            conn.close()
+            return rows
+
+        pages = read_pages("par2")
+        rows = read_rows("par2")
+        self.assertIn(("from par2",), rows)
+
+        # the backup and the checksums are up to date before flattening
+        incremental_backup.export_increment("tools.db", "backup3.json", "backup3.inc1")
+        incremental_backup.apply_increment("backup3.inc1", "backup3.db")
+        page_checksums.update("tools.db")
+
+        with self.assertRaises(ValueError):
+            flatten_branch.flatten("tools.db", "par1")   # no commits
+        with self.assertRaises(ValueError):
+            flatten_branch.flatten("tools.db", "master")
+
+        batch_size = flatten_branch.batch_size
+        flatten_branch.batch_size = 2
+        try:
+            self.assertGreater(flatten_branch.flatten("tools.db", "par2"), 0)
+        finally:
+            flatten_branch.batch_size = batch_size
+        with self.assertRaises(ValueError):
+            flatten_branch.flatten("tools.db", "par2")
+
+        with litetree.LiteTreeFile("tools.db") as db:
+            self.assertEqual(db.branch("par2").source_branch, 0)
+            self.assertEqual(db.stats("par2", pages=True)["shared_pages"], 0)
+        self.assertEqual(read_pages("par2"), pages)
+        self.assertListEqual(read_rows("par2"), rows)
+        self.assertListEqual(integrity_check.check("tools.db", ["par2"])[0]["errors"], [])
+
+        # the copied pages are below the watermarks, the branch is exported
+        # and checked again in full
+        incremental_backup.export_increment("tools.db", "backup3.json", "backup3.inc2")
+        incremental_backup.apply_increment("backup3.inc2", "backup3.db")
+        self.assertListEqual(read_rows("par2", "backup3.db"), rows)
+        self.assertGreater(page_checksums.update("tools.db"), 0)
+        result = page_checksums.verify("tools.db", ["par2"])
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(result["unchecked"], 0)
+
+
+    @classmethod
+    def tearDownClass(self):
+        delete_files("tools.db")
+        delete_files("export.db")
+        delete_files("backup.db")
+        delete_files("backup2.db")
+        delete_files("backup3.db")
+        delete_file("backup3.json")
+        delete_file("backup3.inc1")
+        delete_file("backup3.inc2")
+        delete_files("trunc.db")
+        delete_files("trunc-backup.db")
+        delete_file("trunc.json")
+        delete_file("trunc.inc")
+        delete_files("trunc.db-checksums")
+        delete_files("replica.db")
+        delete_files("portable.db")
+        delete_file("portable.dump")
+        delete_files("tools.db-checksums")
+        delete_files("check.db")
+
+
+if __name__ == '__main__':
+    unittest.main()
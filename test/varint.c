@@ -0,0 +1,126 @@
+/*
+** SQLite4 varint
+**
+** Used by convert-to-64bit.c and, when built as a shared library with
+** `make libvarint`, by varint.py to encode and decode many keys at once.
+**
+** Copyright defined in LICENSE.txt
+*/
+#include <stdint.h>
+#include <stddef.h>
+
+/*
+** Writes a SQLite4 varint. Returns the number of bytes used (max 9)
+*/
+static int putVarint64(unsigned char *z, uint64_t x){
+  int i, n;
+  if( x<=240 ){
+    z[0] = (unsigned char)x;
+    return 1;
+  }
+  if( x<=2287 ){
+    x -= 240;
+    z[0] = (unsigned char)((x>>8)+241);
+    z[1] = (unsigned char)(x&0xff);
+    return 2;
+  }
+  if( x<=67823 ){
+    x -= 2288;
+    z[0] = 249;
+    z[1] = (unsigned char)(x>>8);
+    z[2] = (unsigned char)(x&0xff);
+    return 3;
+  }
+  for(n=3; n<8 && (x>>(n*8))!=0; n++){}
+  z[0] = (unsigned char)(247+n);
+  for(i=n; i>0; i--){
+    z[i] = (unsigned char)(x&0xff);
+    x >>= 8;
+  }
+  return n+1;
+}
+
+/*
+** Reads a SQLite4 varint. Returns the number of bytes used or 0 on error
+*/
+static int getVarint64(const unsigned char *z, size_t n, uint64_t *pResult){
+  int i, nByte;
+  if( n<1 ) return 0;
+  if( z[0]<=240 ){
+    *pResult = z[0];
+    return 1;
+  }
+  if( z[0]<=248 ){
+    if( n<2 ) return 0;
+    *pResult = (z[0]-241)*256 + z[1] + 240;
+    return 2;
+  }
+  if( z[0]==249 ){
+    if( n<3 ) return 0;
+    *pResult = 2288 + 256*z[1] + z[2];
+    return 3;
+  }
+  nByte = z[0]-247;
+  if( n<(size_t)nByte+1 ) return 0;
+  *pResult = 0;
+  for(i=1; i<=nByte; i++){
+    *pResult = (*pResult<<8) | z[i];
+  }
+  return nByte+1;
+}
+
+/*
+** Decodes all the varints stored back to back on the buffer. Returns
+** the number of values written to aValue (at most nMax) or -1 if the
+** buffer ends in the middle of a varint.
+*/
+int varint_decode_many(const unsigned char *z, size_t n, uint64_t *aValue, int nMax){
+  int count = 0;
+  while( n>0 && count<nMax ){
+    int len = getVarint64(z, n, &aValue[count]);
+    if( len==0 ) return -1;
+    z += len;
+    n -= len;
+    count++;
+  }
+  return count;
+}
+
+/*
+** Decodes nKey page keys, varint(pgno) + varint(commit), stored back
+** to back on the buffer with their sizes on aSize. Returns 0 on success
+** or the position+1 of the first invalid key.
+*/
+int varint_decode_keys(
+  const unsigned char *z, const uint32_t *aSize, int nKey,
+  uint64_t *aPgno, uint64_t *aCommit
+){
+  int i;
+  for(i=0; i<nKey; i++){
+    int len = getVarint64(z, aSize[i], &aPgno[i]);
+    if( len==0 || getVarint64(z+len, aSize[i]-len, &aCommit[i])!=(int)aSize[i]-len ){
+      return i+1;
+    }
+    z += aSize[i];
+  }
+  return 0;
+}
+
+/*
+** Encodes nKey page keys. The output buffer must have 18 bytes per key.
+** The size of each key is stored on aSize. Returns the total size.
+*/
+size_t varint_encode_keys(
+  const uint64_t *aPgno, const uint64_t *aCommit, int nKey,
+  unsigned char *zOut, uint32_t *aSize
+){
+  size_t total = 0;
+  int i;
+  for(i=0; i<nKey; i++){
+    int len = putVarint64(zOut+total, aPgno[i]);
+    len += putVarint64(zOut+total+len, aCommit[i]);
+    aSize[i] = len;
+    total += len;
+  }
+  return total;
+}
@@ -1,8 +1,22 @@
 #
 # SQLite4 varint
 #
+# The functions accept any buffer: str, bytes, bytearray, memoryview,
+# lmdb buffers or NumPy uint8 arrays. The batch functions for page keys
+# (varint(pgno) + varint(commit)) use the C implementation when it is
+# built with `make libvarint`
+#
 # Copyright defined in LICENSE.txt
 #
+import os
+import array
+import struct
+import ctypes
+
+_bytes = [struct.pack('B', i) for i in range(256)]
+
+_pack_be64 = struct.Struct('>Q').pack
+
 
 def encode(num):
 
@@ -10,97 +24,212 @@ def encode(num):
         raise ValueError("The number is negative")
 
     if num <= 240:
-        result = chr(num)
+        return _bytes[num]
 
-    elif num <= 2287:
+    if num <= 2287:
         num -= 240
-        result = chr((num >> 8) + 241) + chr(num % 256)
+        return _bytes[(num >> 8) + 241] + _bytes[num & 0xFF]
 
-    elif num <= 67823:
+    if num <= 67823:
         num -= 2288
-        result = chr(249) + chr(num >> 8) + chr(num % 256)
+        return _bytes[249] + _bytes[num >> 8] + _bytes[num & 0xFF]
+
+    if num > 0xFFFFFFFFFFFFFFFF:
+        raise ValueError("The number is bigger than an unsigned 64-bit integer")
 
-    else:
+    # the number in big endian, without the leading zeros
+    num_bytes = max(3, (num.bit_length() + 7) // 8)
+    return _bytes[247 + num_bytes] + _pack_be64(num)[8 - num_bytes:]
 
-        if num > 0xFFFFFFFFFFFFFFFF:
-            raise ValueError("The number is bigger than an unsigned 64-bit integer")
 
-        # convert the 64-bit number to a buffer in big endian
-        buf = ''
-        shift = 56
-        while shift >= 0:
-            buf += chr(num >> shift & 0xFF)
-            shift -= 8
 
-        # check how many zeros in the beginning
-        start = 0
-        for i in range(0, 8):
-            if ord(buf[i]) == 0:
-                start += 1
-            else:
-                break
+def _decode_at(buf, offset):
+    # buf must be a bytearray
+    first = buf[offset]
 
-        # get the number of used bytes
-        num_bytes = 8 - start
+    if first <= 240:
+        return (first, 1)
 
-        # build the result
-        result = chr(247 + num_bytes) + buf[start:8]
+    if first < 249:
+        return (240 + ((first - 241) << 8) + buf[offset + 1], 2)
 
+    if first == 249:
+        return (2288 + (buf[offset + 1] << 8) + buf[offset + 2], 3)
 
-    return result
+    num_bytes = first - 247
+    if len(buf) - offset < num_bytes + 1: raise ValueError("Invalid varint")
+    result = 0
+    for i in range(offset + 1, offset + num_bytes + 1):
+        result = (result << 8) | buf[i]
+
+    return (result, num_bytes + 1)
+
+
+def decode(buf, offset=0):
+    """ returns a tuple (value, num_bytes) """
+    if not isinstance(buf, bytearray):
+        buf = bytearray(buf)
+    try:
+        return _decode_at(buf, offset)
+    except IndexError:
+        raise ValueError("Invalid varint")
 
 
 
-def decode(buf):
+def encode_many(nums):
+    """ encodes the numbers back to back """
+    return b''.join([encode(num) for num in nums])
+
+
+def decode_many(buf):
+    """ decodes all the varints stored back to back on the buffer """
+    buf = bytearray(buf)
+    result = []
+    offset = 0
     size = len(buf)
-    if size < 1: raise ValueError("Invalid varint")
-    first = ord(buf[0])
+    try:
+        while offset < size:
+            value, num_bytes = _decode_at(buf, offset)
+            result.append(value)
+            offset += num_bytes
+    except IndexError:
+        raise ValueError("Invalid varint")
+    return result
 
-    if first <= 240:
-        result = first
-        num_bytes = 1
 
-    elif first < 249:
-        if size < 2: raise ValueError("Invalid varint")
-        second = ord(buf[1])
-        result = 240 + ((first - 241) * 256) + second
-        num_bytes = 2
+def encode_key(pgno, commit):
+    return encode(pgno) + encode(commit)
+
+
+def decode_key(key):
+    """ returns the (pgno, commit) tuple from a page key """
+    key = bytearray(key)
+    try:
+        pgno, size = _decode_at(key, 0)
+        commit, size2 = _decode_at(key, size)
+    except IndexError:
+        raise ValueError("Invalid key")
+    if size + size2 != len(key):
+        raise ValueError("Invalid key")
+    return (pgno, commit)
+
+
+def _py_encode_keys(pgnos, commits):
+    return [encode(pgno) + encode(commit) for pgno, commit in zip(pgnos, commits)]
+
+
+def _py_decode_keys(keys):
+    pgnos = []
+    commits = []
+    for key in keys:
+        pgno, commit = decode_key(key)
+        pgnos.append(pgno)
+        commits.append(commit)
+    return (pgnos, commits)
+
+
+
+# C implementation of the batch functions
+
+_lib = None
+_libpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libvarint.so')
+if os.path.exists(_libpath):
+    try:
+        _lib = ctypes.CDLL(_libpath)
+    except OSError:
+        _lib = None
+
+if _lib is not None:
+    _lib.varint_decode_keys.restype = ctypes.c_int
+    _lib.varint_decode_keys.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint32), ctypes.c_int,
+                                        ctypes.POINTER(ctypes.c_uint64), ctypes.POINTER(ctypes.c_uint64)]
+    _lib.varint_encode_keys.restype = ctypes.c_size_t
+    _lib.varint_encode_keys.argtypes = [ctypes.POINTER(ctypes.c_uint64), ctypes.POINTER(ctypes.c_uint64), ctypes.c_int,
+                                        ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint32)]
+
+
+def _c_encode_keys(pgnos, commits):
+    num = len(pgnos)
+    if len(commits) != num:
+        raise ValueError("The lists have different sizes")
+    for value in pgnos:
+        if value < 0: raise ValueError("The number is negative")
+    for value in commits:
+        if value < 0: raise ValueError("The number is negative")
+    out = ctypes.create_string_buffer(18 * num)
+    sizes = (ctypes.c_uint32 * num)()
+    _lib.varint_encode_keys((ctypes.c_uint64 * num)(*pgnos), (ctypes.c_uint64 * num)(*commits),
+                            num, out, sizes)
+    raw = out.raw
+    result = []
+    offset = 0
+    for size in sizes:
+        result.append(raw[offset:offset + size])
+        offset += size
+    return result
 
-    elif first == 249:
-        if size < 3: raise ValueError("Invalid varint")
-        second = ord(buf[1])
-        third = ord(buf[2])
-        result = 2288 + (second * 256) + third
-        num_bytes = 3
 
-    else:
-        num_bytes = first - 247
-        if size < num_bytes + 1: raise ValueError("Invalid varint")
-        result = ord(buf[1])
-        for i in range(2, num_bytes + 1):
-            result = (result << 8) | ord(buf[i])
-        num_bytes += 1
+def _c_decode_keys(keys):
+    keys = [bytes(key) for key in keys]
+    num = len(keys)
+    sizes = array.array('I', [len(key) for key in keys])
+    sizes = (ctypes.c_uint32 * num).from_buffer(sizes)
+    pgnos = (ctypes.c_uint64 * num)()
+    commits = (ctypes.c_uint64 * num)()
+    if _lib.varint_decode_keys(b''.join(keys), sizes, num, pgnos, commits) != 0:
+        raise ValueError("Invalid key")
+    return (list(pgnos), list(commits))
 
-    return (result, num_bytes)
+
+def encode_keys(pgnos, commits):
+    """ encodes many page keys at once. returns a list of keys """
+    pgnos = list(pgnos)
+    commits = list(commits)
+    if _lib is not None and len(pgnos) > 0:
+        return _c_encode_keys(pgnos, commits)
+    if len(pgnos) != len(commits):
+        raise ValueError("The lists have different sizes")
+    return _py_encode_keys(pgnos, commits)
+
+
+def decode_keys(keys):
+    """ decodes many page keys at once. returns a tuple (pgnos, commits) """
+    keys = list(keys)
+    if _lib is not None and len(keys) > 0:
+        return _c_decode_keys(keys)
+    return _py_decode_keys(keys)
 
 
 
 tests = 0
 
 def test_encode(num):
-    print 'testing ', num
     buf = encode(num)
     num2 = decode(buf)[0]
-    if num2 != num:
-        print "FAILED!!!", num, num2
+    if num2 != num or decode_many(buf + buf) != [num, num]:
+        print("FAILED!!! " + str(num) + " " + str(num2))
         quit()
     global tests
     tests += 1
 
 if __name__ == '__main__':
+    nums = []
+    for num in list(range(0, 70000)) + [0xFFFFFFFFFFFFFFFF]:
+        test_encode(num)
+        nums.append(num)
     num = 11
     while num < 0xFFFFFFFFFFFFFFFF:
         test_encode(num)
+        nums.append(num)
         num *= 3
-    print 'OK'
-    print tests, 'tests'
+    # the encoding must keep the sort order
+    keys = [encode(num) for num in sorted(nums)]
+    assert keys == sorted(keys)
+    # batch of page keys, with the C implementation if available
+    keys = encode_keys(nums, reversed(nums))
+    assert keys == _py_encode_keys(nums, list(reversed(nums)))
+    assert decode_keys(keys) == (nums, list(reversed(nums)))
+    assert _py_decode_keys(keys) == (nums, list(reversed(nums)))
+    print('OK')
+    print(str(tests) + ' tests')
+    print('C implementation: ' + ('yes' if _lib is not None else 'no'))